@@ -0,0 +1,159 @@
+﻿# -*- coding: utf-8 -*-
+"""
+api/access_log.py — escritura de logs fuera del hilo del request
+- AccessLog: access log estructurado (JSONL, una línea por request) en logs/requests.jsonl
+  * el hilo del request solo hace put_nowait de un dict en una cola acotada; si la cola está
+    llena el registro se descarta y se cuenta (fraudchain_access_log_dropped_total): un disco
+    lento nunca frena el scoring
+  * un hilo escritor serializa y escribe en lotes (hasta ACCESS_LOG_BATCH registros o cada
+    ACCESS_LOG_FLUSH_S) con un solo write por lote, y rota por tamaño como RotatingFileHandler
+  * muestreo: errores (status >= 400) y requests lentos (>= ACCESS_LOG_SLOW_MS) siempre;
+    el resto con probabilidad ACCESS_LOG_SAMPLE
+- queued(handler): envuelve un logging.Handler con QueueHandler + QueueListener (lo usa
+  api/chain.py para logs/chain.log)
+- Con api/serve.py cada worker escribe su archivo (requests.<i>.jsonl): la rotación no se
+  coordina entre procesos
+"""
+
+from __future__ import annotations
+import os, json, time, queue, random, atexit, threading, logging
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, List, Optional
+
+from .telemetry import counter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+ACCESS_LOG = os.getenv("ACCESS_LOG") or os.path.join(ROOT, "logs", "requests.jsonl")
+# 0 = sin access log
+ACCESS_LOG_ENABLED = (os.getenv("ACCESS_LOG_ENABLED") or "1") != "0"
+ACCESS_LOG_SAMPLE = float(os.getenv("ACCESS_LOG_SAMPLE") or 1.0)
+ACCESS_LOG_SLOW_MS = float(os.getenv("ACCESS_LOG_SLOW_MS") or 500.0)
+ACCESS_LOG_QUEUE = int(os.getenv("ACCESS_LOG_QUEUE") or 10_000)
+ACCESS_LOG_BATCH = int(os.getenv("ACCESS_LOG_BATCH") or 512)
+ACCESS_LOG_FLUSH_S = float(os.getenv("ACCESS_LOG_FLUSH_S") or 0.5)
+ACCESS_LOG_MAX_BYTES = int(os.getenv("ACCESS_LOG_MAX_BYTES") or 20_000_000)
+ACCESS_LOG_BACKUPS = int(os.getenv("ACCESS_LOG_BACKUPS") or 5)
+
+ACCESS_LOG_RECORDS = counter("fraudchain_access_log_total", "Registros del access log", ("result",))
+
+logger = logging.getLogger("fraudchain.api")
+
+class AccessLog:
+    """Access log JSONL con escritor en background."""
+
+    _STOP = object()
+
+    def __init__(self, path: str = ACCESS_LOG, sample: float = ACCESS_LOG_SAMPLE,
+                 slow_ms: float = ACCESS_LOG_SLOW_MS, queue_size: int = ACCESS_LOG_QUEUE,
+                 batch: int = ACCESS_LOG_BATCH, flush_s: float = ACCESS_LOG_FLUSH_S,
+                 max_bytes: int = ACCESS_LOG_MAX_BYTES, backups: int = ACCESS_LOG_BACKUPS):
+        self.path = path
+        self.sample = min(1.0, max(0.0, float(sample)))
+        self.slow_ms = float(slow_ms)
+        self.batch = max(1, int(batch))
+        self.flush_s = float(flush_s)
+        self.max_bytes = int(max_bytes)
+        self.backups = max(0, int(backups))
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._f = None
+
+    def should_log(self, status: int, latency_ms: float) -> bool:
+        if status >= 400 or latency_ms >= self.slow_ms or self.sample >= 1.0:
+            return True
+        return random.random() < self.sample
+
+    def write(self, record: Dict[str, Any]) -> bool:
+        """Encola sin bloquear; False si la cola está llena (registro descartado)."""
+        self._ensure_writer()
+        try:
+            self._q.put_nowait(record)
+            return True
+        except queue.Full:
+            ACCESS_LOG_RECORDS.labels("dropped").inc()
+            return False
+
+    def _ensure_writer(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="access-log", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Vacía la cola y cierra el archivo (atexit)."""
+        t = self._thread
+        if t is None or not t.is_alive():
+            return
+        try:
+            self._q.put(self._STOP, timeout=timeout)
+        except queue.Full:
+            return
+        t.join(timeout)
+
+    # ---------- hilo escritor ----------
+    def _run(self) -> None:
+        while True:
+            items: List[Any] = [self._q.get()]
+            deadline = time.monotonic() + self.flush_s
+            while len(items) < self.batch and items[-1] is not self._STOP:
+                remaining = deadline - time.monotonic()
+                try:
+                    items.append(self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait())
+                except queue.Empty:
+                    break
+            stop = items[-1] is self._STOP
+            records = [r for r in items if r is not self._STOP]
+            if records:
+                try:
+                    self._write_lines(records)
+                    ACCESS_LOG_RECORDS.labels("written").inc(len(records))
+                except Exception as e:
+                    ACCESS_LOG_RECORDS.labels("error").inc(len(records))
+                    logger.error(f"ACCESS LOG no se pudo escribir {self.path}: {e}")
+                    self._close_file()
+            if stop:
+                self._close_file()
+                return
+
+    def _write_lines(self, records: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":"), default=str) + "\n"
+                       for r in records).encode("utf-8")
+        if self._f is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._f = open(self.path, "ab")
+        if self.max_bytes > 0 and self._f.tell() + len(data) > self.max_bytes and self._f.tell() > 0:
+            self._rotate()
+        self._f.write(data)
+        self._f.flush()
+
+    def _rotate(self) -> None:
+        # requests.jsonl -> .1 -> .2 ... (igual que RotatingFileHandler)
+        self._close_file()
+        if self.backups > 0:
+            for i in range(self.backups - 1, 0, -1):
+                src = f"{self.path}.{i}"
+                if os.path.exists(src):
+                    os.replace(src, f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._f = open(self.path, "ab")
+
+    def _close_file(self) -> None:
+        if self._f is not None:
+            try:
+                self._f.close()
+            finally:
+                self._f = None
+
+def queued(handler: logging.Handler) -> QueueHandler:
+    """El hilo que loguea solo encola; un QueueListener pasa los registros a handler."""
+    q: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    listener = QueueListener(q, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return QueueHandler(q)
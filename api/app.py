@@ -2,63 +2,156 @@
 """
 api/app.py — Flask API (puerto 5000)
 - POST /score  { "features": {col: value, ...}, "tx_ref": "opcional" }
-- Si la decisión es "segura" (score<thr) dispara evento on-chain (sin PII)
+- /score pasa por un micro-batcher (api/batcher.py): requests concurrentes -> un predict
+- Lotes chicos se evalúan con el bosque empaquetado (api/forest.py), no con sklearn
+- Modelo/umbral desde models/registry/ (api/registry.py): una versión nueva se carga y calienta
+  en background y se intercambia sin reiniciar; cada respuesta lleva model_version
+- POST /score/batch  { "transactions": [{"features": {...}, "tx_ref": "..."}, ...] }
+  (una sola matriz float32 y un único predict_proba para todo el lote)
+- Si la decisión es "segura" (score<thr) se encola en el outbox (api/outbox.py) y un
+  submitter en background emite el evento on-chain (sin PII); la respuesta no espera el receipt
+  (en lotes de N decisiones por tx si el contrato desplegado lo soporta)
+- GET /onchain/<decision_id> para consultar el estado del registro on-chain
 - /health para diagnóstico (RPC y contrato)
+- CHAIN_BACKEND=local: cadena en memoria en vez de RPC_URL (api/local_chain.py). El proceso
+  con el submitter la sigue con el indexer (api/indexer.py) hacia state/index.local.sqlite,
+  que es lo que muestra el dashboard (en local no hay events.csv)
+- GET /metrics: formato Prometheus (api/telemetry.py). Latencia por etapa de /score y
+  /score/batch (parse, vectorize, predict, hash, enqueue), del micro-batcher y de la cadena;
+  decisiones secure/fraud, reintentos y skips on-chain; filas del outbox por estado
+- Arranque sin red: la cadena se conecta recién cuando el outbox envía (api/chain.py). Sin RPC
+  el API puntúa igual, las decisiones quedan "pending" y /health informa degraded=true
 """
 
-import json, os, time, glob, hashlib
-from typing import Dict, Any
-from flask import Flask, request, jsonify
-from joblib import load
+import os, math, time, hashlib, threading
+from typing import Dict, Any, List, Optional
+from flask import Flask, Response, request, jsonify
 import numpy as np
-import pandas as pd
 
-from .logging_mw import request_logger
-from .chain import register_secure_tx, CONTRACT_ADDRESS, w3
+from .logging_mw import annotate, request_logger
+from .chain import (send_secure_tx, send_secure_batch, get_receipt, record_event, has_batch, chain_status,
+                    mined_nonce, state_path, CHAIN_BACKEND, CONTRACT_ADDRESS)
+from .batcher import MicroBatcher
+from .outbox import Outbox, OUTBOX_DB
+from .registry import ModelBundle, ModelRegistry
+from .telemetry import CONTENT_TYPE, counter, gauge, on_collect, render, stage
 
-ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-MODELS_DIR = os.path.join(ROOT, "models")
-REPORTS_DIR = os.path.join(ROOT, "reports")
+# Máximo de filas por llamada a /score/batch (protege memoria y tiempo de request)
+MAX_BATCH_ROWS = int(os.getenv("MAX_BATCH_ROWS") or 10_000)
+# Micro-batching de /score (BATCH_MAX_SIZE / BATCH_MAX_WAIT_MS en api/batcher.py); 0 = desactivado
+BATCHING_ENABLED = (os.getenv("BATCHING_ENABLED") or "1") != "0"
 
 app = Flask(__name__)
 request_logger(app)
 
-_model = None
-_features = None
-_threshold = None
-
-def _load_model_and_meta():
-    global _model, _features, _threshold
-    if _model is None:
-        _model = load(os.path.join(MODELS_DIR, "model.joblib"))
-    if _features is None:
-        with open(os.path.join(MODELS_DIR, "features.json"), "r", encoding="utf-8") as f:
-            _features = json.load(f)["features"]
-    if _threshold is None:
-        # Tomar el umbral del último rf_*.json
-        paths = sorted(glob.glob(os.path.join(REPORTS_DIR, "rf_*.json")))
-        if not paths:
-            raise RuntimeError("No se encontró reports/rf_*.json con el umbral")
-        with open(paths[-1], "r", encoding="utf-8") as f:
-            rep = json.load(f)
-        _threshold = float(rep["threshold"]["value"])
-
-def _vectorize(feats: Dict[str, Any]) -> np.ndarray:
+# Bundle de modelo vigente (FOREST_ENGINE / PACKED_MAX_ROWS / REGISTRY_POLL_S en api/registry.py)
+_registry = ModelRegistry()
+# Cada fila se puntúa con el bundle que estaba vigente cuando llegó su request
+_batcher = MicroBatcher(lambda X, b: b.scores(X)) if BATCHING_ENABLED else None
+# Envío en pipeline: el outbox manda sin esperar y confirma receipts fuera de orden;
+# si el contrato tiene registerSecureTxBatch, ancla en lotes (OUTBOX_BATCH_SIZE / OUTBOX_BATCH_MAX_AGE_S).
+# has_batch() solo lee abi/ del disco: no conecta al RPC. Con CHAIN_BACKEND=local el outbox es otro archivo
+_outbox = Outbox(send_secure_tx, get_receipt, on_confirmed=record_event, path=state_path(OUTBOX_DB),
+                 send_batch_fn=send_secure_batch if has_batch() else None, nonce_fn=mined_nonce)
+
+DECISIONS = counter("fraudchain_decisions_total", "Decisiones de scoring", ("decision",))
+OUTBOX_ROWS = gauge("fraudchain_outbox_rows", "Filas del outbox por estado", ("status",))
+CHAIN_DEGRADED = gauge("fraudchain_chain_degraded", "1 si el submitter no llega a la cadena (modo degradado)")
+MODEL_INFO = gauge("fraudchain_model_info", "Versión de modelo servida", ("version", "engine"))
+MODEL_SWAPS = gauge("fraudchain_model_swaps", "Cambios de versión en caliente desde el arranque")
+
+def _collect_metrics() -> None:
+    # Estado que se lee recién al exportar: nada de esto se toca en el camino de /score
+    OUTBOX_ROWS.clear()
+    for status, n in _outbox.stats().items():
+        OUTBOX_ROWS.labels(status).set(n)
+    CHAIN_DEGRADED.set(1 if _outbox.unavailable_since is not None else 0)
+    m = _registry.stats()
+    MODEL_INFO.clear()
+    if m.get("version"):
+        MODEL_INFO.labels(m["version"], m["engine"]).set(1)
+    MODEL_SWAPS.set(m["swaps"])
+
+on_collect(_collect_metrics)
+
+def _vectorize(feats: Dict[str, Any], features: List[str]) -> np.ndarray:
     # Asegurar orden y tipos
-    row = [float(feats.get(col, 0.0)) for col in _features]
+    row = [float(feats.get(col, 0.0)) for col in features]
     return np.array(row, dtype=np.float32).reshape(1, -1)
 
+def _vectorize_many(rows: List[Dict[str, Any]], features: List[str]) -> np.ndarray:
+    """Matriz (n, d) float32 C-contigua en el orden de features del modelo."""
+    X = np.empty((len(rows), len(features)), dtype=np.float32)
+    for i, feats in enumerate(rows):
+        X[i] = [float(feats.get(col, 0.0)) for col in features]
+    return X
+
+def _bad_request(detail: str):
+    return jsonify({"status": "error", "detail": detail}), 400
+
+_F32_MAX = float(np.finfo(np.float32).max)
+
+def _check_tx(t: Any, where: str, require_features: bool = True) -> Optional[str]:
+    """Error de una transacción ({"features": {col: número}, "tx_ref": "..."}) o None si está bien."""
+    if not isinstance(t, dict):
+        return f"{where}: se espera un objeto"
+    feats = t.get("features")
+    if not isinstance(feats, dict) and (require_features or feats is not None):
+        return f"{where}: 'features' debe ser un objeto"
+    for col, v in (feats or {}).items():
+        # bool es int en Python; null / strings / NaN / inf / fuera de float32 no se puntúan
+        if isinstance(v, bool) or not isinstance(v, (int, float)) or abs(v) > _F32_MAX or not math.isfinite(v):
+            return f"{where}: features['{col}'] debe ser un número finito"
+    if not isinstance(t.get("tx_ref") or "", str):
+        return f"{where}: 'tx_ref' debe ser string"
+    return None
+
+def _decision_id(vec: np.ndarray, b: ModelBundle) -> str:
+    # decision_id: hash del vector (1, d) + threshold + versión -> mismo id en /score y /score/batch
+    digest_dec = hashlib.sha256((str(vec.tolist()) + str(b.threshold) + b.version).encode("utf-8")).hexdigest()
+    return "0x" + digest_dec[:64]
+
+def _tx_ref_hash(tx_ref: str) -> str:
+    # txRefHash: hash de tx_ref (si no hay, hash del timestamp)
+    base_txref = tx_ref or f"ts:{time.time_ns()}"
+    digest_tx = hashlib.sha256(base_txref.encode("utf-8")).hexdigest()
+    return "0x" + digest_tx[:64]
+
+def start_local_indexer() -> None:
+    """CHAIN_BACKEND=local: la cadena vive en este proceso; nadie más puede indexarla."""
+    if CHAIN_BACKEND != "local" or not _outbox.submitter:
+        return
+    from .indexer import connect
+    idx = connect()
+    idx.index.clear()  # índice de una cadena anterior (en memoria, ya no existe)
+    threading.Thread(target=idx.follow, name="local-indexer", daemon=True).start()
+
+def _onchain_view(entry: Dict[str, Any]) -> Dict[str, Any]:
+    # Vista compacta de una fila del outbox para las respuestas de scoring
+    out = {"status": entry["status"]}
+    if entry.get("tx_hash"):
+        out.update({"tx_hash": entry["tx_hash"], "blockNumber": entry["block_number"]})
+    return out
+
 @app.get("/health")
 def health():
     try:
-        _load_model_and_meta()
-        rpc_ok = bool(w3.is_connected())
+        b = _registry.current()
+        chain = chain_status()
         return jsonify({
             "status": "ok",
-            "rpc_connected": rpc_ok,
+            "chain_backend": CHAIN_BACKEND,
+            "rpc_connected": chain["rpc_connected"],
+            "degraded": chain["degraded"],
+            "chain_error": chain["last_error"],
             "contract_address": CONTRACT_ADDRESS,
-            "features": len(_features),
-            "threshold": _threshold
+            "features": len(b.features),
+            "threshold": b.threshold,
+            "engine": b.engine,
+            "model_version": b.version,
+            "model": _registry.stats(),
+            "batcher": _batcher.stats() if _batcher else None,
+            "outbox": _outbox.stats()
         })
     except Exception as e:
         return jsonify({"status": "error", "detail": str(e)}), 500
@@ -71,42 +164,43 @@ def score():
     Respuesta:
     {
       "score": float, "label": 0|1, "secure": bool,
-      "decision_id": "0x..", "tx_ref_hash": "0x..",
-      "onchain": {"tx_hash":"0x..","blockNumber":N} | {"skipped":True} | null
+      "decision_id": "0x..", "tx_ref_hash": "0x..", "model_version": "...",
+      "onchain": {"status":"pending"} | {"status":"confirmed","tx_hash":"0x..","blockNumber":N} | null
     }
     """
     t0 = time.perf_counter()
-    _load_model_and_meta()
+    # Un request usa un solo bundle de principio a fin aunque haya un swap en el medio
+    b = _registry.current()
 
-    data = request.get_json(force=True) or {}
+    with stage("score", "parse"):
+        data = request.get_json(force=True)
+    err = _check_tx(data, "body", require_features=False)
+    if err:
+        return _bad_request(err)
     feats = data.get("features") or {}
     tx_ref = data.get("tx_ref") or ""
 
-    vec = _vectorize(feats)
-    # Probabilidad de clase 1 (fraude)
-    if hasattr(_model, "predict_proba"):
-        score = float(_model.predict_proba(vec)[:,1][0])
-    else:
-        # Normalizo decision_function a [0,1] si hiciera falta
-        s = float(_model.decision_function(vec)[0])
-        score = (s - (-10.0)) / (10.0 - (-10.0))
+    with stage("score", "vectorize"):
+        vec = _vectorize(feats, b.features)
+    # Probabilidad de clase 1 (fraude); con micro-batching incluye la espera en cola
+    with stage("score", "predict"):
+        score = _batcher.submit(vec, b) if _batcher else float(b.scores(vec)[0])
 
-    label = int(score >= _threshold)  # 1 = fraude
+    label = int(score >= b.threshold)  # 1 = fraude
     secure = bool(label == 0)
+    DECISIONS.labels("secure" if secure else "fraud").inc()
 
     # decision_id y txRefHash (sin PII): 32 bytes a partir de hash SHA256
-    # decision_id: hash del vector + threshold + model path
-    digest_dec = hashlib.sha256((str(vec.tolist()) + str(_threshold)).encode("utf-8")).hexdigest()
-    decision_id = "0x" + digest_dec[:64]
-    # txRefHash: hash de tx_ref (si no hay, hash del timestamp)
-    base_txref = tx_ref or f"ts:{time.time_ns()}"
-    digest_tx = hashlib.sha256(base_txref.encode("utf-8")).hexdigest()
-    tx_ref_hash = "0x" + digest_tx[:64]
+    with stage("score", "hash"):
+        decision_id = _decision_id(vec, b)
+        tx_ref_hash = _tx_ref_hash(tx_ref)
 
     onchain = None
     if secure:
-        # Llamar al contrato (idempotente a nivel app)
-        onchain = register_secure_tx(decision_id, tx_ref_hash)
+        # Encolar en el outbox (idempotente por decision_id); no bloquea por el receipt
+        with stage("score", "enqueue"):
+            onchain = _onchain_view(_outbox.enqueue(decision_id, tx_ref_hash))
+    annotate(decision_id=decision_id, model_version=b.version, secure=secure)
 
     dt_ms = (time.perf_counter() - t0)*1000.0
     return jsonify({
@@ -115,12 +209,102 @@ def score():
         "secure": secure,
         "decision_id": decision_id,
         "tx_ref_hash": tx_ref_hash,
+        "model_version": b.version,
         "latency_ms": dt_ms,
         "onchain": onchain
     })
 
+@app.post("/score/batch")
+def score_batch():
+    """
+    Request:
+    { "transactions": [ {"features": {col:value,...}, "tx_ref": "opcional"}, ... ] }
+    Respuesta:
+    {
+      "n": N, "latency_ms": float, "model_version": "...",
+      "results": [ {"score", "label", "secure", "decision_id", "tx_ref_hash", "onchain"}, ... ]
+    }
+    Un único predict_proba sobre la matriz (N, d); el orden de results = orden de entrada.
+    Body que no es objeto o transactions[i] sin "features" objeto, o con un valor que no es un
+    número finito -> 400 con "index": i y la feature en "detail" (413 si N > MAX_BATCH_ROWS).
+    """
+    t0 = time.perf_counter()
+    b = _registry.current()
+
+    with stage("score_batch", "parse"):
+        data = request.get_json(force=True)
+    if not isinstance(data, dict):
+        return _bad_request("body: se espera un objeto")
+    txs = data.get("transactions")
+    if not isinstance(txs, list) or not txs:
+        return _bad_request("Se espera 'transactions' como lista no vacía")
+    if len(txs) > MAX_BATCH_ROWS:
+        return jsonify({"status": "error", "detail": f"Máximo {MAX_BATCH_ROWS} transacciones por lote"}), 413
+    for i, t in enumerate(txs):
+        err = _check_tx(t, f"transactions[{i}]")
+        if err:
+            return jsonify({"status": "error", "detail": err, "index": i}), 400
+
+    with stage("score_batch", "vectorize"):
+        X = _vectorize_many([t["features"] for t in txs], b.features)
+    with stage("score_batch", "predict"):
+        scores = b.scores(X)
+    labels = (scores >= b.threshold).astype(np.int8)
+
+    results = []
+    with stage("score_batch", "hash"):
+        for i, t in enumerate(txs):
+            label = int(labels[i])
+            results.append({
+                "score": float(scores[i]),
+                "label": label,
+                "secure": bool(label == 0),
+                "decision_id": _decision_id(X[i:i+1], b),
+                "tx_ref_hash": _tx_ref_hash(t.get("tx_ref") or ""),
+                "onchain": None
+            })
+
+    # Todas las decisiones seguras del lote van al outbox en una sola transacción
+    secure_rows = [r for r in results if r["secure"]]
+    DECISIONS.labels("secure").inc(len(secure_rows))
+    DECISIONS.labels("fraud").inc(len(results) - len(secure_rows))
+    with stage("score_batch", "enqueue"):
+        entries = _outbox.enqueue_many([(r["decision_id"], r["tx_ref_hash"]) for r in secure_rows])
+    annotate(n=len(results), secure=len(secure_rows), model_version=b.version)
+    for r in secure_rows:
+        r["onchain"] = _onchain_view(entries[r["decision_id"]])
+
+    dt_ms = (time.perf_counter() - t0)*1000.0
+    return jsonify({"n": len(results), "latency_ms": dt_ms, "model_version": b.version, "results": results})
+
+@app.get("/metrics")
+def metrics():
+    """Métricas del proceso en formato de texto Prometheus."""
+    return Response(render(), content_type=CONTENT_TYPE)
+
+@app.get("/onchain/<decision_id>")
+def onchain_status(decision_id: str):
+    """Estado del registro on-chain de una decisión: pending|sending|confirmed|skipped|failed."""
+    entry = _outbox.status(decision_id)
+    if entry is None:
+        return jsonify({"status": "unknown", "decision_id": decision_id}), 404
+    return jsonify({
+        "decision_id": entry["decision_id"],
+        "tx_ref_hash": entry["tx_ref_hash"],
+        "status": entry["status"],
+        "attempts": entry["attempts"],
+        "tx_hash": entry["tx_hash"],
+        "blockNumber": entry["block_number"],
+        "last_error": entry["last_error"],
+        "created_at": entry["created_at"],
+        "updated_at": entry["updated_at"]
+    })
+
 if __name__ == "__main__":
     # Puerto 5000; si hay colisión, usa 5050 y abrí el firewall (privada)
+    _outbox.start()  # recupera pendientes de una ejecución anterior
+    start_local_indexer()
+    _registry.current()  # carga + calentamiento antes de aceptar tráfico; arranca el watcher
     app.run(host="127.0.0.1", port=5000, debug=False)
 
 
@@ -0,0 +1,148 @@
+﻿# -*- coding: utf-8 -*-
+"""
+api/batcher.py — micro-batching dinámico delante del modelo
+- Los handlers llaman submit(vec) y esperan su score (contrato de /score intacto)
+- Un worker junta las filas en cola y hace UN predict por lote cuando:
+  * el lote llega a max_batch, o
+  * la fila más vieja esperó max_wait_ms
+- Cada fila viaja con su contexto (el bundle de modelo vigente al llegar el request): un lote
+  que cruza un swap de versión se parte en un predict por contexto
+- Contadores: distribución de tamaños de lote y espera en cola (ms); además alimenta
+  fraudchain_stage_seconds{op="batcher"} (queue_wait por fila, predict por lote) y
+  fraudchain_batch_rows (api/telemetry.py)
+"""
+
+from __future__ import annotations
+import os, time, queue, threading
+from typing import Callable, Dict, Any, List, Optional
+import numpy as np
+
+from .telemetry import STAGE_SECONDS, TELEMETRY_ENABLED, histogram, stage
+
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE") or 64)
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS") or 2.0)
+
+# Buckets fijos (límite superior inclusivo) para el histograma de tamaños de lote
+_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+BATCH_ROWS = histogram("fraudchain_batch_rows", "Filas por lote del micro-batcher", buckets=_SIZE_BUCKETS)
+_QUEUE_WAIT = STAGE_SECONDS.labels("batcher", "queue_wait")
+
+class _Pending:
+    __slots__ = ("vec", "ctx", "t_enq", "done", "score", "error")
+
+    def __init__(self, vec: np.ndarray, ctx: Any = None):
+        self.vec = vec
+        self.ctx = ctx
+        self.t_enq = time.perf_counter()
+        self.done = threading.Event()
+        self.score: Optional[float] = None
+        self.error: Optional[BaseException] = None
+
+class MicroBatcher:
+    """
+    Coalesce requests concurrentes en una sola llamada a predict_fn.
+    predict_fn(X: (n, d) float32, ctx) -> (n,) scores
+    """
+
+    def __init__(self, predict_fn: Callable[[np.ndarray, Any], np.ndarray],
+                 max_batch: int = BATCH_MAX_SIZE, max_wait_ms: float = BATCH_MAX_WAIT_MS):
+        self.predict_fn = predict_fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._q: "queue.Queue[_Pending]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        # contadores
+        self._size_hist = [0] * (len(_SIZE_BUCKETS) + 1)
+        self._batches = 0
+        self._rows = 0
+        self._wait_sum_ms = 0.0
+        self._wait_max_ms = 0.0
+
+    def _ensure_worker(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, vec: np.ndarray, ctx: Any = None, timeout: Optional[float] = 30.0) -> float:
+        """Encola una fila (1, d) y bloquea hasta tener su score (calculado con ctx)."""
+        self._ensure_worker()
+        p = _Pending(vec, ctx)
+        self._q.put(p)
+        if not p.done.wait(timeout):
+            raise TimeoutError("micro-batcher: timeout esperando score")
+        if p.error is not None:
+            raise p.error
+        return float(p.score)
+
+    def _collect(self) -> List[_Pending]:
+        batch = [self._q.get()]
+        deadline = batch[0].t_enq + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            t_flush = time.perf_counter()
+            groups: Dict[int, List[_Pending]] = {}
+            for p in batch:
+                groups.setdefault(id(p.ctx), []).append(p)
+            try:
+                for group in groups.values():
+                    self._predict(group)
+            finally:
+                self._record(batch, t_flush)
+                for p in batch:
+                    p.done.set()
+
+    def _predict(self, group: List[_Pending]) -> None:
+        try:
+            X = np.vstack([p.vec for p in group]).astype(np.float32, copy=False)
+            with stage("batcher", "predict"):
+                scores = self.predict_fn(X, group[0].ctx)
+            for p, s in zip(group, scores):
+                p.score = float(s)
+        except BaseException as e:  # el error se propaga a cada request del grupo
+            for p in group:
+                p.error = e
+
+    def _record(self, batch: List[_Pending], t_flush: float) -> None:
+        n = len(batch)
+        waits = [(t_flush - p.t_enq) * 1000.0 for p in batch]
+        BATCH_ROWS.observe(n)
+        if TELEMETRY_ENABLED:
+            for w in waits:
+                _QUEUE_WAIT.observe(w / 1000.0)
+        idx = next((i for i, b in enumerate(_SIZE_BUCKETS) if n <= b), len(_SIZE_BUCKETS))
+        with self._lock:
+            self._size_hist[idx] += 1
+            self._batches += 1
+            self._rows += n
+            self._wait_sum_ms += sum(waits)
+            self._wait_max_ms = max(self._wait_max_ms, max(waits))
+
+    def stats(self) -> Dict[str, Any]:
+        lo = [1] + [b + 1 for b in _SIZE_BUCKETS[:-1]]
+        labels = [str(b) if a == b else f"{a}-{b}" for a, b in zip(lo, _SIZE_BUCKETS)] + [f">{_SIZE_BUCKETS[-1]}"]
+        with self._lock:
+            return {
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self._batches,
+                "rows": self._rows,
+                "avg_batch_size": (self._rows / self._batches) if self._batches else 0.0,
+                "batch_size_hist": dict(zip(labels, self._size_hist)),
+                "queue_wait_avg_ms": (self._wait_sum_ms / self._rows) if self._rows else 0.0,
+                "queue_wait_max_ms": self._wait_max_ms,
+                "queue_depth": self._q.qsize(),
+            }
@@ -2,20 +2,52 @@
 """
 api/chain.py — Web3.py v6 EIP-1559
 - Lee .env (RPC_URL, CHAIN_ID, PRIVATE_KEY, CONTRACT_ADDRESS)
-- register_secure_tx(decision_id_hex, tx_ref_hash_hex) con firma local
-- Reintentos y logs; idempotencia por decision_id en events.csv
+- register_secure_tx(decision_id_hex, tx_ref_hash_hex) con firma local (envío + espera del receipt)
+- send_secure_tx / get_receipt / record_event: envío sin esperar, para tener muchas tx en vuelo
+  (los usa el outbox, que confirma fuera de orden)
+- send_secure_batch: N decisiones en UNA tx vía registerSecureTxBatch (si el ABI desplegado
+  la tiene; has_batch()). El outbox decide cuándo vaciar el lote (tamaño / antigüedad)
+- Gas calibrado una vez por (contrato, ABI) en GasCache (lineal base + n·por_ítem para lotes);
+  se recalibra por TTL o ante out-of-gas. Fees EIP-1559 en FeeCache: estáticas (Ganache) o
+  leídas de eth_feeHistory cada FEE_REFRESH_S; ninguna de las dos es un RPC por tx
+- Nonces asignados localmente (NonceManager): una sola lectura de la cadena y resync ante
+  errores de nonce (too low / too high)
+- Reenvío con el MISMO nonce (nonce=, bump=): el outbox rehace una tx sin receipt con fees
+  subidas FEE_BUMP_PCT% por reenvío, así solo una copia puede minarse; mined_nonce() le dice
+  si ese nonce ya se usó. Si send_raw_transaction falla por red (timeout), la tx pudo llegar
+  al mempool: se devuelve como enviada (hash calculado localmente) y no se gasta otro nonce
+- Reintentos y logs; idempotencia por decision_id en un store indexado (api/event_store.py),
+  que además espeja cada evento en events.csv para el dashboard
+- Conexión perezosa: importar el módulo no toca la red ni la clave. Web3, contrato y cuenta se
+  arman en el primer uso (_client); si el RPC no responde o falta configuración se lanza
+  ChainUnavailable y no se reintenta antes de CHAIN_RETRY_S. El API puntúa igual y el outbox
+  retiene las escrituras hasta que la cadena vuelva (modo degradado)
+- Telemetría (api/telemetry.py): fraudchain_stage_seconds{op="chain"} por etapa (connect,
+  idempotency, gas, fees, nonce, sign, send, receipt) y contadores de tx enviadas, reintentos
+  (nonce / gas / sync) y skips por idempotencia
+- logs/chain.log se escribe desde un hilo aparte (QueueHandler, api/access_log.py)
+- CHAIN_BACKEND=rpc (por defecto) habla con RPC_URL; CHAIN_BACKEND=local usa el nodo en memoria
+  de api/local_chain.py (sin Ganache: CI y benchmarks del camino on-chain). En local, PRIVATE_KEY
+  y CONTRACT_ADDRESS tienen valores de desarrollo, el ABI es el del contrato que ejecuta el nodo
+  (no abi/, que describe el deploy real) y el estado (outbox, eventos) va a archivos
+  *.local.sqlite sin espejo en events.csv, para no mezclarse con la cadena real
 - NUNCA imprime PRIVATE_KEY
 """
 
 from __future__ import annotations
-import json, os, time, csv, logging
+import json, os, time, hashlib, logging, threading, functools
 from logging.handlers import RotatingFileHandler
-from typing import Dict, Any, Optional
+from typing import TYPE_CHECKING, Callable, Dict, Any, List, Optional, Tuple
 
 from dotenv import load_dotenv
-from web3 import Web3
-from eth_account import Account
-from eth_account.signers.local import LocalAccount
+
+from .event_store import EventStore, EVENTS_DB
+from .access_log import queued
+from .outbox import BackendUnavailable
+from .telemetry import counter, stage
+
+if TYPE_CHECKING:  # web3 / eth_account se importan recién al conectar (~1s de import)
+    from eth_account.signers.local import LocalAccount
 
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 LOGS_DIR = os.path.join(ROOT, "logs")
@@ -30,34 +62,184 @@ logger.setLevel(logging.INFO)
 _handler = RotatingFileHandler(os.path.join(LOGS_DIR, "chain.log"), maxBytes=2_000_000, backupCount=2, encoding="utf-8")
 _formatter = logging.Formatter("%(asctime)s | %(levelname)s | %(message)s")
 _handler.setFormatter(_formatter)
-logger.addHandler(_handler)
+# El archivo lo escribe un QueueListener: quien loguea (request o submitter) solo encola
+logger.addHandler(queued(_handler))
 
 # --- env ---
 load_dotenv(os.path.join(ROOT, ".env"))
-RPC_URL = os.getenv("RPC_URL", "http://127.0.0.1:8545")
+# "rpc": nodo real en RPC_URL | "local": cadena en memoria del proceso (api/local_chain.py)
+CHAIN_BACKEND = (os.getenv("CHAIN_BACKEND") or "rpc").lower()
+if CHAIN_BACKEND not in ("rpc", "local"):
+    raise RuntimeError(f"CHAIN_BACKEND={CHAIN_BACKEND} inválido (rpc | local)")
+if CHAIN_BACKEND == "local":  # importa web3 al arrancar; solo para CI / benchmarks
+    from .local_chain import LOCAL_DEV_KEY, LOCAL_CONTRACT, TXREGISTRY_ABI
+else:
+    LOCAL_DEV_KEY = LOCAL_CONTRACT = ""
+RPC_URL = os.getenv("RPC_URL", "http://127.0.0.1:8545") if CHAIN_BACKEND == "rpc" else "local"
 CHAIN_ID = int(os.getenv("CHAIN_ID") or 1337)
-PRIVATE_KEY = os.getenv("PRIVATE_KEY") or ""
-CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS") or ""
+PRIVATE_KEY = os.getenv("PRIVATE_KEY") or LOCAL_DEV_KEY
+CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS") or LOCAL_CONTRACT
+# Gas: validez de la calibración y colchón sobre lo estimado
+GAS_CACHE_TTL_S = float(os.getenv("GAS_CACHE_TTL_S") or 600.0)
+GAS_MARGIN = float(os.getenv("GAS_MARGIN") or 1.2)
+# Fees: "static" (valores fijos, Ganache) | "history" (eth_feeHistory, refresco cada FEE_REFRESH_S)
+FEE_SOURCE = os.getenv("FEE_SOURCE") or "static"
+FEE_REFRESH_S = float(os.getenv("FEE_REFRESH_S") or 15.0)
+# Reemplazo de una tx pendiente (mismo nonce): geth exige al menos +10% en ambas fees
+FEE_BUMP_PCT = int(os.getenv("FEE_BUMP_PCT") or 15)
+# Conexión: timeout por llamada RPC y espera mínima entre intentos mientras la cadena no responde
+RPC_TIMEOUT_S = float(os.getenv("RPC_TIMEOUT_S") or 10.0)
+CHAIN_RETRY_S = float(os.getenv("CHAIN_RETRY_S") or 5.0)
+
+CHAIN_TX = counter("fraudchain_chain_tx_total", "Transacciones enviadas al contrato", ("fn",))
+CHAIN_RETRIES = counter("fraudchain_chain_retries_total", "Reintentos dentro de api/chain.py", ("reason",))
+CHAIN_SKIPS = counter("fraudchain_chain_skips_total", "Decisiones ya registradas que no se envían")
+
+class ChainUnavailable(BackendUnavailable):
+    """RPC caído o .env incompleto: las escrituras esperan en el outbox hasta que vuelva."""
+
+_abi_info: Optional[Dict[str, Any]] = None
+
+def _abi() -> Dict[str, Any]:
+    """ABI desplegado + si tiene registerSecureTxBatch + hash (clave del GasCache). Solo disco."""
+    global _abi_info
+    if _abi_info is None:
+        if CHAIN_BACKEND == "local":
+            abi = TXREGISTRY_ABI
+        else:
+            with open(os.path.join(ABI_DIR, "TxRegistry.json"), "r", encoding="utf-8") as f:
+                abi = json.load(f)
+        _abi_info = {
+            "abi": abi,
+            "has_batch": any(e.get("type") == "function" and e.get("name") == "registerSecureTxBatch" for e in abi),
+            "hash": hashlib.sha256(json.dumps(abi, sort_keys=True).encode("utf-8")).hexdigest()[:16],
+        }
+    return _abi_info
+
+def has_batch() -> bool:
+    """Contratos desplegados antes de registerSecureTxBatch siguen funcionando (una tx por decisión)."""
+    try:
+        return bool(_abi()["has_batch"])
+    except (OSError, ValueError):
+        return False  # sin abi/ todavía (falta el deploy): envío de a una
+
+class _Client:
+    """Web3 + contrato + cuenta local, listos para firmar. Lo arma _client() una sola vez."""
+
+    def __init__(self):
+        from web3 import Web3
+        from eth_account import Account
+        if not (PRIVATE_KEY.startswith("0x") and len(PRIVATE_KEY) == 66):
+            raise RuntimeError("PRIVATE_KEY inválida. Debe empezar con 0x y tener 64 hex.")
+        if not (CONTRACT_ADDRESS.startswith("0x") and len(CONTRACT_ADDRESS) == 42):
+            raise RuntimeError("CONTRACT_ADDRESS inválida. Asegúrate de haber hecho el deploy y actualizado .env.")
+        abi = _abi()["abi"]
+        if CHAIN_BACKEND == "local":
+            from .local_chain import LocalProvider
+            self.w3 = Web3(LocalProvider())
+        else:
+            self.w3 = Web3(Web3.HTTPProvider(RPC_URL, request_kwargs={"timeout": RPC_TIMEOUT_S}))
+        if not self.w3.is_connected():
+            raise RuntimeError(f"No conecta a RPC_URL={RPC_URL}")
+        self.contract = self.w3.eth.contract(address=Web3.to_checksum_address(CONTRACT_ADDRESS), abi=abi)
+        # --- cuenta local (NO imprimir nunca la clave) ---
+        self.account: LocalAccount = Account.from_key(PRIVATE_KEY)
+        self.sender = self.account.address
+
+_client_lock = threading.Lock()
+_conn: Optional[_Client] = None
+_conn_error: Optional[str] = None
+_next_try = 0.0
+
+def _client() -> _Client:
+    """Conexión a la cadena, creada en el primer uso; ChainUnavailable si no se puede."""
+    global _conn, _conn_error, _next_try
+    c = _conn
+    if c is not None:
+        return c
+    with _client_lock:
+        if _conn is None:
+            if time.time() < _next_try:
+                raise ChainUnavailable(_conn_error or "cadena no disponible")
+            t0 = time.perf_counter()
+            try:
+                with stage("chain", "connect"):
+                    _conn = _Client()
+            except Exception as e:
+                _conn_error, _next_try = str(e), time.time() + CHAIN_RETRY_S
+                logger.warning(f"CHAIN no disponible ({e}); próximo intento en {CHAIN_RETRY_S:.0f}s")
+                raise ChainUnavailable(_conn_error) from e
+            _conn_error = None
+            logger.info(f"CHAIN conectado | rpc={RPC_URL} sender={_conn.sender} "
+                        f"({(time.perf_counter() - t0) * 1000.0:.0f}ms)")
+        return _conn
+
+def state_path(path: str) -> str:
+    """En CHAIN_BACKEND=local: state/outbox.sqlite -> state/outbox.local.sqlite."""
+    if CHAIN_BACKEND != "local":
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.local{ext}"
+
+def chain_status() -> Dict[str, Any]:
+    """Diagnóstico para /health; nunca lanza y respeta CHAIN_RETRY_S entre intentos."""
+    try:
+        ok = bool(_client().w3.is_connected())
+    except ChainUnavailable:
+        ok = False
+    return {"rpc_connected": ok, "degraded": not ok, "last_error": _conn_error}
+
+def _unavailable_on_io(fn):
+    """Errores de red del RPC (requests hereda de OSError) -> ChainUnavailable."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        except OSError as e:
+            raise ChainUnavailable(f"RPC {RPC_URL}: {e}") from e
+    return wrapper
+
+class NonceManager:
+    """
+    Asignador de nonces en proceso: se siembra una vez desde la cadena (incluye mempool)
+    y luego incrementa localmente, así dos requests concurrentes nunca comparten nonce.
+    invalidate() fuerza a releer de la cadena en la próxima asignación.
+    """
+
+    def __init__(self, fetch: Callable[[], int]):
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._next: Optional[int] = None
+
+    def allocate(self) -> int:
+        with self._lock:
+            if self._next is None:
+                self._next = int(self._fetch())
+            n = self._next
+            self._next += 1
+            return n
 
-if not (PRIVATE_KEY.startswith("0x") and len(PRIVATE_KEY) == 66):
-    raise RuntimeError("PRIVATE_KEY inválida. Debe empezar con 0x y tener 64 hex.")
-if not (CONTRACT_ADDRESS.startswith("0x") and len(CONTRACT_ADDRESS) == 42):
-    raise RuntimeError("CONTRACT_ADDRESS inválida. Asegúrate de haber hecho el deploy y actualizado .env.")
+    def resync(self) -> int:
+        with self._lock:
+            self._next = int(self._fetch())
+            logger.info(f"NONCE resync | next={self._next}")
+            return self._next
 
-# --- web3 & contract ---
-w3 = Web3(Web3.HTTPProvider(RPC_URL, request_kwargs={"timeout": 10}))
-if not w3.is_connected():
-    raise RuntimeError(f"No conecta a RPC_URL={RPC_URL}")
+    def invalidate(self) -> None:
+        with self._lock:
+            self._next = None
 
-# Cargar ABI
-with open(os.path.join(ABI_DIR, "TxRegistry.json"), "r", encoding="utf-8") as f:
-    ABI = json.load(f)
+def _pending_nonce() -> int:
+    c = _client()
+    return c.w3.eth.get_transaction_count(c.sender, "pending")
 
-contract = w3.eth.contract(address=Web3.to_checksum_address(CONTRACT_ADDRESS), abi=ABI)
+_nonces = NonceManager(_pending_nonce)
 
-# --- cuenta local (NO imprimir nunca la clave) ---
-account: LocalAccount = Account.from_key(PRIVATE_KEY)
-SENDER = account.address
+def _is_nonce_error(e: Exception) -> bool:
+    # Mensajes de Ganache / Hardhat / geth para nonce desfasado
+    msg = str(e).lower()
+    return any(s in msg for s in ("nonce too low", "nonce too high", "correct nonce", "invalid nonce",
+                                  "transaction nonce", "already known", "replacement transaction underpriced"))
 
 def _hex32(s: str) -> bytes:
     """
@@ -67,84 +249,299 @@ def _hex32(s: str) -> bytes:
         raise ValueError("Debe ser hex de 32 bytes: '0x' + 64 hex.")
     return bytes.fromhex(s[2:])
 
+def _0x(h: str) -> str:
+    # events.csv guarda tx_hash sin prefijo (HexBytes.hex()); el RPC lo espera con '0x'
+    return h if h.startswith("0x") else "0x" + h
+
+# Idempotencia: set en memoria + SQLite (se carga una vez, al primer envío; O(1) por consulta).
+# Los workers que solo encolan nunca lo abren
+_events: Optional[EventStore] = None
+_events_lock = threading.Lock()
+
+def _store() -> EventStore:
+    global _events
+    if _events is None:
+        with _events_lock:
+            if _events is None:
+                # events.csv es de la cadena real (dashboard): en local no se espeja
+                _events = EventStore(state_path(EVENTS_DB), EVENTS_CSV if CHAIN_BACKEND == "rpc" else None)
+    return _events
+
 def _already_recorded(decision_id_hex: str) -> bool:
-    if not os.path.exists(EVENTS_CSV):
-        return False
-    with open(EVENTS_CSV, "r", newline="", encoding="utf-8") as f:
-        r = csv.DictReader(f)
-        for row in r:
-            if row.get("decision_id_hex") == decision_id_hex:
-                return True
-    return False
+    with stage("chain", "idempotency"):
+        return _store().contains(decision_id_hex)
 
 def _append_event(decision_id_hex: str, tx_ref_hash_hex: str, tx_hash: str, block_number: int) -> None:
-    exists = os.path.exists(EVENTS_CSV)
-    with open(EVENTS_CSV, "a", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=["decision_id_hex", "tx_ref_hash_hex", "tx_hash", "block_number"])
-        if not exists:
-            w.writeheader()
-        w.writerow({
-            "decision_id_hex": decision_id_hex,
-            "tx_ref_hash_hex": tx_ref_hash_hex,
-            "tx_hash": tx_hash,
-            "block_number": block_number
-        })
-
-def _eip1559_fees() -> Dict[str,int]:
-    """EIP-1559: fees conservadoras para Ganache."""
-    # Ganache suele ignorar dinámica; valores estáticos conservadores
-    base = w3.to_wei(20, "gwei")
-    prio = w3.to_wei(2, "gwei")
-    return {"maxFeePerGas": int(base), "maxPriorityFeePerGas": int(prio)}
+    _store().add(decision_id_hex, tx_ref_hash_hex, tx_hash, block_number)
 
-def register_secure_tx(decision_id_hex: str, tx_ref_hash_hex: str, retries: int = 3, wait_sec: float = 1.5) -> Dict[str,Any]:
+class GasCache:
     """
-    Envía una tx que emite el evento SecureTx(decisionId, txRefHash, ts).
-    Idempotencia: si decision_id ya está en events.csv -> no envía.
-    Retorna: {"tx_hash": "0x...", "blockNumber": N} o {"skipped": True}
+    Límite de gas por función, calibrado con estimate_gas una vez por (contrato, ABI, función).
+    Emitir SecureTx tiene forma fija: el costo no depende del contenido de los bytes32
+    (se calibra con bytes no nulos, el peor caso de calldata). Para lotes se ajusta
+    gas(n) = base + n * por_ítem con dos estimaciones. Vence a los ttl_s o con invalidate().
+    """
+
+    _CAL_N = 8  # tamaño del segundo punto de calibración para funciones de lote
+
+    def __init__(self, ttl_s: float = GAS_CACHE_TTL_S, margin: float = GAS_MARGIN):
+        self.ttl_s = float(ttl_s)
+        self.margin = float(margin)
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str, str], Tuple[float, float, float]] = {}  # -> (base, por_ítem, t)
+
+    def gas(self, name: str, estimate: Callable[[int], int], n: int = 1, linear: bool = False) -> int:
+        """estimate(k) -> gas estimado para k ítems (k se ignora si la función no es de lote)."""
+        key = (CONTRACT_ADDRESS.lower(), _abi()["hash"], name)
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None or time.time() - e[2] > self.ttl_s:
+                e = self._entries[key] = self._calibrate(name, estimate, linear)
+        base, per_item, _ = e
+        return int((base + per_item * n) * self.margin)
+
+    def _calibrate(self, name: str, estimate: Callable[[int], int], linear: bool) -> Tuple[float, float, float]:
+        g1 = float(estimate(1))
+        if not linear:
+            logger.info(f"GAS calibrado | {name}={g1:.0f}")
+            return g1, 0.0, time.time()
+        gn = float(estimate(self._CAL_N))
+        per_item = max(0.0, (gn - g1) / (self._CAL_N - 1))
+        logger.info(f"GAS calibrado | {name}: base={g1 - per_item:.0f} por_item={per_item:.0f}")
+        return g1 - per_item, per_item, time.time()
+
+    def invalidate(self, reason: str = "") -> None:
+        with self._lock:
+            self._entries.clear()
+        logger.warning(f"GAS recalibración forzada{': ' + reason if reason else ''}")
+
+class FeeCache:
+    """
+    Fees EIP-1559 cacheadas. "static": valores fijos conservadores (Ganache suele ignorar
+    la dinámica). "history": eth_feeHistory a lo sumo cada refresh_s; si falla, quedan las estáticas.
+    """
+
+    def __init__(self, source: str = FEE_SOURCE, refresh_s: float = FEE_REFRESH_S):
+        self.source = source
+        self.refresh_s = float(refresh_s)
+        self._lock = threading.Lock()
+        self._static = {"maxFeePerGas": 20 * 10**9,          # 20 gwei
+                        "maxPriorityFeePerGas": 2 * 10**9}   # 2 gwei
+        self._fees = dict(self._static)
+        self._t = 0.0
+
+    def get(self) -> Dict[str,int]:
+        if self.source != "history":
+            return self._static
+        with self._lock:
+            if time.time() - self._t > self.refresh_s:
+                self._fees = self._from_history()
+                self._t = time.time()
+            return self._fees
+
+    def _from_history(self) -> Dict[str,int]:
+        try:
+            h = _client().w3.eth.fee_history(5, "latest", [50])
+            base = int(h["baseFeePerGas"][-1])  # base fee del próximo bloque
+            tips = sorted(int(r[0]) for r in h.get("reward") or [] if r)
+            prio = tips[len(tips) // 2] if tips else self._static["maxPriorityFeePerGas"]
+            # Margen para que la tx siga siendo válida si la base fee sube unos bloques
+            return {"maxFeePerGas": 2 * base + prio, "maxPriorityFeePerGas": prio}
+        except Exception as e:
+            logger.warning(f"FEES fee_history no disponible ({e}); uso valores estáticos")
+            return dict(self._static)
+
+_gas = GasCache()
+_fees = FeeCache()
+
+# Argumentos de calibración: bytes no nulos = peor caso de costo de calldata
+_CAL_ARG = b"\xff" * 32
+
+def _gas_single() -> int:
+    c = _client()
+    with stage("chain", "gas"):
+        return _gas.gas("registerSecureTx",
+                        lambda _k: c.contract.functions.registerSecureTx(_CAL_ARG, _CAL_ARG).estimate_gas({"from": c.sender}))
+
+def _gas_batch(n: int) -> int:
+    c = _client()
+    with stage("chain", "gas"):
+        return _gas.gas("registerSecureTxBatch",
+                        lambda k: c.contract.functions.registerSecureTxBatch([_CAL_ARG] * k, [_CAL_ARG] * k)
+                                                     .estimate_gas({"from": c.sender}),
+                        n=n, linear=True)
+
+def _is_gas_error(e: Exception) -> bool:
+    msg = str(e).lower()
+    return any(s in msg for s in ("out of gas", "intrinsic gas too low", "gas required exceeds"))
+
+def _eip1559_fees(bump: int = 0) -> Dict[str,int]:
+    """EIP-1559: fees desde el cache (sin RPC por transacción); bump = reenvíos del mismo nonce."""
+    with stage("chain", "fees"):
+        fees = _fees.get()
+    if bump <= 0:
+        return fees
+    # Redondeo hacia arriba: el reemplazo nunca queda por debajo del mínimo que pide el nodo
+    return {k: -(-v * (100 + FEE_BUMP_PCT) ** bump // 100 ** bump) for k, v in fees.items()}
+
+@_unavailable_on_io
+def mined_nonce() -> int:
+    """Nonces del sender ya minados ("latest"): nonce < mined_nonce() está usado en la cadena."""
+    c = _client()
+    return int(c.w3.eth.get_transaction_count(c.sender, "latest"))
+
+@_unavailable_on_io
+def send_secure_tx(decision_id_hex: str, tx_ref_hash_hex: str, nonce_retries: int = 3,
+                   nonce: Optional[int] = None, bump: int = 0) -> Dict[str,Any]:
+    """
+    Firma y envía registerSecureTx SIN esperar el receipt (pipelining).
+    Idempotencia: si decision_id ya está registrado (store de eventos) -> no envía.
+    nonce / bump: reenvío de una tx sin receipt con su nonce original y fees subidas.
+    Retorna: {"tx_hash": "...", "nonce": N} o {"skipped": True, "reason": ...}
+    ChainUnavailable si la cadena no responde (el outbox reintenta sin gastar intentos).
     """
     # Validaciones
     d = _hex32(decision_id_hex)
     t = _hex32(tx_ref_hash_hex)
 
     if _already_recorded(decision_id_hex):
+        CHAIN_SKIPS.inc()
         msg = f"Decision {decision_id_hex} ya registrada; skip."
         logger.info(msg)
         return {"skipped": True, "reason": "already_recorded"}
 
-    # Build tx
-    nonce = w3.eth.get_transaction_count(SENDER)
-    fees = _eip1559_fees()
+    # Gas calibrado (cache) con colchón: sin estimate_gas por transacción
+    return _sign_and_send(_client().contract.functions.registerSecureTx(d, t), _gas_single(), nonce_retries,
+                          nonce, bump)
 
-    tx = contract.functions.registerSecureTx(d, t).build_transaction({
-        "from": SENDER,
-        "nonce": nonce,
-        "chainId": CHAIN_ID,
-        "type": 2,  # EIP-1559
-        **fees,
-        # Gas estimado con colchón
-        "gas": int(contract.functions.registerSecureTx(d, t).estimate_gas({"from": SENDER}) * 1.2),
-    })
+@_unavailable_on_io
+def send_secure_batch(items: List[Tuple[str, str]], nonce_retries: int = 3,
+                      nonce: Optional[int] = None, bump: int = 0) -> Dict[str,Any]:
+    """
+    Firma y envía registerSecureTxBatch con todas las decisiones aún no registradas, sin esperar.
+    nonce / bump: como en send_secure_tx (reenvío del mismo lote).
+    Retorna: {"tx_hash": "..." | None, "nonce": N | None, "sent": [ids], "skipped": [ids]}
+    """
+    if not has_batch():
+        raise RuntimeError("El contrato desplegado no expone registerSecureTxBatch")
+    todo, skipped = [], []
+    for d_hex, t_hex in items:
+        pair = (_hex32(d_hex), _hex32(t_hex))
+        if _already_recorded(d_hex):
+            skipped.append(d_hex)
+        else:
+            todo.append((d_hex, pair))
+    if skipped:
+        CHAIN_SKIPS.inc(len(skipped))
+        logger.info(f"Batch: {len(skipped)} decisiones ya registradas; skip.")
+    if not todo:
+        return {"tx_hash": None, "nonce": None, "sent": [], "skipped": skipped}
+
+    fn = _client().contract.functions.registerSecureTxBatch([p[0] for _, p in todo], [p[1] for _, p in todo])
+    res = _sign_and_send(fn, _gas_batch(len(todo)), nonce_retries, nonce, bump)
+    logger.info(f"BATCH SENT | n={len(todo)} tx_hash={res['tx_hash']} nonce={res['nonce']}")
+    return {**res, "sent": [d for d, _ in todo], "skipped": skipped}
+
+def _sign_and_send(fn, gas: int, nonce_retries: int, nonce: Optional[int] = None, bump: int = 0) -> Dict[str,Any]:
+    """
+    Construye, firma y envía la llamada con un nonce local; resync ante errores de nonce.
+    Con nonce fijo (reenvío) no hay resync: un error de nonce se propaga y decide el outbox.
+    """
+    c = _client()
+    fees = _eip1559_fees(bump)
+    for attempt in range(1, nonce_retries+1):
+        n, signed = nonce, None
+        if n is None:
+            with stage("chain", "nonce"):
+                n = _nonces.allocate()
+        try:
+            with stage("chain", "sign"):
+                tx = fn.build_transaction({
+                    "from": c.sender,
+                    "nonce": n,
+                    "chainId": CHAIN_ID,
+                    "type": 2,  # EIP-1559
+                    **fees,
+                    "gas": gas,
+                })
+                signed = c.account.sign_transaction(tx)
+            with stage("chain", "send"):
+                tx_hash = c.w3.eth.send_raw_transaction(signed.raw_transaction)
+            CHAIN_TX.labels(fn.fn_name).inc()
+            return {"tx_hash": tx_hash.hex(), "nonce": n}
+        except OSError as e:
+            if signed is None:
+                raise
+            # Sin respuesta del RPC después de firmar: la tx pudo entrar al mempool. Se da por
+            # enviada con su hash local; si no aparece, el outbox la reenvía con este mismo nonce
+            _nonces.invalidate()
+            logger.warning(f"TX nonce={n} envío incierto ({e}); se espera el receipt de {signed.hash.hex()}")
+            return {"tx_hash": signed.hash.hex(), "nonce": n}
+        except Exception as e:
+            if nonce is None and _is_nonce_error(e) and attempt < nonce_retries:
+                CHAIN_RETRIES.labels("nonce").inc()
+                logger.warning(f"TX nonce={n} rechazado ({e}); resync {attempt}/{nonce_retries}")
+                _nonces.resync()
+                continue
+            if _is_gas_error(e):
+                CHAIN_RETRIES.labels("gas").inc()
+                _gas.invalidate(str(e))
+            if nonce is None:
+                # Rechazada por el nodo: el nonce no se usó, releer en la próxima asignación
+                _nonces.invalidate()
+            raise
+    raise RuntimeError("unreachable")
+
+@_unavailable_on_io
+def get_receipt(tx_hash_hex: str) -> Optional[Dict[str,Any]]:
+    """Consulta no bloqueante: None si la tx aún no fue minada; error si fue revertida."""
+    from web3.exceptions import TransactionNotFound
+    w3 = _client().w3
+    try:
+        with stage("chain", "receipt"):
+            receipt = w3.eth.get_transaction_receipt(_0x(tx_hash_hex))
+    except TransactionNotFound:
+        return None
+    if receipt is None:
+        return None
+    if int(receipt.get("status", 1)) == 0:
+        # Revertida usando todo el gas: la calibración quedó corta
+        if int(receipt["gasUsed"]) >= int(w3.eth.get_transaction(_0x(tx_hash_hex))["gas"]):
+            CHAIN_RETRIES.labels("gas").inc()
+            _gas.invalidate(f"out of gas en {tx_hash_hex}")
+        raise RuntimeError(f"TX {tx_hash_hex} revertida en bloque {receipt['blockNumber']}")
+    return {"tx_hash": tx_hash_hex, "blockNumber": int(receipt["blockNumber"])}
+
+def record_event(decision_id_hex: str, tx_ref_hash_hex: str, tx_hash: str, block_number: int) -> None:
+    """Persiste un evento confirmado (idempotencia + dashboard)."""
+    _append_event(decision_id_hex, tx_ref_hash_hex, tx_hash, block_number)
+    logger.info(f"EVENT OK | decision_id={decision_id_hex} txRefHash={tx_ref_hash_hex} tx_hash={tx_hash} block={block_number}")
+
+def register_secure_tx(decision_id_hex: str, tx_ref_hash_hex: str, retries: int = 3, wait_sec: float = 1.5) -> Dict[str,Any]:
+    """
+    Envía una tx que emite el evento SecureTx(decisionId, txRefHash, ts) y espera el receipt.
+    Idempotencia: si decision_id ya está registrado (store de eventos) -> no envía.
+    Retorna: {"tx_hash": "0x...", "blockNumber": N} o {"skipped": True}
+    """
+    # Hex inválido: error inmediato, no tiene sentido reintentar
+    _hex32(decision_id_hex); _hex32(tx_ref_hash_hex)
 
     # Intentar con reintentos en errores típicos
     last_err: Optional[Exception] = None
     for attempt in range(1, retries+1):
         try:
-            signed = account.sign_transaction(tx)
-            tx_hash = w3.eth.send_raw_transaction(signed.raw_transaction)
-            receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
-            txh = tx_hash.hex()
+            sent = send_secure_tx(decision_id_hex, tx_ref_hash_hex)
+            if sent.get("skipped"):
+                return sent
+            receipt = _client().w3.eth.wait_for_transaction_receipt(_0x(sent["tx_hash"]), timeout=120)
             bn  = int(receipt["blockNumber"])
-            _append_event(decision_id_hex, tx_ref_hash_hex, txh, bn)
-            logger.info(f"EVENT OK | decision_id={decision_id_hex} txRefHash={tx_ref_hash_hex} tx_hash={txh} block={bn}")
-            return {"tx_hash": txh, "blockNumber": bn}
+            record_event(decision_id_hex, tx_ref_hash_hex, sent["tx_hash"], bn)
+            return {"tx_hash": sent["tx_hash"], "blockNumber": bn}
         except Exception as e:
             last_err = e
+            CHAIN_RETRIES.labels("sync").inc()
             logger.warning(f"TX attempt {attempt}/{retries} failed: {e}")
             time.sleep(wait_sec)
-            # Actualizar nonce por si se consumió
-            nonce = w3.eth.get_transaction_count(SENDER)
-            tx["nonce"] = nonce
 
     logger.error(f"TX permanent failure for decision_id={decision_id_hex}: {last_err}")
     raise RuntimeError(f"TX failed after {retries} attempts: {last_err}")
@@ -0,0 +1,137 @@
+﻿# -*- coding: utf-8 -*-
+"""
+api/event_store.py — store indexado de eventos on-chain confirmados (idempotencia)
+- SQLite (WAL) con PK en decision_id_hex + índices por tx_ref_hash_hex, tx_hash y bloque
+- Set en memoria cargado una vez al arrancar: contains() es O(1) para lo ya visto;
+  si no está en el set se consulta la PK (otro proceso pudo haberlo registrado)
+- add() es durable (commit en SQLite) y además espeja la fila en events.csv (dashboard)
+- Primera vez: si la base está vacía se importa el events.csv existente
+
+Re-exportar events.csv completo desde la base:
+  python -m api.event_store --export
+"""
+
+from __future__ import annotations
+import os, csv, time, sqlite3, threading, argparse
+from typing import Iterator, Optional, Tuple
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+EVENTS_DB = os.getenv("EVENTS_DB") or os.path.join(ROOT, "state", "events.sqlite")
+EVENTS_CSV = os.path.join(ROOT, "events.csv")
+
+CSV_FIELDS = ["decision_id_hex", "tx_ref_hash_hex", "tx_hash", "block_number"]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    decision_id_hex TEXT PRIMARY KEY,
+    tx_ref_hash_hex TEXT NOT NULL,
+    tx_hash         TEXT NOT NULL,
+    block_number    INTEGER NOT NULL,
+    recorded_at     REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_events_txref ON events(tx_ref_hash_hex);
+CREATE INDEX IF NOT EXISTS ix_events_txhash ON events(tx_hash);
+CREATE INDEX IF NOT EXISTS ix_events_block ON events(block_number);
+"""
+
+class EventStore:
+    """Eventos SecureTx confirmados por este API, indexados por decision_id."""
+
+    def __init__(self, db_path: str = EVENTS_DB, csv_path: Optional[str] = EVENTS_CSV):
+        self.db_path = db_path
+        self.csv_path = csv_path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        if conn.execute("SELECT COUNT(*) FROM events").fetchone()[0] == 0:
+            self._import_csv()
+        self._ids = {r[0] for r in conn.execute("SELECT decision_id_hex FROM events")}
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _import_csv(self) -> int:
+        """Migración única desde el events.csv histórico (escrito por versiones previas)."""
+        if not (self.csv_path and os.path.exists(self.csv_path)):
+            return 0
+        now = time.time()
+        with open(self.csv_path, "r", newline="", encoding="utf-8") as f:
+            rows = [(r["decision_id_hex"], r["tx_ref_hash_hex"], r["tx_hash"], int(r["block_number"] or 0), now)
+                    for r in csv.DictReader(f) if r.get("decision_id_hex")]
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany("INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?)", rows)
+        conn.execute("COMMIT")
+        return len(rows)
+
+    def __len__(self) -> int:
+        return int(self._conn().execute("SELECT COUNT(*) FROM events").fetchone()[0])
+
+    def contains(self, decision_id_hex: str) -> bool:
+        if decision_id_hex in self._ids:
+            return True
+        hit = self._conn().execute("SELECT 1 FROM events WHERE decision_id_hex = ?", (decision_id_hex,)).fetchone()
+        if hit:
+            self._ids.add(decision_id_hex)
+        return bool(hit)
+
+    def add(self, decision_id_hex: str, tx_ref_hash_hex: str, tx_hash: str, block_number: int) -> bool:
+        """Registra un evento; False si ese decision_id ya estaba."""
+        with self._lock:
+            cur = self._conn().execute("INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?)",
+                                       (decision_id_hex, tx_ref_hash_hex, tx_hash, int(block_number), time.time()))
+            self._ids.add(decision_id_hex)
+            if cur.rowcount != 1:
+                return False
+            if self.csv_path:
+                self._append_csv(decision_id_hex, tx_ref_hash_hex, tx_hash, int(block_number))
+            return True
+
+    def _append_csv(self, decision_id_hex: str, tx_ref_hash_hex: str, tx_hash: str, block_number: int) -> None:
+        exists = os.path.exists(self.csv_path)
+        with open(self.csv_path, "a", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            if not exists:
+                w.writeheader()
+            w.writerow(dict(zip(CSV_FIELDS, (decision_id_hex, tx_ref_hash_hex, tx_hash, block_number))))
+
+    def rows(self) -> Iterator[Tuple[str, str, str, int]]:
+        yield from self._conn().execute(
+            "SELECT decision_id_hex, tx_ref_hash_hex, tx_hash, block_number FROM events ORDER BY rowid")
+
+    def export_csv(self, path: Optional[str] = None) -> int:
+        """Reescribe events.csv completo desde la base (escritura atómica vía archivo temporal)."""
+        path = path or self.csv_path
+        tmp = path + ".tmp"
+        n = 0
+        with open(tmp, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(CSV_FIELDS)
+            for r in self.rows():
+                w.writerow(r); n += 1
+        os.replace(tmp, path)
+        return n
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=EVENTS_DB)
+    ap.add_argument("--export", action="store_true", help="Reescribir events.csv desde la base")
+    ap.add_argument("--out", default=EVENTS_CSV)
+    args = ap.parse_args()
+
+    store = EventStore(args.db, csv_path=args.out)
+    print(f"Eventos en {args.db}: {len(store):,}")
+    if args.export:
+        n = store.export_csv(args.out)
+        print(f"OK → {n:,} filas exportadas a {args.out}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+﻿# -*- coding: utf-8 -*-
+"""
+api/forest.py — evaluador compilado del RandomForest servido
+- PackedForest.from_sklearn(clf): aplana todos los árboles en arrays NumPy contiguos
+  (feature, threshold, hijo izquierdo, valor de hoja, missing_go_to_left)
+- Nodos renumerados por niveles: el hijo derecho es siempre hijo_izq + 1
+- predict_proba(X): recorrido vectorizado nivel a nivel de TODOS los árboles a la vez;
+  los pares (fila, árbol) que llegan a una hoja salen del conjunto activo
+- Sin validación por llamada ni dispatch de joblib: para 1 fila domina el recorrido.
+  En lotes grandes (cientos de filas) el Cython de sklearn vuelve a ganar; el API
+  usa este evaluador hasta PACKED_MAX_ROWS filas por llamada
+- save(dir) / load(dir, mmap_mode="r"): un .npy por array; con mmap los workers de api/serve.py
+  comparten las páginas del bosque vía page cache en lugar de tener una copia cada uno
+
+Chequeo de paridad contra sklearn en el split de test:
+  python -m api.forest --model .\\models\\model.joblib --data-dir .\\data\\processed
+"""
+
+from __future__ import annotations
+import os, sys, json, time, argparse
+from typing import Optional
+import numpy as np
+
+# Filas por bloque en predict_proba (acota memoria de los índices (n, n_trees))
+_CHUNK_ROWS = 4096
+# Arrays persistidos por save()/load()
+_ARRAYS = ("feature", "threshold", "left", "value", "roots", "classes_")
+
+class PackedForest:
+    """Ensamble de árboles en arrays planos; drop-in de predict_proba para el API."""
+
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, left: np.ndarray,
+                 value: np.ndarray, missing_left: Optional[np.ndarray], roots: np.ndarray,
+                 max_depth: int, classes: np.ndarray, n_features: int):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left          # -1 en hojas; hijo derecho = left + 1
+        self.value = value
+        self.missing_left = missing_left
+        self.roots = roots
+        self.max_depth = int(max_depth)
+        self.classes_ = classes
+        self.n_features_in_ = int(n_features)
+
+    @property
+    def n_trees(self) -> int:
+        return int(len(self.roots))
+
+    @property
+    def n_nodes(self) -> int:
+        return int(len(self.feature))
+
+    @classmethod
+    def from_sklearn(cls, clf) -> "PackedForest":
+        """Aplana un RandomForestClassifier/ExtraTreesClassifier entrenado (1 salida)."""
+        ests = getattr(clf, "estimators_", None)
+        if not ests or not all(hasattr(e, "tree_") for e in ests):
+            raise TypeError("Se espera un ensamble de árboles entrenado (estimators_ con tree_)")
+        if getattr(clf, "n_outputs_", 1) != 1:
+            raise TypeError("Solo se soporta clasificación de una salida")
+
+        trees = [e.tree_ for e in ests]
+        sizes = np.array([t.node_count for t in trees], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        total = int(sizes.sum())
+        n_classes = int(trees[0].value.shape[2])
+        has_missing = all(hasattr(t, "missing_go_to_left") for t in trees)
+
+        feature = np.zeros(total, dtype=np.int32)
+        threshold = np.zeros(total, dtype=np.float64)
+        left = np.full(total, -1, dtype=np.int32)
+        value = np.empty((total, n_classes), dtype=np.float64)
+        missing_left = np.zeros(total, dtype=bool) if has_missing else None
+
+        for t, off in zip(trees, offsets):
+            # Orden por niveles (BFS): los dos hijos de un nodo quedan contiguos
+            cl, cr = t.children_left, t.children_right
+            order = [0]
+            for node in order:
+                if cl[node] >= 0:
+                    order.extend((cl[node], cr[node]))
+            order = np.asarray(order, dtype=np.int64)
+            new_id = np.empty(t.node_count, dtype=np.int64)
+            new_id[order] = np.arange(t.node_count) + off
+
+            sl = slice(int(off), int(off) + t.node_count)
+            internal = cl[order] >= 0
+            feature[sl] = np.where(internal, t.feature[order], 0)
+            threshold[sl] = np.where(internal, t.threshold[order], 0.0)
+            left[sl] = np.where(internal, new_id[np.maximum(cl[order], 0)], -1)
+            # Misma normalización que DecisionTreeClassifier.predict_proba
+            v = t.value[order, 0, :].astype(np.float64)
+            norm = v.sum(axis=1, keepdims=True)
+            norm[norm == 0.0] = 1.0
+            value[sl] = v / norm
+            if has_missing:
+                missing_left[sl] = np.asarray(t.missing_go_to_left, dtype=bool)[order]
+
+        return cls(feature, threshold, left, value, missing_left,
+                   roots=offsets.astype(np.int32), max_depth=max(t.max_depth for t in trees),
+                   classes=np.asarray(clf.classes_), n_features=clf.n_features_in_)
+
+    def save(self, path: str) -> None:
+        """Escribe los arrays (.npy sin comprimir, mapeables) y meta.json en el directorio path."""
+        os.makedirs(path, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        if self.missing_left is not None:
+            np.save(os.path.join(path, "missing_left.npy"), self.missing_left)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"max_depth": self.max_depth, "n_features": self.n_features_in_,
+                       "n_trees": self.n_trees, "n_nodes": self.n_nodes}, f, indent=2)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: Optional[str] = "r") -> "PackedForest":
+        """Carga lo escrito por save(); con mmap_mode="r" los arrays quedan mapeados (solo lectura)."""
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        # np.asarray: vista ndarray sobre el mismo buffer (sin el overhead de la subclase memmap)
+        arr = {n: np.asarray(np.load(os.path.join(path, f"{n}.npy"), mmap_mode=mmap_mode)) for n in _ARRAYS}
+        ml = os.path.join(path, "missing_left.npy")
+        missing_left = np.asarray(np.load(ml, mmap_mode=mmap_mode)) if os.path.exists(ml) else None
+        return cls(arr["feature"], arr["threshold"], arr["left"], arr["value"], missing_left, arr["roots"],
+                   max_depth=meta["max_depth"], classes=arr["classes_"], n_features=meta["n_features"])
+
+    def _leaves(self, X: np.ndarray) -> np.ndarray:
+        """Índice global de la hoja alcanzada por cada (fila, árbol): (n, n_trees)."""
+        n, d = X.shape
+        leaves = np.tile(self.roots, n)                           # plano, fila-mayor
+        base = np.repeat(np.arange(n, dtype=np.int64) * d, self.n_trees)
+        pos = np.arange(leaves.size)                              # pares aún activos
+        node = leaves
+        Xf = X.ravel()
+        check_nan = self.missing_left is not None and bool(np.isnan(X).any())
+        for _ in range(self.max_depth + 1):
+            child = self.left[node]
+            active = child >= 0
+            if not active.all():
+                leaves[pos[~active]] = node[~active]
+                pos, node, child, base = pos[active], node[active], child[active], base[active]
+                if not pos.size:
+                    break
+            x = Xf[base + self.feature[node]]
+            go_right = ~(x <= self.threshold[node])
+            if check_nan:
+                go_right &= ~(np.isnan(x) & self.missing_left[node])
+            node = child + go_right
+        return leaves.reshape(n, self.n_trees)
+
+    def predict_proba(self, X) -> np.ndarray:
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"X debe ser (n, {self.n_features_in_}); recibido {X.shape}")
+        out = np.empty((X.shape[0], self.value.shape[1]), dtype=np.float64)
+        for i in range(0, X.shape[0], _CHUNK_ROWS):
+            leaves = self._leaves(X[i:i + _CHUNK_ROWS])
+            out[i:i + _CHUNK_ROWS] = self.value[leaves].mean(axis=1)
+        return out
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+def load_forest(path: str) -> PackedForest:
+    """Carga models/model.joblib (sklearn) y lo empaqueta."""
+    from joblib import load
+    return PackedForest.from_sklearn(load(path))
+
+# ---------- chequeo de paridad / latencia ----------
+def _median_ms(fn, reps: int) -> float:
+    ts = []
+    for _ in range(reps):
+        t0 = time.perf_counter(); fn(); ts.append((time.perf_counter() - t0) * 1000.0)
+    return float(np.median(ts))
+
+def main():
+    root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", default=os.path.join(root, "models", "model.joblib"))
+    ap.add_argument("--features", default=os.path.join(root, "models", "features.json"))
+    ap.add_argument("--data-dir", default=os.path.join(root, "data", "processed"))
+    ap.add_argument("--tol", type=float, default=1e-9, help="Máx. diferencia absoluta de probabilidad")
+    ap.add_argument("--reps", type=int, default=200, help="Repeticiones para la latencia de 1 fila")
+    args = ap.parse_args()
+
+    from joblib import load
+    clf = load(args.model)
+    packed = PackedForest.from_sklearn(clf)
+    with open(args.features, "r", encoding="utf-8") as f:
+        cols = json.load(f)["features"]
+    from src.dataset_cache import read_split  # cache de data.py, si no parquet / csv
+    X = np.ascontiguousarray(read_split(args.data_dir, "test", cols)[cols].to_numpy(dtype=np.float32))
+
+    p_sk = clf.predict_proba(X)
+    p_pk = packed.predict_proba(X)
+    max_diff = float(np.abs(p_sk - p_pk).max())
+    same_label = float((p_sk.argmax(axis=1) == p_pk.argmax(axis=1)).mean())
+
+    row = X[:1]
+    out = {
+        "rows": int(len(X)), "trees": packed.n_trees, "nodes": packed.n_nodes, "max_depth": packed.max_depth,
+        "max_abs_diff": max_diff, "label_agreement": same_label,
+        "single_row_ms": {"sklearn": _median_ms(lambda: clf.predict_proba(row), args.reps),
+                          "packed": _median_ms(lambda: packed.predict_proba(row), args.reps)},
+        "batch_ms": {"sklearn": _median_ms(lambda: clf.predict_proba(X), 3),
+                     "packed": _median_ms(lambda: packed.predict_proba(X), 3)},
+    }
+    print(json.dumps(out, indent=2))
+    if max_diff > args.tol:
+        print(f"[ERROR] Paridad fuera de tolerancia: {max_diff:.3e} > {args.tol:.1e}", file=sys.stderr)
+        sys.exit(1)
+    print("OK → paridad con sklearn dentro de tolerancia")
+
+if __name__ == "__main__":
+    main()
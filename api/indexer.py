@@ -0,0 +1,324 @@
+﻿# -*- coding: utf-8 -*-
+"""
+api/indexer.py — indexador de eventos SecureTx desde la cadena
+- Lee los logs de CONTRACT_ADDRESS con eth_getLogs por rangos de bloques (no depende de
+  events.csv, que solo ve lo que escribió un proceso del API)
+- Backfill: rangos de INDEXER_RANGE bloques pedidos en paralelo (INDEXER_WORKERS); se
+  escriben en orden y el checkpoint avanza solo sobre el prefijo contiguo ya guardado.
+  Si el nodo rechaza un rango por tamaño, se parte en dos
+- Tail-follow: sigue la cabeza (menos INDEXER_CONFIRMATIONS) desde el checkpoint
+- Store SQLite (WAL) con índices por decision_id, tx_ref_hash y bloque; reindexar un rango
+  es idempotente (PK = tx_hash + log_index)
+- SecureTxIndex: API de consulta para el dashboard y la conciliación (sin re-escanear);
+  query() resuelve prefijo / rango de bloques / orden / página en SQL sobre esos índices
+
+Sincronizar una vez / seguir la cadena / conciliar contra los eventos locales:
+  python -m api.indexer
+  python -m api.indexer --follow
+  python -m api.indexer --reconcile
+"""
+
+from __future__ import annotations
+import os, time, sqlite3, threading, logging, argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+INDEX_DB = os.getenv("INDEX_DB") or os.path.join(ROOT, "state", "index.sqlite")
+INDEXER_START_BLOCK = int(os.getenv("INDEXER_START_BLOCK") or 0)
+INDEXER_RANGE = int(os.getenv("INDEXER_RANGE") or 2000)
+INDEXER_WORKERS = int(os.getenv("INDEXER_WORKERS") or 4)
+INDEXER_CONFIRMATIONS = int(os.getenv("INDEXER_CONFIRMATIONS") or 0)
+INDEXER_POLL_S = float(os.getenv("INDEXER_POLL_S") or 2.0)
+
+# event SecureTx(bytes32 decisionId, bytes32 txRefHash, uint256 ts) — ningún campo indexado
+EVENT_SIGNATURE = "SecureTx(bytes32,bytes32,uint256)"
+
+logger = logging.getLogger("fraudchain.indexer")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS secure_tx (
+    tx_hash      TEXT NOT NULL,
+    log_index    INTEGER NOT NULL,
+    decision_id  TEXT NOT NULL,
+    tx_ref_hash  TEXT NOT NULL,
+    ts           INTEGER NOT NULL,
+    block_number INTEGER NOT NULL,
+    PRIMARY KEY (tx_hash, log_index)
+);
+CREATE INDEX IF NOT EXISTS ix_secure_tx_decision ON secure_tx(decision_id);
+CREATE INDEX IF NOT EXISTS ix_secure_tx_txref ON secure_tx(tx_ref_hash);
+CREATE INDEX IF NOT EXISTS ix_secure_tx_block ON secure_tx(block_number, log_index);
+CREATE TABLE IF NOT EXISTS checkpoint (
+    contract   TEXT PRIMARY KEY,
+    last_block INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+_COLS = ("decision_id", "tx_ref_hash", "ts", "block_number", "tx_hash", "log_index")
+HEX_COLS = ("decision_id", "tx_ref_hash", "tx_hash")
+_BLOCK_OPS = ("=", "!=", ">", ">=", "<", "<=")
+
+def _hex(b) -> str:
+    # HexBytes.hex() cambia de prefijo entre versiones de hexbytes: normalizo a '0x' + minúsculas
+    return "0x" + bytes(b).hex()
+
+def _norm(h: str) -> str:
+    h = (h or "").strip().lower()
+    return h if h.startswith("0x") else "0x" + h
+
+def decode_log(log: Dict[str, Any]) -> Tuple[str, int, str, str, int, int]:
+    """Log crudo de eth_getLogs -> fila (tx_hash, log_index, decision_id, tx_ref_hash, ts, block)."""
+    data = bytes(log["data"])
+    if len(data) != 96:
+        raise ValueError(f"SecureTx con data de {len(data)} bytes (se esperan 96)")
+    return (_hex(log["transactionHash"]), int(log["logIndex"]), _hex(data[:32]), _hex(data[32:64]),
+            int.from_bytes(data[64:], "big"), int(log["blockNumber"]))
+
+class SecureTxIndex:
+    """Store de eventos SecureTx indexados; solo lectura salvo para el Indexer."""
+
+    def __init__(self, path: str = INDEX_DB):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _rows(self, where: str = "", params: Iterable[Any] = (), order: str = "block_number, log_index",
+              limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
+        sql = f"SELECT {', '.join(_COLS)} FROM secure_tx {('WHERE ' + where) if where else ''} ORDER BY {order}"
+        params = list(params)
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"; params += [int(limit), int(offset)]
+        return [dict(zip(_COLS, r)) for r in self._conn().execute(sql, params)]
+
+    # ---------- escritura (Indexer) ----------
+    def write(self, contract: str, rows: List[Tuple], last_block: int) -> None:
+        """Guarda los eventos de un rango y mueve el checkpoint en la misma transacción."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("INSERT OR IGNORE INTO secure_tx(tx_hash, log_index, decision_id, tx_ref_hash, ts, "
+                             "block_number) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("INSERT INTO checkpoint(contract, last_block, updated_at) VALUES (?, ?, ?) "
+                         "ON CONFLICT(contract) DO UPDATE SET last_block = excluded.last_block, "
+                         "updated_at = excluded.updated_at",
+                         (contract.lower(), int(last_block), time.time()))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def clear(self) -> None:
+        """Vacía eventos y checkpoints (la cadena local de api/local_chain.py arranca vacía en cada proceso)."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM secure_tx")
+        conn.execute("DELETE FROM checkpoint")
+        conn.execute("COMMIT")
+
+    def checkpoint(self, contract: str) -> Optional[int]:
+        r = self._conn().execute("SELECT last_block FROM checkpoint WHERE contract = ?",
+                                 (contract.lower(),)).fetchone()
+        return int(r[0]) if r else None
+
+    # ---------- consultas ----------
+    def count(self) -> int:
+        return int(self._conn().execute("SELECT COUNT(*) FROM secure_tx").fetchone()[0])
+
+    def by_decision(self, decision_id_hex: str) -> List[Dict[str, Any]]:
+        return self._rows("decision_id = ?", (_norm(decision_id_hex),))
+
+    def by_tx_ref(self, tx_ref_hash_hex: str) -> List[Dict[str, Any]]:
+        return self._rows("tx_ref_hash = ?", (_norm(tx_ref_hash_hex),))
+
+    def by_tx_hash(self, tx_hash: str) -> List[Dict[str, Any]]:
+        return self._rows("tx_hash = ?", (_norm(tx_hash),))
+
+    def blocks(self, from_block: int, to_block: int) -> List[Dict[str, Any]]:
+        return self._rows("block_number BETWEEN ? AND ?", (int(from_block), int(to_block)))
+
+    def page(self, offset: int = 0, limit: int = 50, newest_first: bool = True) -> List[Dict[str, Any]]:
+        order = "block_number DESC, log_index DESC" if newest_first else "block_number, log_index"
+        return self._rows(order=order, limit=limit, offset=offset)
+
+    def latest(self, n: int = 200) -> List[Dict[str, Any]]:
+        return list(reversed(self.page(0, n, newest_first=True)))
+
+    def query(self, prefixes: Iterable[Tuple[Optional[str], str]] = (), blocks: Iterable[Tuple[str, int]] = (),
+              order_by: str = "block_number", desc: bool = True, offset: int = 0,
+              limit: int = 50) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Página filtrada + total (para tablas con paginado del lado del servidor).
+        prefixes: (columna de HEX_COLS | None = cualquiera, prefijo con o sin 0x); blocks: (op, n).
+        Las cláusulas se combinan con AND; orden estable por (order_by, block_number, log_index).
+        """
+        where, params = [], []
+        for col, prefix in prefixes:
+            lo = _norm(prefix)
+            cols = HEX_COLS if col is None else (col,)
+            if any(c not in HEX_COLS for c in cols):
+                raise ValueError(f"Columna hex desconocida: {col}")
+            # Rango [lo, lo + '~'): '~' es mayor que cualquier dígito hex, y el rango usa el índice
+            where.append("(" + " OR ".join(f"({c} >= ? AND {c} < ?)" for c in cols) + ")")
+            params += [lo, lo + "~"] * len(cols)
+        for op, n in blocks:
+            if op not in _BLOCK_OPS:
+                raise ValueError(f"Operador de bloque desconocido: {op}")
+            where.append(f"block_number {op} ?"); params.append(int(n))
+        if order_by not in HEX_COLS + ("block_number",):
+            raise ValueError(f"Orden desconocido: {order_by}")
+        direction = "DESC" if desc else "ASC"
+        order = ", ".join(f"{c} {direction}" for c in dict.fromkeys((order_by, "block_number", "log_index")))
+        cond = " AND ".join(where)
+        total = int(self._conn().execute(f"SELECT COUNT(*) FROM secure_tx {('WHERE ' + cond) if cond else ''}",
+                                         params).fetchone()[0])
+        return self._rows(cond, params, order=order, limit=limit, offset=offset), total
+
+    def missing(self, decision_ids: Iterable[str]) -> Set[str]:
+        """Conciliación: ids (tal como vienen) que NO tienen evento on-chain indexado."""
+        ids = {_norm(d): d for d in decision_ids}
+        found: Set[str] = set()
+        keys = list(ids)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            found.update(r[0] for r in self._conn().execute(
+                f"SELECT DISTINCT decision_id FROM secure_tx WHERE decision_id IN ({', '.join('?' * len(chunk))})",
+                chunk))
+        return {orig for k, orig in ids.items() if k not in found}
+
+class Indexer:
+    """Sincroniza logs SecureTx de la cadena al SecureTxIndex."""
+
+    def __init__(self, w3, contract_address: str, index: Optional[SecureTxIndex] = None,
+                 start_block: int = INDEXER_START_BLOCK, range_size: int = INDEXER_RANGE,
+                 workers: int = INDEXER_WORKERS, confirmations: int = INDEXER_CONFIRMATIONS):
+        from web3 import Web3
+        self.w3 = w3
+        self.address = Web3.to_checksum_address(contract_address)
+        self.topic = _hex(Web3.keccak(text=EVENT_SIGNATURE))
+        self.index = index or SecureTxIndex()
+        self.start_block = max(0, int(start_block))
+        self.range_size = max(1, int(range_size))
+        self.workers = max(1, int(workers))
+        self.confirmations = max(0, int(confirmations))
+
+    def _fetch(self, a: int, b: int) -> List[Tuple]:
+        try:
+            logs = self.w3.eth.get_logs({"address": self.address, "topics": [self.topic],
+                                         "fromBlock": a, "toBlock": b})
+        except Exception as e:
+            # Nodos con límite de resultados/rango: se parte el rango en dos
+            if b > a:
+                logger.warning(f"INDEXER get_logs [{a}, {b}] rechazado ({e}); divido el rango")
+                mid = (a + b) // 2
+                return self._fetch(a, mid) + self._fetch(mid + 1, b)
+            raise
+        return [decode_log(log) for log in logs]
+
+    def head(self) -> int:
+        return int(self.w3.eth.block_number) - self.confirmations
+
+    def sync(self, to_block: Optional[int] = None) -> int:
+        """Indexa desde el checkpoint hasta to_block (cabeza confirmada). Devuelve eventos nuevos."""
+        cp = self.index.checkpoint(self.address)
+        a = self.start_block if cp is None else cp + 1
+        b = self.head() if to_block is None else int(to_block)
+        if b < a:
+            return 0
+        ranges = [(s, min(s + self.range_size - 1, b)) for s in range(a, b + 1, self.range_size)]
+        before = self.index.count()
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(ranges))) as ex:
+            # map respeta el orden: cada rango se escribe (y avanza el checkpoint) tras sus anteriores
+            for (_, hi), rows in zip(ranges, ex.map(lambda r: self._fetch(*r), ranges)):
+                self.index.write(self.address, rows, hi)
+        added = self.index.count() - before
+        logger.info(f"INDEXER sync | bloques {a}-{b} ({len(ranges)} rangos) +{added} eventos")
+        return added
+
+    def follow(self, poll_s: float = INDEXER_POLL_S, stop: Optional[threading.Event] = None) -> None:
+        """Tail-follow: sincroniza la cabeza cada poll_s hasta que stop se active."""
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"INDEXER follow error: {e}")
+            stop.wait(poll_s)
+
+def index_path(backend: Optional[str] = None) -> str:
+    """INDEX_DB, o state/index.local.sqlite con CHAIN_BACKEND=local (no se mezcla con la cadena real)."""
+    if (backend or os.getenv("CHAIN_BACKEND") or "rpc").lower() != "local":
+        return INDEX_DB
+    base, ext = os.path.splitext(INDEX_DB)
+    return f"{base}.local{ext}"
+
+def connect(db_path: Optional[str] = None) -> Indexer:
+    """Indexer con RPC_URL / CONTRACT_ADDRESS del .env (no requiere PRIVATE_KEY); db_path=None -> index_path()."""
+    from dotenv import load_dotenv
+    from web3 import Web3
+    load_dotenv(os.path.join(ROOT, ".env"))
+    path = db_path or index_path()
+    if (os.getenv("CHAIN_BACKEND") or "rpc").lower() == "local":
+        # Cadena en memoria del proceso (api/local_chain.py): solo tiene sentido dentro del API
+        from .local_chain import LocalProvider, LOCAL_CONTRACT
+        return Indexer(Web3(LocalProvider()), os.getenv("CONTRACT_ADDRESS") or LOCAL_CONTRACT,
+                       SecureTxIndex(path))
+    rpc_url = os.getenv("RPC_URL", "http://127.0.0.1:8545")
+    address = os.getenv("CONTRACT_ADDRESS") or ""
+    if not (address.startswith("0x") and len(address) == 42):
+        raise RuntimeError("CONTRACT_ADDRESS inválida. Asegúrate de haber hecho el deploy y actualizado .env.")
+    w3 = Web3(Web3.HTTPProvider(rpc_url, request_kwargs={"timeout": 30}))
+    if not w3.is_connected():
+        raise RuntimeError(f"No conecta a RPC_URL={rpc_url}")
+    return Indexer(w3, address, SecureTxIndex(path))
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--db", default=None, help="Store del índice (por defecto INDEX_DB; *.local con CHAIN_BACKEND=local)")
+    ap.add_argument("--follow", action="store_true", help="Seguir la cabeza de la cadena")
+    ap.add_argument("--from-block", type=int, default=None, help="Bloque inicial si no hay checkpoint")
+    ap.add_argument("--workers", type=int, default=INDEXER_WORKERS)
+    ap.add_argument("--range", type=int, default=INDEXER_RANGE, dest="range_size")
+    ap.add_argument("--reconcile", action="store_true",
+                    help="Listar decisiones del store local (api/event_store.py) sin evento on-chain")
+    args = ap.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+    idx = connect(args.db)
+    idx.workers, idx.range_size = max(1, args.workers), max(1, args.range_size)
+    if args.from_block is not None:
+        idx.start_block = max(0, args.from_block)
+
+    t0 = time.perf_counter()
+    added = idx.sync()
+    print(f"OK → +{added:,} eventos en {time.perf_counter() - t0:.2f}s | total {idx.index.count():,} | "
+          f"checkpoint bloque {idx.index.checkpoint(idx.address)}")
+
+    if args.reconcile:
+        from .event_store import EventStore
+        local = [r[0] for r in EventStore(csv_path=None).rows()]
+        miss = sorted(idx.index.missing(local))
+        print(f"Conciliación: {len(local):,} decisiones locales, {len(miss):,} sin evento on-chain")
+        for d in miss[:50]:
+            print("  ", d)
+
+    if args.follow:
+        print("Siguiendo la cadena (Ctrl+C para salir)...")
+        try:
+            idx.follow()
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == "__main__":
+    main()
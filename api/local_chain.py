@@ -0,0 +1,386 @@
+﻿# -*- coding: utf-8 -*-
+"""
+api/local_chain.py — cadena local en memoria para CHAIN_BACKEND=local (sin Ganache / Hardhat)
+- LocalProvider: provider de web3 que responde, desde un LocalNode del proceso, el subconjunto
+  de JSON-RPC que usan api/chain.py y api/indexer.py. Todo lo demás es el camino real:
+  build_transaction, firma EIP-1559 local, send_raw_transaction, receipts y eth_getLogs
+- LocalNode ejecuta TxRegistry en las direcciones "desplegadas": registerSecureTx y
+  registerSecureTxBatch emiten SecureTx(decisionId, txRefHash, ts del bloque); una llamada a
+  otra dirección es una transferencia sin código
+  * valida firma, chainId, fees (base fee fija LOCAL_BASE_FEE) y gas contra un modelo fijo
+    (intrínseco + calldata + llamada + por evento); sin gas suficiente el receipt sale con
+    status 0 y usa todo el gas (out of gas), como en la cadena real
+  * nonces como un nodo real: "nonce too low" si ya se usó, "already known" si se reenvía la
+    misma tx; un nonce adelantado queda en cola hasta que llegue el que falta
+  * LOCAL_BLOCK_TIME_S=0: cada tx se mina al recibirla (automine, como Hardhat); > 0: un hilo
+    sella un bloque cada LOCAL_BLOCK_TIME_S (vacío si no hay txs) con hasta
+    LOCAL_BLOCK_GAS_LIMIT de gas; lo que no entra queda para el próximo
+  * LOCAL_RPC_LATENCY_MS: demora agregada a cada llamada RPC (simula la red)
+- El nodo vive en el proceso: se pierde al reiniciar y otro proceso (dashboard, workers de
+  api/serve.py sin submitter) no lo ve
+"""
+
+from __future__ import annotations
+import os, time, itertools, threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from eth_abi import decode as abi_decode
+from eth_account import Account
+from eth_account.typed_transactions import TypedTransaction
+from eth_utils import keccak, to_checksum_address
+from hexbytes import HexBytes
+from web3.providers.base import BaseProvider
+
+LOCAL_BLOCK_TIME_S = float(os.getenv("LOCAL_BLOCK_TIME_S") or 0.0)
+LOCAL_RPC_LATENCY_MS = float(os.getenv("LOCAL_RPC_LATENCY_MS") or 0.0)
+LOCAL_BLOCK_GAS_LIMIT = int(os.getenv("LOCAL_BLOCK_GAS_LIMIT") or 30_000_000)
+LOCAL_BASE_FEE = int(os.getenv("LOCAL_BASE_FEE") or 10**9)  # 1 gwei
+
+# Cuenta #0 y primer deploy de la red de desarrollo de Hardhat: claves públicas, sin fondos reales
+LOCAL_DEV_KEY = "0xac0974bec39a17e36ba4a6b4d238ff944bacb478cbed5efcae784d7bf4f2ff80"
+LOCAL_CONTRACT = "0x5FbDB2315678afecb367f032d93F642f64180aa3"
+
+# Modelo de gas (aprox. al bytecode de TxRegistry: LOG1 con 96 bytes de data + loop)
+TX_GAS = 21_000
+CALL_GAS = 2_400
+EVENT_GAS = 2_100
+
+# ABI de lo que ejecuta el nodo (hardhat/contracts/TxRegistry.sol actual, con el lote)
+_B32 = {"internalType": "bytes32", "type": "bytes32"}
+TXREGISTRY_ABI = [
+    {"type": "event", "name": "SecureTx", "anonymous": False,
+     "inputs": [{**_B32, "name": "decisionId", "indexed": False}, {**_B32, "name": "txRefHash", "indexed": False},
+                {"internalType": "uint256", "type": "uint256", "name": "ts", "indexed": False}]},
+    {"type": "function", "name": "registerSecureTx", "stateMutability": "nonpayable", "outputs": [],
+     "inputs": [{**_B32, "name": "decisionId"}, {**_B32, "name": "txRefHash"}]},
+    {"type": "function", "name": "registerSecureTxBatch", "stateMutability": "nonpayable", "outputs": [],
+     "inputs": [{"internalType": "bytes32[]", "type": "bytes32[]", "name": "decisionIds"},
+                {"internalType": "bytes32[]", "type": "bytes32[]", "name": "txRefHashes"}]},
+]
+
+EVENT_TOPIC = keccak(text="SecureTx(bytes32,bytes32,uint256)")
+SEL_SINGLE = keccak(text="registerSecureTx(bytes32,bytes32)")[:4]
+SEL_BATCH = keccak(text="registerSecureTxBatch(bytes32[],bytes32[])")[:4]
+
+class RPCError(Exception):
+    """Error JSON-RPC que el nodo devuelve al cliente (web3 lo convierte en excepción)."""
+
+    def __init__(self, message: str, code: int = -32000):
+        super().__init__(message)
+        self.code = code
+
+def _hex(v: Any) -> str:
+    if isinstance(v, (bytes, bytearray)):
+        return "0x" + bytes(v).hex()
+    return hex(int(v))
+
+def _calldata_gas(data: bytes) -> int:
+    zeros = data.count(0)
+    return TX_GAS + 4 * zeros + 16 * (len(data) - zeros)
+
+class LocalNode:
+    """Estado de la cadena en memoria; thread-safe (un lock para todo el estado)."""
+
+    def __init__(self, chain_id: int, contracts: Iterable[str] = (LOCAL_CONTRACT,),
+                 block_time_s: float = LOCAL_BLOCK_TIME_S, block_gas_limit: int = LOCAL_BLOCK_GAS_LIMIT,
+                 base_fee: int = LOCAL_BASE_FEE):
+        self.chain_id = int(chain_id)
+        self.contracts = {c.lower() for c in contracts if c}
+        self.block_time_s = float(block_time_s)
+        self.block_gas_limit = int(block_gas_limit)
+        self.base_fee = int(base_fee)
+        self._lock = threading.Lock()
+        self._blocks: List[Dict[str, Any]] = []
+        self._txs: Dict[bytes, Dict[str, Any]] = {}      # hash -> tx (+ bloque al minarse)
+        self._receipts: Dict[bytes, Dict[str, Any]] = {}
+        self._pool: List[bytes] = []                     # ejecutables, en orden de llegada
+        self._queued: Dict[str, Dict[int, bytes]] = {}   # sender -> nonce adelantado -> hash
+        self._pool_nonce: Dict[str, int] = {}            # "pending": próximo nonce aceptable
+        self._mined_nonce: Dict[str, int] = {}           # "latest"
+        self._seal([])  # génesis
+        if self.block_time_s > 0:
+            threading.Thread(target=self._miner, name="local-chain-miner", daemon=True).start()
+
+    # ---------- bloques ----------
+    def _seal(self, hashes: List[bytes]) -> Dict[str, Any]:
+        number = len(self._blocks)
+        parent = self._blocks[-1]["hash"] if self._blocks else b"\x00" * 32
+        ts = max(int(time.time()), self._blocks[-1]["timestamp"] if self._blocks else 0)
+        block = {"number": number, "hash": keccak(parent + number.to_bytes(8, "big") + b"".join(hashes)),
+                 "parentHash": parent, "timestamp": ts, "transactions": hashes, "gasUsed": 0, "logs": []}
+        for i, h in enumerate(hashes):
+            r = self._execute(self._txs[h], block, i)
+            block["gasUsed"] += r["gasUsed"]
+            block["logs"].extend(r["logs"])
+            self._receipts[h] = r
+        self._blocks.append(block)
+        return block
+
+    def _mine(self) -> None:
+        """Sella el pool (hasta block_gas_limit; lo que no entra espera al próximo bloque)."""
+        take, gas = [], 0
+        for h in self._pool:
+            g = self._txs[h]["gas"]
+            if take and gas + g > self.block_gas_limit:
+                break
+            take.append(h)
+            gas += g
+        self._pool = self._pool[len(take):]
+        self._seal(take)
+
+    def _miner(self) -> None:
+        while True:
+            time.sleep(self.block_time_s)
+            with self._lock:
+                self._mine()
+
+    # ---------- ejecución ----------
+    def _execute(self, tx: Dict[str, Any], block: Dict[str, Any], index: int) -> Dict[str, Any]:
+        tx.update(blockNumber=block["number"], blockHash=block["hash"], transactionIndex=index)
+        sender = tx["from"].lower()
+        self._mined_nonce[sender] = max(self._mined_nonce.get(sender, 0), tx["nonce"] + 1)
+        events, required = self._run_call(tx["to"], tx["data"])
+        ok = events is not None and tx["gas"] >= required
+        # Revert: gas hasta el punto de falla; out of gas: todo el límite
+        gas_used = min(tx["gas"], required) if events is None else (required if ok else tx["gas"])
+        logs = []
+        if ok:
+            for d, t in events:
+                logs.append({"address": tx["to"], "topics": [EVENT_TOPIC],
+                             "data": d + t + block["timestamp"].to_bytes(32, "big"),
+                             "blockNumber": block["number"], "blockHash": block["hash"],
+                             "transactionHash": tx["hash"], "transactionIndex": index,
+                             "logIndex": len(block["logs"]) + len(logs)})
+        price = min(tx["maxFeePerGas"], self.base_fee + tx["maxPriorityFeePerGas"])
+        return {"transactionHash": tx["hash"], "transactionIndex": index, "blockHash": block["hash"],
+                "blockNumber": block["number"], "from": tx["from"], "to": tx["to"],
+                "cumulativeGasUsed": block["gasUsed"] + gas_used, "gasUsed": gas_used,
+                "effectiveGasPrice": price, "status": 1 if ok else 0, "logs": logs, "type": 2}
+
+    def _run_call(self, to: Optional[str], data: bytes) -> Tuple[Optional[List[Tuple[bytes, bytes]]], int]:
+        """(eventos | None si revierte, gas necesario)."""
+        base = _calldata_gas(data)
+        if not to or to.lower() not in self.contracts:
+            return [], base
+        try:
+            if data[:4] == SEL_SINGLE:
+                d, t = abi_decode(["bytes32", "bytes32"], data[4:])
+                events = [(d, t)]
+            elif data[:4] == SEL_BATCH:
+                ds, ts = abi_decode(["bytes32[]", "bytes32[]"], data[4:])
+                if len(ds) != len(ts):
+                    return None, base + CALL_GAS  # require(longitudes distintas)
+                events = list(zip(ds, ts))
+            else:
+                return None, base + CALL_GAS  # sin fallback: revierte
+        except Exception:
+            return None, base + CALL_GAS
+        return events, base + CALL_GAS + EVENT_GAS * len(events)
+
+    # ---------- envío ----------
+    def send_raw(self, raw: bytes) -> bytes:
+        if not raw or raw[0] != 2:
+            raise RPCError("solo se aceptan transacciones EIP-1559 (type 2)")
+        try:
+            fields = TypedTransaction.from_bytes(HexBytes(raw)).as_dict()
+            sender = Account.recover_transaction(raw)
+        except Exception as e:
+            raise RPCError(f"invalid transaction: {e}")
+        h = keccak(raw)
+        to = fields.get("to")
+        tx = {"hash": h, "from": sender, "to": to_checksum_address(to) if to else None,
+              "nonce": int(fields["nonce"]), "gas": int(fields["gas"]), "value": int(fields.get("value") or 0),
+              "data": bytes(fields.get("data") or b""), "chainId": int(fields["chainId"]),
+              "maxFeePerGas": int(fields["maxFeePerGas"]),
+              "maxPriorityFeePerGas": int(fields["maxPriorityFeePerGas"]),
+              "v": int(fields.get("v") or 0), "r": int(fields.get("r") or 0), "s": int(fields.get("s") or 0),
+              "blockNumber": None, "blockHash": None, "transactionIndex": None}
+        if tx["chainId"] != self.chain_id:
+            raise RPCError(f"invalid chain id {tx['chainId']} (expected {self.chain_id})")
+        if tx["gas"] < _calldata_gas(tx["data"]):
+            raise RPCError("intrinsic gas too low")
+        if tx["gas"] > self.block_gas_limit:
+            raise RPCError("exceeds block gas limit")
+        if tx["maxFeePerGas"] < self.base_fee:
+            raise RPCError("max fee per gas less than block base fee")
+        key = sender.lower()
+        with self._lock:
+            if h in self._txs:
+                raise RPCError("already known")
+            expected = self._pool_nonce.get(key, 0)
+            if tx["nonce"] < expected:
+                raise RPCError(f"nonce too low: next nonce {expected}, tx nonce {tx['nonce']}")
+            queued = self._queued.setdefault(key, {})
+            if tx["nonce"] in queued:
+                raise RPCError("replacement transaction underpriced")
+            self._txs[h] = tx
+            queued[tx["nonce"]] = h
+            # Promueve el prefijo contiguo de nonces al pool ejecutable
+            while expected in queued:
+                self._pool.append(queued.pop(expected))
+                expected += 1
+            self._pool_nonce[key] = expected
+            if self.block_time_s <= 0 and self._pool:
+                self._mine()
+        return h
+
+    # ---------- lecturas ----------
+    def _block_number(self, tag: Any) -> int:
+        if tag in (None, "latest", "pending", "safe", "finalized"):
+            return len(self._blocks) - 1
+        if tag == "earliest":
+            return 0
+        return int(tag, 16) if isinstance(tag, str) else int(tag)
+
+    def _fmt_tx(self, tx: Dict[str, Any]) -> Dict[str, Any]:
+        price = min(tx["maxFeePerGas"], self.base_fee + tx["maxPriorityFeePerGas"])
+        return {"hash": _hex(tx["hash"]), "from": tx["from"], "to": tx["to"], "nonce": _hex(tx["nonce"]),
+                "gas": _hex(tx["gas"]), "value": _hex(tx["value"]), "input": _hex(tx["data"]),
+                "type": "0x2", "chainId": _hex(tx["chainId"]), "maxFeePerGas": _hex(tx["maxFeePerGas"]),
+                "maxPriorityFeePerGas": _hex(tx["maxPriorityFeePerGas"]), "gasPrice": _hex(price),
+                "accessList": [], "v": _hex(tx["v"]), "r": _hex(tx["r"]), "s": _hex(tx["s"]),
+                "blockNumber": None if tx["blockNumber"] is None else _hex(tx["blockNumber"]),
+                "blockHash": None if tx["blockHash"] is None else _hex(tx["blockHash"]),
+                "transactionIndex": None if tx["transactionIndex"] is None else _hex(tx["transactionIndex"])}
+
+    @staticmethod
+    def _fmt_log(log: Dict[str, Any]) -> Dict[str, Any]:
+        return {"address": log["address"], "topics": [_hex(t) for t in log["topics"]], "data": _hex(log["data"]),
+                "blockNumber": _hex(log["blockNumber"]), "blockHash": _hex(log["blockHash"]),
+                "transactionHash": _hex(log["transactionHash"]),
+                "transactionIndex": _hex(log["transactionIndex"]), "logIndex": _hex(log["logIndex"]),
+                "removed": False}
+
+    def _fmt_receipt(self, r: Dict[str, Any]) -> Dict[str, Any]:
+        out = {k: (_hex(v) if isinstance(v, (int, bytes)) else v) for k, v in r.items() if k != "logs"}
+        out.update(logs=[self._fmt_log(l) for l in r["logs"]], contractAddress=None,
+                   logsBloom="0x" + "00" * 256)
+        return out
+
+    def _fmt_block(self, b: Dict[str, Any], full: bool) -> Dict[str, Any]:
+        txs = [self._fmt_tx(self._txs[h]) if full else _hex(h) for h in b["transactions"]]
+        return {"number": _hex(b["number"]), "hash": _hex(b["hash"]), "parentHash": _hex(b["parentHash"]),
+                "timestamp": _hex(b["timestamp"]), "gasLimit": _hex(self.block_gas_limit),
+                "gasUsed": _hex(b["gasUsed"]), "baseFeePerGas": _hex(self.base_fee), "transactions": txs,
+                "miner": "0x" + "00" * 20, "difficulty": "0x0", "totalDifficulty": "0x0",
+                "extraData": "0x", "logsBloom": "0x" + "00" * 256, "nonce": "0x" + "00" * 8,
+                "mixHash": "0x" + "00" * 32, "sha3Uncles": "0x" + "00" * 32, "stateRoot": "0x" + "00" * 32,
+                "transactionsRoot": "0x" + "00" * 32, "receiptsRoot": "0x" + "00" * 32,
+                "size": "0x0", "uncles": []}
+
+    def _get_logs(self, flt: Dict[str, Any]) -> List[Dict[str, Any]]:
+        a = self._block_number(flt.get("fromBlock", "latest"))
+        b = min(self._block_number(flt.get("toBlock", "latest")), len(self._blocks) - 1)
+        addrs = flt.get("address")
+        addrs = {x.lower() for x in ([addrs] if isinstance(addrs, str) else addrs)} if addrs else None
+        topic0 = (flt.get("topics") or [None])[0]
+        topic0 = {topic0.lower()} if isinstance(topic0, str) else ({t.lower() for t in topic0} if topic0 else None)
+        out = []
+        for block in self._blocks[max(0, a):b + 1]:
+            for log in block["logs"]:
+                if addrs is not None and log["address"].lower() not in addrs:
+                    continue
+                if topic0 is not None and _hex(log["topics"][0]) not in topic0:
+                    continue
+                out.append(self._fmt_log(log))
+        return out
+
+    def _fee_history(self, count: Any, newest: Any, percentiles: Optional[List[float]]) -> Dict[str, Any]:
+        n = int(count, 16) if isinstance(count, str) else int(count)
+        last = self._block_number(newest)
+        first = max(0, last - n + 1)
+        blocks = self._blocks[first:last + 1]
+        reward = []
+        for b in blocks:
+            tips = sorted(self._txs[h]["maxPriorityFeePerGas"] for h in b["transactions"])
+            reward.append([_hex(tips[min(len(tips) - 1, int(p / 100.0 * len(tips)))] if tips else 0)
+                           for p in (percentiles or [])])
+        return {"oldestBlock": _hex(first), "baseFeePerGas": [_hex(self.base_fee)] * (len(blocks) + 1),
+                "gasUsedRatio": [b["gasUsed"] / self.block_gas_limit for b in blocks],
+                "reward": reward}
+
+    def request(self, method: str, params: List[Any]) -> Any:
+        """Resultado JSON-RPC (valores en hex, como un nodo) o RPCError."""
+        if method == "eth_sendRawTransaction":
+            raw = params[0]
+            return _hex(self.send_raw(bytes.fromhex(raw[2:]) if isinstance(raw, str) else bytes(raw)))
+        with self._lock:
+            if method == "eth_chainId":
+                return _hex(self.chain_id)
+            if method == "net_version":
+                return str(self.chain_id)
+            if method == "web3_clientVersion":
+                return "fraudchain-local/1.0"
+            if method == "eth_blockNumber":
+                return _hex(len(self._blocks) - 1)
+            if method == "eth_getTransactionCount":
+                key = params[0].lower()
+                src = self._pool_nonce if (params[1:] or ["latest"])[0] == "pending" else self._mined_nonce
+                return _hex(src.get(key, 0))
+            if method == "eth_estimateGas":
+                call = params[0]
+                data = call.get("data") or call.get("input") or "0x"
+                events, required = self._run_call(call.get("to"), bytes.fromhex(data[2:]))
+                if events is None:
+                    raise RPCError("execution reverted", 3)
+                return _hex(required)
+            if method == "eth_getTransactionReceipt":
+                r = self._receipts.get(bytes.fromhex(params[0][2:]))
+                return self._fmt_receipt(r) if r is not None else None
+            if method == "eth_getTransactionByHash":
+                tx = self._txs.get(bytes.fromhex(params[0][2:]))
+                return self._fmt_tx(tx) if tx is not None else None
+            if method == "eth_getBlockByNumber":
+                n = self._block_number(params[0])
+                return self._fmt_block(self._blocks[n], bool(params[1:] and params[1])) if n < len(self._blocks) else None
+            if method == "eth_getLogs":
+                return self._get_logs(params[0])
+            if method == "eth_feeHistory":
+                return self._fee_history(params[0], params[1], params[2] if len(params) > 2 else None)
+            if method == "eth_gasPrice":
+                return _hex(self.base_fee * 2)
+            if method == "eth_maxPriorityFeePerGas":
+                return _hex(10**9)
+            if method == "eth_getCode":
+                return "0x60" if params[0].lower() in self.contracts else "0x"
+            if method in ("eth_getBalance",):
+                return _hex(10**24)
+            if method == "eth_accounts":
+                return []
+            if method == "eth_syncing":
+                return False
+        raise RPCError(f"the method {method} does not exist/is not available", -32601)
+
+class LocalProvider(BaseProvider):
+    """Provider de web3 sobre un LocalNode (el del proceso por defecto)."""
+
+    def __init__(self, node: Optional[LocalNode] = None, latency_ms: float = LOCAL_RPC_LATENCY_MS):
+        super().__init__()
+        self.node = node if node is not None else local_node()
+        self.latency_s = max(0.0, float(latency_ms)) / 1000.0
+        self._ids = itertools.count(1)
+
+    def is_connected(self, show_traceback: bool = False) -> bool:
+        return True
+
+    def make_request(self, method, params):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+        rid = next(self._ids)
+        try:
+            return {"jsonrpc": "2.0", "id": rid, "result": self.node.request(str(method), list(params or []))}
+        except RPCError as e:
+            return {"jsonrpc": "2.0", "id": rid, "error": {"code": e.code, "message": str(e)}}
+
+_node: Optional[LocalNode] = None
+_node_lock = threading.Lock()
+
+def local_node() -> LocalNode:
+    """Nodo del proceso; TxRegistry "desplegado" en LOCAL_CONTRACT y en CONTRACT_ADDRESS del .env."""
+    global _node
+    if _node is None:
+        with _node_lock:
+            if _node is None:
+                _node = LocalNode(int(os.getenv("CHAIN_ID") or 1337),
+                                  contracts=(LOCAL_CONTRACT, os.getenv("CONTRACT_ADDRESS") or ""))
+    return _node
@@ -1,26 +1,74 @@
 ﻿# -*- coding: utf-8 -*-
 """
 api/logging_mw.py — middleware de logging para Flask (se usará en Paso 8)
+- Access log estructurado (api/access_log.py): una línea JSON por request en logs/requests.jsonl
+  con ts, request_id, method, path, endpoint, status, latency_ms, stages_ms (etapas medidas con
+  telemetry.stage en el hilo del request) y lo que el handler agregue con annotate()
+  (decision_id, model_version, ...). El request solo encola; escribe un hilo en background
+- request_id: el header X-Request-ID entrante o uno nuevo; se devuelve en la respuesta
+- Además, cada request alimenta fraudchain_http_request_seconds
+  {method, endpoint, status}; endpoint es la regla de la ruta (/onchain/<decision_id>), no el path
 """
-import time, logging
-from typing import Callable
-from flask import request
+import time, uuid, logging
+from typing import Any, Optional
+from flask import g, request
 
-def request_logger(app):
+from .access_log import AccessLog, ACCESS_LOG_ENABLED
+from .telemetry import capture_stages, histogram, release_stages
+
+HTTP_SECONDS = histogram("fraudchain_http_request_seconds", "Duración de los requests HTTP",
+                         ("method", "endpoint", "status"))
+
+def annotate(**fields: Any) -> None:
+    """Campos extra para la línea del access log del request actual."""
+    extra = g.get("access_fields")
+    if extra is None:
+        extra = g.access_fields = {}
+    extra.update(fields)
+
+def request_logger(app, access_log: Optional[AccessLog] = None):
     logger = logging.getLogger("fraudchain.api")
     logger.setLevel(logging.INFO)
+    if access_log is None and ACCESS_LOG_ENABLED:
+        access_log = AccessLog()
 
     @app.before_request
     def _before():
         request.start_ts = time.perf_counter()
+        g.request_id = (request.headers.get("X-Request-ID") or "")[:64] or uuid.uuid4().hex[:16]
+        g.stages, g.stages_token = capture_stages()
 
     @app.after_request
     def _after(resp):
         try:
             dt = (time.perf_counter() - getattr(request, "start_ts", time.perf_counter()))*1000.0
-            logger.info(f"{request.method} {request.path} {resp.status_code} {dt:.1f}ms")
-        except Exception:
-            pass
+            rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            HTTP_SECONDS.labels(request.method, rule, resp.status_code).observe(dt / 1000.0)
+            resp.headers["X-Request-ID"] = g.get("request_id", "")
+            if access_log is not None and access_log.should_log(resp.status_code, dt):
+                # Solo se arma el dict: serializar y escribir es trabajo del hilo escritor
+                access_log.write({
+                    "ts": time.time(),
+                    "request_id": g.get("request_id"),
+                    "method": request.method,
+                    "path": request.path,
+                    "endpoint": rule,
+                    "status": resp.status_code,
+                    "latency_ms": round(dt, 3),
+                    "stages_ms": {k: round(v * 1000.0, 3) for k, v in (g.get("stages") or {}).items()},
+                    **(g.get("access_fields") or {}),
+                })
+        except Exception as e:
+            logger.error(f"ACCESS LOG error: {e}")
         return resp
 
-    return app
+    @app.teardown_request
+    def _teardown(_exc):
+        token = g.pop("stages_token", None)
+        if token is not None:
+            try:
+                release_stages(token)
+            except ValueError:
+                pass  # token de otro contexto (no debería pasar con el servidor de werkzeug)
+
+    return app
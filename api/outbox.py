@@ -0,0 +1,468 @@
+﻿# -*- coding: utf-8 -*-
+"""
+api/outbox.py — outbox local durable para registros on-chain
+- SQLite en modo WAL: /score solo hace INSERT (decision_id, tx_ref_hash) y responde "pending"
+- Un submitter en background drena la cola en pipeline: envía hasta OUTBOX_MAX_IN_FLIGHT tx
+  sin esperar y luego consulta receipts, confirmando fuera de orden
+- Reintentos con backoff. Cada fila enviada guarda el nonce de su tx; si el receipt no llega en
+  OUTBOX_RECEIPT_TIMEOUT_S y hay nonce_fn: con el nonce ya minado se vuelven a buscar los
+  receipts (de la tx y de sus reenvíos); con el nonce libre se reenvía con el MISMO nonce y
+  fees subidas, así solo una copia puede minarse. Nonce nuevo solo si ese nonce lo usó otra tx
+  (o la tx se revirtió): el contrato no deduplica y dos copias serían dos eventos SecureTx
+- Recuperación: al arrancar, las filas en "sending" vuelven a "pending" y las "sent" siguen
+  esperando su receipt (entrega at-least-once; idempotencia por decision_id en api/chain.py)
+- Con send_batch_fn (contrato con registerSecureTxBatch) las pendientes se anclan en lotes:
+  se vacía al juntar OUTBOX_BATCH_SIZE decisiones o cuando la más vieja esperó
+  OUTBOX_BATCH_MAX_AGE_S; todo el lote comparte tx_hash y se confirma con UN receipt
+- Con varios procesos (api/serve.py) todos encolan pero uno solo corre el submitter
+  (OUTBOX_SUBMITTER=0 en el resto): los nonces se asignan en proceso y no deben competir
+- Backend caído (BackendUnavailable, p.ej. RPC sin respuesta): la fila vuelve a 'pending' sin
+  consumir intentos y se reintenta cada OUTBOX_UNAVAILABLE_S; el API sigue encolando
+- Estados: pending -> sending -> sent -> confirmed | skipped | failed
+- Telemetría: fraudchain_outbox_total{result} (sent, confirmed, skipped, failed, retry, deferred,
+  resent)
+  y fraudchain_outbox_confirm_seconds (enqueue -> receipt)
+"""
+
+from __future__ import annotations
+import os, time, sqlite3, threading, logging
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from .telemetry import counter, histogram
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+OUTBOX_DB = os.getenv("OUTBOX_DB") or os.path.join(ROOT, "state", "outbox.sqlite")
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS") or 5)
+OUTBOX_BACKOFF_S = float(os.getenv("OUTBOX_BACKOFF_S") or 1.5)
+OUTBOX_POLL_S = float(os.getenv("OUTBOX_POLL_S") or 1.0)
+OUTBOX_MAX_IN_FLIGHT = int(os.getenv("OUTBOX_MAX_IN_FLIGHT") or 64)
+OUTBOX_RECEIPT_POLL_S = float(os.getenv("OUTBOX_RECEIPT_POLL_S") or 0.25)
+OUTBOX_RECEIPT_TIMEOUT_S = float(os.getenv("OUTBOX_RECEIPT_TIMEOUT_S") or 120.0)
+# Anclaje por lotes (solo si hay send_batch_fn): tamaño máximo y espera máxima de la más vieja
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE") or 100)
+OUTBOX_BATCH_MAX_AGE_S = float(os.getenv("OUTBOX_BATCH_MAX_AGE_S") or 2.0)
+# 0 = este proceso solo encola; el envío lo hace otro proceso con el submitter activo
+OUTBOX_SUBMITTER = (os.getenv("OUTBOX_SUBMITTER") or "1") != "0"
+# Espera entre reintentos mientras el backend no está disponible (no cuenta como intento)
+OUTBOX_UNAVAILABLE_S = float(os.getenv("OUTBOX_UNAVAILABLE_S") or 5.0)
+
+logger = logging.getLogger("fraudchain.chain")
+
+OUTBOX_RESULTS = counter("fraudchain_outbox_total", "Transiciones de filas del outbox", ("result",))
+CONFIRM_SECONDS = histogram("fraudchain_outbox_confirm_seconds", "Desde el enqueue hasta el receipt",
+                            buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0))
+
+class BackendUnavailable(RuntimeError):
+    """send_fn / receipt_fn no pueden hablar con el backend: reintentar más tarde, sin gastar intentos."""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    decision_id     TEXT PRIMARY KEY,
+    tx_ref_hash     TEXT NOT NULL,
+    status          TEXT NOT NULL,
+    attempts        INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    tx_hash         TEXT,
+    block_number    INTEGER,
+    last_error      TEXT,
+    sent_at         REAL,
+    nonce           INTEGER,
+    prev_tx_hashes  TEXT,
+    created_at      REAL NOT NULL,
+    updated_at      REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_outbox_status ON outbox(status, next_attempt_at);
+"""
+
+_COLS = ("decision_id", "tx_ref_hash", "status", "attempts", "tx_hash", "block_number",
+         "last_error", "sent_at", "created_at", "updated_at", "nonce", "prev_tx_hashes")
+
+class Outbox:
+    """
+    Cola durable de decisiones seguras pendientes de registrar on-chain.
+    send_fn(decision_id_hex, tx_ref_hash_hex) -> {"tx_hash", "nonce"} | {"skipped": True, "reason"}  (no bloquea)
+    receipt_fn(tx_hash) -> None (aún no minada) | {"tx_hash", "blockNumber"}  (error si revertida)
+    on_confirmed(decision_id_hex, tx_ref_hash_hex, tx_hash, block_number): una vez por confirmación
+    send_batch_fn([(decision_id_hex, tx_ref_hash_hex), ...]) -> {"tx_hash" | None, "nonce", "sent": [ids], "skipped": [ids]}
+      (opcional; si está, reemplaza a send_fn y una tx lleva hasta batch_size decisiones)
+    nonce_fn() -> nonces ya minados del sender (opcional). Con él, una tx sin receipt se reenvía
+      llamando a send_fn / send_batch_fn con nonce=N, bump=k (k-ésimo reenvío del mismo nonce)
+    Las funciones lanzan BackendUnavailable si el backend está caído (modo degradado).
+    """
+
+    def __init__(self, send_fn: Callable[[str, str], Dict[str, Any]],
+                 receipt_fn: Callable[[str], Optional[Dict[str, Any]]],
+                 on_confirmed: Optional[Callable[[str, str, str, int], None]] = None,
+                 path: str = OUTBOX_DB, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 backoff_s: float = OUTBOX_BACKOFF_S, poll_s: float = OUTBOX_POLL_S,
+                 max_in_flight: int = OUTBOX_MAX_IN_FLIGHT, receipt_poll_s: float = OUTBOX_RECEIPT_POLL_S,
+                 receipt_timeout_s: float = OUTBOX_RECEIPT_TIMEOUT_S,
+                 send_batch_fn: Optional[Callable[[List[Tuple[str, str]]], Dict[str, Any]]] = None,
+                 batch_size: int = OUTBOX_BATCH_SIZE, batch_max_age_s: float = OUTBOX_BATCH_MAX_AGE_S,
+                 submitter: bool = OUTBOX_SUBMITTER, unavailable_s: float = OUTBOX_UNAVAILABLE_S,
+                 nonce_fn: Optional[Callable[[], int]] = None):
+        self.send_fn = send_fn
+        self.nonce_fn = nonce_fn
+        self.submitter = bool(submitter)
+        self.send_batch_fn = send_batch_fn
+        self.batch_size = max(1, int(batch_size))
+        self.batch_max_age_s = max(0.0, float(batch_max_age_s))
+        self.receipt_fn = receipt_fn
+        self.on_confirmed = on_confirmed
+        self.path = path
+        self.max_attempts = max(1, int(max_attempts))
+        self.backoff_s = float(backoff_s)
+        self.poll_s = float(poll_s)
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.receipt_poll_s = float(receipt_poll_s)
+        self.receipt_timeout_s = float(receipt_timeout_s)
+        self.unavailable_s = float(unavailable_s)
+        self.unavailable_since: Optional[float] = None
+        self._local = threading.local()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn().executescript(_SCHEMA)
+        self._migrate()
+
+    # ---------- SQLite ----------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self) -> None:
+        # Bases creadas antes del pipelining no tienen sent_at; antes del reenvío por nonce, nonce
+        cols = {r[1] for r in self._conn().execute("PRAGMA table_info(outbox)")}
+        for col, kind in (("sent_at", "REAL"), ("nonce", "INTEGER"), ("prev_tx_hashes", "TEXT")):
+            if col not in cols:
+                self._conn().execute(f"ALTER TABLE outbox ADD COLUMN {col} {kind}")
+
+    def _row(self, r) -> Dict[str, Any]:
+        return dict(zip(_COLS, r))
+
+    # ---------- API para los handlers ----------
+    def enqueue(self, decision_id_hex: str, tx_ref_hash_hex: str) -> Dict[str, Any]:
+        """Inserta (idempotente por decision_id) y devuelve el estado actual."""
+        self.start()
+        now = time.time()
+        self._conn().execute(
+            "INSERT OR IGNORE INTO outbox(decision_id, tx_ref_hash, status, next_attempt_at, created_at, updated_at) "
+            "VALUES (?, ?, 'pending', ?, ?, ?)",
+            (decision_id_hex, tx_ref_hash_hex, now, now, now))
+        self._wake.set()
+        return self.status(decision_id_hex) or {"decision_id": decision_id_hex, "status": "pending"}
+
+    def enqueue_many(self, pairs: List[Tuple[str, str]]) -> Dict[str, Dict[str, Any]]:
+        """Igual que enqueue, en una sola transacción; devuelve {decision_id: estado}."""
+        self.start()
+        if not pairs:
+            return {}
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO outbox(decision_id, tx_ref_hash, status, next_attempt_at, created_at, updated_at) "
+                "VALUES (?, ?, 'pending', ?, ?, ?)",
+                [(d, t, now, now, now) for d, t in pairs])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._wake.set()
+        ids = [d for d, _ in pairs]
+        out = {}
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            rows = conn.execute(f"SELECT {', '.join(_COLS)} FROM outbox WHERE decision_id IN "
+                                f"({', '.join('?' * len(chunk))})", chunk).fetchall()
+            out.update({r[0]: self._row(r) for r in rows})
+        return out
+
+    def status(self, decision_id_hex: str) -> Optional[Dict[str, Any]]:
+        r = self._conn().execute(f"SELECT {', '.join(_COLS)} FROM outbox WHERE decision_id = ?",
+                                 (decision_id_hex,)).fetchone()
+        return self._row(r) if r else None
+
+    def stats(self) -> Dict[str, int]:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return {s: int(n) for s, n in rows}
+
+    # ---------- submitter ----------
+    def start(self) -> None:
+        if not self.submitter or (self._thread is not None and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self.recover()
+                self._thread = threading.Thread(target=self._run, name="outbox-submitter", daemon=True)
+                self._thread.start()
+
+    def recover(self) -> int:
+        """Devuelve a 'pending' lo que quedó en vuelo tras una caída."""
+        cur = self._conn().execute(
+            "UPDATE outbox SET status = 'pending', updated_at = ? WHERE status = 'sending'", (time.time(),))
+        if cur.rowcount:
+            logger.warning(f"OUTBOX recover | {cur.rowcount} entradas 'sending' -> 'pending'")
+        return cur.rowcount
+
+    def _in_flight(self) -> int:
+        # Tx en vuelo (no filas): en modo lote varias decisiones comparten tx_hash
+        return int(self._conn().execute(
+            "SELECT COUNT(DISTINCT tx_hash) FROM outbox WHERE status = 'sent'").fetchone()[0])
+
+    def _due(self) -> Tuple[int, Optional[float]]:
+        """Pendientes vencidas (hasta batch_size) y created_at de la más vieja."""
+        n, oldest = self._conn().execute(
+            "SELECT COUNT(*), MIN(created_at) FROM (SELECT created_at FROM outbox "
+            "WHERE status = 'pending' AND next_attempt_at <= ? LIMIT ?)",
+            (time.time(), self.batch_size)).fetchone()
+        return int(n), (float(oldest) if oldest is not None else None)
+
+    def _claim(self, limit: int = 32) -> List[Dict[str, Any]]:
+        """Toma entradas vencidas y las marca 'sending' (atómico entre procesos)."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                f"SELECT {', '.join(_COLS)} FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY created_at LIMIT ?", (now, limit)).fetchall()
+            conn.executemany("UPDATE outbox SET status = 'sending', updated_at = ? WHERE decision_id = ?",
+                             [(now, r[0]) for r in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [self._row(r) for r in rows]
+
+    def _finish(self, decision_id_hex: str, expect: Optional[str] = None, **fields) -> bool:
+        """UPDATE de una fila; con expect solo si sigue en ese estado (True si la actualizó)."""
+        fields["updated_at"] = time.time()
+        sets = ", ".join(f"{k} = ?" for k in fields)
+        where, params = "decision_id = ?", [decision_id_hex]
+        if expect is not None:
+            where += " AND status = ?"; params.append(expect)
+        cur = self._conn().execute(f"UPDATE outbox SET {sets} WHERE {where}", (*fields.values(), *params))
+        if cur.rowcount == 1 and fields.get("status") not in (None, "pending"):
+            OUTBOX_RESULTS.labels(fields["status"]).inc()
+        return cur.rowcount == 1
+
+    def _retry_or_fail(self, d: str, attempts: int, err: Exception, expect: str) -> None:
+        if attempts >= self.max_attempts:
+            logger.error(f"OUTBOX failed | decision_id={d} attempts={attempts}: {err}")
+            self._finish(d, expect, status="failed", attempts=attempts, last_error=str(err))
+        else:
+            delay = self.backoff_s * (2 ** (attempts - 1))
+            OUTBOX_RESULTS.labels("retry").inc()
+            logger.warning(f"OUTBOX retry | decision_id={d} attempt {attempts}/{self.max_attempts} en {delay:.1f}s: {err}")
+            # Próximo envío con nonce nuevo: este no se usó o lo consumió una tx revertida / ajena
+            self._finish(d, expect, status="pending", attempts=attempts, last_error=str(err),
+                         tx_hash=None, sent_at=None, nonce=None, prev_tx_hashes=None,
+                         next_attempt_at=time.time() + delay)
+
+    def _defer(self, ids: List[str], err: Exception) -> None:
+        """Backend caído: de vuelta a 'pending' sin sumar intentos."""
+        if self.unavailable_since is None:
+            self.unavailable_since = time.time()
+            logger.warning(f"OUTBOX backend no disponible; se retiene la cola ({err})")
+        retry_at = time.time() + self.unavailable_s
+        OUTBOX_RESULTS.labels("deferred").inc(len(ids))
+        for d in ids:
+            self._finish(d, "sending", status="pending", last_error=str(err), next_attempt_at=retry_at)
+
+    def _available(self) -> None:
+        if self.unavailable_since is not None:
+            logger.info(f"OUTBOX backend disponible otra vez tras {time.time() - self.unavailable_since:.0f}s")
+            self.unavailable_since = None
+
+    def _send(self, item: Dict[str, Any]) -> None:
+        d, t = item["decision_id"], item["tx_ref_hash"]
+        attempts = int(item["attempts"]) + 1
+        try:
+            res = self.send_fn(d, t)
+        except BackendUnavailable as e:
+            self._defer([d], e)
+            return
+        except Exception as e:
+            self._retry_or_fail(d, attempts, e, expect="sending")
+            return
+        self._available()
+        if res.get("skipped"):
+            self._finish(d, "sending", status="skipped", attempts=attempts, last_error=res.get("reason"))
+        else:
+            self._finish(d, "sending", status="sent", attempts=attempts, last_error=None,
+                         tx_hash=res["tx_hash"], nonce=res.get("nonce"), sent_at=time.time())
+
+    def _send_batch(self, items: List[Dict[str, Any]]) -> None:
+        attempts = {it["decision_id"]: int(it["attempts"]) + 1 for it in items}
+        try:
+            res = self.send_batch_fn([(it["decision_id"], it["tx_ref_hash"]) for it in items])
+        except BackendUnavailable as e:
+            self._defer(list(attempts), e)
+            return
+        except Exception as e:
+            for d, a in attempts.items():
+                self._retry_or_fail(d, a, e, expect="sending")
+            return
+        self._available()
+        for d in res.get("skipped") or []:
+            self._finish(d, "sending", status="skipped", attempts=attempts[d], last_error="already_recorded")
+        now = time.time()
+        for d in res.get("sent") or []:
+            self._finish(d, "sending", status="sent", attempts=attempts[d], last_error=None,
+                         tx_hash=res["tx_hash"], nonce=res.get("nonce"), sent_at=now)
+
+    def _poll_receipts(self, limit: int = 256) -> int:
+        """Revisa las tx en vuelo (las más viejas primero); un receipt por tx_hash. Devuelve filas cerradas."""
+        rows = self._conn().execute(
+            f"SELECT {', '.join(_COLS)} FROM outbox WHERE status = 'sent' ORDER BY sent_at LIMIT ?",
+            (limit,)).fetchall()
+        by_tx: Dict[str, List[Dict[str, Any]]] = {}
+        for item in map(self._row, rows):
+            by_tx.setdefault(item["tx_hash"], []).append(item)
+        closed = 0
+        for txh, group in by_tx.items():
+            try:
+                rec = self.receipt_fn(txh)
+            except BackendUnavailable:
+                break  # siguen 'sent'; se consultan cuando vuelva el backend
+            except Exception as e:  # revertida
+                for item in group:
+                    self._retry_or_fail(item["decision_id"], int(item["attempts"]), e, expect="sent")
+                closed += len(group)
+                continue
+            if rec is None:
+                if time.time() - float(group[0]["sent_at"] or 0.0) > self.receipt_timeout_s:
+                    try:
+                        closed += self._expire(txh)
+                    except BackendUnavailable:
+                        break
+                continue
+            closed += self._confirm(group, txh, int(rec["blockNumber"]))
+        return closed
+
+    def _confirm(self, group: List[Dict[str, Any]], txh: str, bn: int) -> int:
+        closed = 0
+        for item in group:
+            d = item["decision_id"]
+            # Solo quien gana la transición sent -> confirmed registra el evento
+            if self._finish(d, "sent", status="confirmed", tx_hash=txh, block_number=bn):
+                closed += 1
+                CONFIRM_SECONDS.observe(time.time() - float(item["created_at"]))
+                if self.on_confirmed is not None:
+                    try:
+                        self.on_confirmed(d, item["tx_ref_hash"], txh, bn)
+                    except Exception as e:
+                        logger.error(f"OUTBOX on_confirmed error | decision_id={d}: {e}")
+        return closed
+
+    def _expire(self, txh: str) -> int:
+        """Tx sin receipt tras receipt_timeout_s (todas sus filas, no solo las del poll). Devuelve filas cerradas."""
+        group = [self._row(r) for r in self._conn().execute(
+            f"SELECT {', '.join(_COLS)} FROM outbox WHERE status = 'sent' AND tx_hash = ?", (txh,))]
+        if not group:
+            return 0
+        err: Exception = TimeoutError(f"sin receipt para {txh} en {self.receipt_timeout_s:.0f}s")
+        nonce = group[0]["nonce"]
+        if nonce is not None and self.nonce_fn is not None:
+            if self.nonce_fn() <= int(nonce):
+                return self._resend(group, int(nonce), err)
+            # Nonce usado: si fue una de nuestras copias, su receipt tiene que estar
+            hashes = [txh] + [h for h in (group[0]["prev_tx_hashes"] or "").split(",") if h]
+            for h in hashes:
+                try:
+                    rec = self.receipt_fn(h)
+                except BackendUnavailable:
+                    raise
+                except Exception as e:  # revertida: nonce consumido sin registrar
+                    err = e
+                    break
+                if rec is not None:
+                    return self._confirm(group, h, int(rec["blockNumber"]))
+            else:
+                err = RuntimeError(f"nonce {nonce} usado por otra tx (sin receipt de {', '.join(hashes)})")
+        for item in group:
+            self._retry_or_fail(item["decision_id"], int(item["attempts"]), err, expect="sent")
+        return len(group)
+
+    def _resend(self, group: List[Dict[str, Any]], nonce: int, err: Exception) -> int:
+        """Reemplazo con el mismo nonce y fees subidas; la copia anterior queda en prev_tx_hashes."""
+        attempts = max(int(it["attempts"]) for it in group) + 1
+        if attempts > self.max_attempts:
+            for item in group:
+                self._retry_or_fail(item["decision_id"], int(item["attempts"]), err, expect="sent")
+            return len(group)
+        txh = group[0]["tx_hash"]
+        prev = [h for h in (group[0]["prev_tx_hashes"] or "").split(",") if h] + [txh]
+        try:
+            if self.send_batch_fn is not None:
+                res = self.send_batch_fn([(it["decision_id"], it["tx_ref_hash"]) for it in group],
+                                         nonce=nonce, bump=len(prev))
+            else:
+                item = group[0]
+                res = self.send_fn(item["decision_id"], item["tx_ref_hash"], nonce=nonce, bump=len(prev))
+                res = {**res, "sent": [] if res.get("skipped") else [item["decision_id"]],
+                       "skipped": [item["decision_id"]] if res.get("skipped") else []}
+        except BackendUnavailable:
+            raise
+        except Exception as e:
+            # p.ej. "nonce too low" / "underpriced": la copia anterior sigue en el mempool o ya se
+            # minó; siguen 'sent' con su tx_hash y se revisa de nuevo tras otro receipt_timeout_s
+            logger.warning(f"OUTBOX reenvío nonce={nonce} de {txh} rechazado ({e}); se sigue esperando")
+            for item in group:
+                self._finish(item["decision_id"], "sent", last_error=str(e), sent_at=time.time())
+            return 0
+        now = time.time()
+        for d in res.get("skipped") or []:
+            self._finish(d, "sent", status="skipped", last_error="already_recorded")
+        for d in res.get("sent") or []:
+            self._finish(d, "sent", attempts=attempts, last_error=str(err), tx_hash=res["tx_hash"],
+                         prev_tx_hashes=",".join(prev), sent_at=now)
+        OUTBOX_RESULTS.labels("resent").inc(len(res.get("sent") or []))
+        logger.warning(f"OUTBOX reenvío | nonce={nonce} {txh} -> {res['tx_hash']} ({len(prev)}° reemplazo)")
+        return len(res.get("skipped") or [])
+
+    def _next_batch(self) -> Tuple[List[Dict[str, Any]], Optional[float]]:
+        """Lote a enviar si se cumple la política de vaciado; si no, segundos hasta que venza."""
+        n, oldest = self._due()
+        if not n:
+            return [], None
+        wait = oldest + self.batch_max_age_s - time.time()
+        if n < self.batch_size and wait > 0:
+            return [], wait
+        return self._claim(self.batch_size), None
+
+    def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            try:
+                self._poll_receipts()
+                in_flight = self._in_flight()
+                items, batch_wait = [], None
+                if in_flight >= self.max_in_flight:
+                    pass
+                elif self.send_batch_fn is not None:
+                    items, batch_wait = self._next_batch()
+                    if items:
+                        self._send_batch(items)
+                else:
+                    items = self._claim(self.max_in_flight - in_flight)
+                    for item in items:
+                        self._send(item)
+            except Exception as e:
+                logger.error(f"OUTBOX loop error: {e}")
+                items, in_flight, batch_wait = [], 0, None
+            if items:
+                continue
+            # Con tx en vuelo se consulta seguido; ocioso, se espera a un enqueue o al poll
+            wait = self.receipt_poll_s if in_flight else self.poll_s
+            if batch_wait is not None:
+                wait = min(wait, max(batch_wait, 0.01))
+            self._wake.wait(wait)
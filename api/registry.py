@@ -0,0 +1,198 @@
+﻿# -*- coding: utf-8 -*-
+"""
+api/registry.py — modelo servido con recarga en caliente desde models/registry/
+- ModelBundle: modelo + bosque empaquetado + features + umbral + versión, inmutable una vez armado
+- El bosque empaquetado se persiste junto al modelo (<versión>/packed/, .npy) y se abre con
+  mmap: varios procesos comparten las mismas páginas. El sklearn completo solo se carga si
+  hace falta (lotes > PACKED_MAX_ROWS o modelos que no son árboles)
+- ModelRegistry vigila current.json (src/model_registry.py) cada REGISTRY_POLL_S; una versión
+  nueva se carga y calienta (predict sobre un lote dummy) en background y recién entonces se
+  publica con un único cambio de referencia: los requests en curso terminan con su bundle
+- Sin registro (instalaciones previas): models/model.joblib + features.json + último rf_*.json,
+  versión "legacy-<sha256[:12]>"
+"""
+
+from __future__ import annotations
+import os, json, time, shutil, threading, logging
+from typing import Any, Dict, Optional
+import numpy as np
+
+from .forest import PackedForest
+from src.artifacts import load_latest
+from src.model_registry import REGISTRY_DIR, current_version, read_manifest, file_sha256
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+MODELS_DIR = os.path.join(ROOT, "models")
+REPORTS_DIR = os.path.join(ROOT, "reports")
+REGISTRY_POLL_S = float(os.getenv("REGISTRY_POLL_S") or 2.0)
+# Evaluador: "packed" (api/forest.py) hasta PACKED_MAX_ROWS filas, sklearn por encima; "sklearn" = siempre sklearn
+FOREST_ENGINE = os.getenv("FOREST_ENGINE") or "packed"
+PACKED_MAX_ROWS = int(os.getenv("PACKED_MAX_ROWS") or 256)
+# Filas del lote dummy de calentamiento (cubre el camino empaquetado y el de 1 fila)
+WARMUP_ROWS = int(os.getenv("WARMUP_ROWS") or 64)
+# Abrir los arrays del bosque con mmap (compartidos entre workers); 0 = copia en memoria
+MODEL_MMAP = (os.getenv("MODEL_MMAP") or "1") != "0"
+
+logger = logging.getLogger("fraudchain.registry")
+
+class ModelBundle:
+    """Todo lo necesario para puntuar con una versión de modelo."""
+
+    def __init__(self, version: str, model_path: str, features, threshold: float, sha256: str = "",
+                 packed_dir: Optional[str] = None):
+        self.version = version
+        self.model_path = model_path
+        self.features = list(features)
+        self.threshold = float(threshold)
+        self.sha256 = sha256
+        self._model = None
+        self._model_lock = threading.Lock()
+        self.packed: Optional[PackedForest] = None
+        if FOREST_ENGINE == "packed":
+            self.packed = self._open_packed(packed_dir)
+        self.loaded_at = time.time()
+
+    def _open_packed(self, packed_dir: Optional[str]) -> Optional[PackedForest]:
+        if packed_dir and os.path.exists(os.path.join(packed_dir, "meta.json")):
+            return PackedForest.load(packed_dir, mmap_mode="r" if MODEL_MMAP else None)
+        try:
+            packed = PackedForest.from_sklearn(self.model)
+        except TypeError:
+            return None  # no es un ensamble de árboles: queda sklearn
+        if packed_dir:
+            # Primer proceso que lo ve lo persiste; escritura a un tmp + rename (otro worker pudo ganar)
+            tmp = f"{packed_dir}.tmp-{os.getpid()}"
+            try:
+                packed.save(tmp)
+                os.rename(tmp, packed_dir)
+            except OSError:
+                shutil.rmtree(tmp, ignore_errors=True)
+            if MODEL_MMAP and os.path.exists(os.path.join(packed_dir, "meta.json")):
+                self._model = None  # quien lo empaquetó tampoco retiene el sklearn (se recarga si hace falta)
+                return PackedForest.load(packed_dir, mmap_mode="r")
+        return packed
+
+    @property
+    def model(self):
+        """Modelo sklearn, cargado recién cuando se usa."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from joblib import load  # con el bosque empaquetado joblib/sklearn no se importan
+                    self._model = load(self.model_path)
+        return self._model
+
+    @property
+    def engine(self) -> str:
+        return "packed" if self.packed is not None else "sklearn"
+
+    def scores(self, X: np.ndarray) -> np.ndarray:
+        """Probabilidad de clase 1 (fraude) para cada fila de X."""
+        if self.packed is not None and len(X) <= PACKED_MAX_ROWS:
+            return self.packed.predict_proba(X)[:, 1]
+        if hasattr(self.model, "predict_proba"):
+            return self.model.predict_proba(X)[:, 1].astype(np.float64)
+        # Normalizo decision_function a [0,1] si hiciera falta
+        s = self.model.decision_function(X).astype(np.float64)
+        return (s - (-10.0)) / (10.0 - (-10.0))
+
+    def warmup(self) -> float:
+        """Predict sobre lotes dummy (1 y WARMUP_ROWS filas); devuelve ms."""
+        t0 = time.perf_counter()
+        X = np.zeros((max(1, WARMUP_ROWS), len(self.features)), dtype=np.float32)
+        self.scores(X[:1]); self.scores(X)
+        return (time.perf_counter() - t0) * 1000.0
+
+    def info(self) -> Dict[str, Any]:
+        return {"version": self.version, "sha256": self.sha256, "features": len(self.features),
+                "threshold": self.threshold, "engine": self.engine, "loaded_at": self.loaded_at,
+                "mmap": bool(self.packed is not None and MODEL_MMAP), "sklearn_loaded": self._model is not None}
+
+def load_bundle(version: Optional[str], registry_dir: str = REGISTRY_DIR) -> ModelBundle:
+    if version is None:
+        return _load_legacy()
+    m = read_manifest(version, registry_dir)
+    return ModelBundle(m["version"], m["model_path"], m["features"], m["threshold"], m.get("sha256", ""),
+                       packed_dir=os.path.join(os.path.dirname(m["model_path"]), "packed"))
+
+def _load_legacy() -> ModelBundle:
+    model_path = os.path.join(MODELS_DIR, "model.joblib")
+    with open(os.path.join(MODELS_DIR, "features.json"), "r", encoding="utf-8") as f:
+        features = json.load(f)["features"]
+    # Tomar el umbral del último rf_*.json (reports/manifest.json, sin glob)
+    found = load_latest("rf", REPORTS_DIR)
+    if found is None:
+        raise RuntimeError("No se encontró reports/rf_*.json con el umbral")
+    sha = file_sha256(model_path)
+    return ModelBundle(f"legacy-{sha[:12]}", model_path, features, found[0]["threshold"]["value"], sha,
+                       packed_dir=os.path.join(MODELS_DIR, f"packed_{sha[:12]}"))
+
+class ModelRegistry:
+    """Bundle actual + watcher que carga, calienta y publica versiones nuevas."""
+
+    def __init__(self, registry_dir: str = REGISTRY_DIR, poll_s: float = REGISTRY_POLL_S):
+        self.registry_dir = registry_dir
+        self.poll_s = float(poll_s)
+        self._bundle: Optional[ModelBundle] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.swaps = 0
+        self.last_error: Optional[str] = None
+
+    def current(self) -> ModelBundle:
+        b = self._bundle
+        if b is None:
+            with self._lock:
+                if self._bundle is None:
+                    self._bundle = self._load(current_version(self.registry_dir))
+                b = self._bundle
+            self.start()
+        return b
+
+    def _load(self, version: Optional[str]) -> ModelBundle:
+        t0 = time.perf_counter()
+        b = load_bundle(version, self.registry_dir)
+        warm_ms = b.warmup()
+        logger.info(f"MODEL cargado | version={b.version} engine={b.engine} "
+                    f"load={(time.perf_counter() - t0) * 1000.0:.0f}ms warmup={warm_ms:.1f}ms")
+        return b
+
+    def check(self) -> bool:
+        """Si current.json apunta a otra versión: cargar, calentar y publicar. True si hubo swap."""
+        version = current_version(self.registry_dir)
+        cur = self._bundle
+        if version is None or (cur is not None and cur.version == version):
+            return False
+        try:
+            b = self._load(version)
+        except Exception as e:
+            # La versión rota no se publica: se sigue sirviendo la actual
+            self.last_error = f"{version}: {e}"
+            logger.error(f"MODEL no se pudo cargar {version}: {e}")
+            return False
+        with self._lock:
+            old, self._bundle = self._bundle, b
+            self.swaps += 1
+        self.last_error = None
+        logger.info(f"MODEL swap | {old.version if old else None} -> {b.version}")
+        return True
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="model-registry", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.poll_s)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"MODEL watcher error: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        b = self._bundle
+        return {**(b.info() if b else {}), "swaps": self.swaps, "last_error": self.last_error}
@@ -0,0 +1,179 @@
+﻿# -*- coding: utf-8 -*-
+"""
+api/serve.py — entrada de producción pre-fork para el API
+- El padre abre el socket, prepara el bosque empaquetado en disco (.npy) y hace fork de N
+  workers; cada worker corre un servidor werkzeug con threads sobre el socket heredado
+- Los workers abren el bosque con mmap (api/registry.py): las páginas del modelo están una
+  sola vez en el page cache y la memoria por worker no crece con el tamaño del bosque
+- api.app se importa recién en cada hijo (conexiones SQLite / RPC no cruzan el fork)
+- Solo el worker 0 corre el submitter del outbox (nonces locales); el resto solo encola
+- Cada worker escribe su access log (logs/requests.<i>.jsonl, api/access_log.py)
+- Cada worker informa cold start (fork -> listo, con el modelo caliente), RSS y PSS;
+  el resumen queda en reports/serve_workers.json
+- El padre reinicia workers que mueren; Ctrl+C / SIGTERM los baja a todos
+- Sin os.fork (Windows): un solo proceso con threads, mismo código
+Uso:
+  python -m api.serve --workers 4 --port 5000
+"""
+
+from __future__ import annotations
+import os, sys, json, time, socket, signal, argparse
+from typing import Dict, Optional
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+REPORTS_DIR = os.path.join(ROOT, "reports")
+SERVE_WORKERS = int(os.getenv("SERVE_WORKERS") or (os.cpu_count() or 1))
+SERVE_HOST = os.getenv("SERVE_HOST") or "127.0.0.1"
+SERVE_PORT = int(os.getenv("SERVE_PORT") or 5000)
+
+def memory_mb() -> Dict[str, Optional[float]]:
+    """RSS y PSS (RSS repartiendo las páginas compartidas) del proceso actual, en MB."""
+    out: Dict[str, Optional[float]] = {"rss_mb": None, "pss_mb": None}
+    try:
+        with open("/proc/self/smaps_rollup", "r") as f:
+            for line in f:
+                k, _, v = line.partition(":")
+                if k in ("Rss", "Pss"):
+                    out[f"{k.lower()}_mb"] = int(v.split()[0]) / 1024.0
+        return out
+    except OSError:
+        pass
+    try:
+        import resource  # máximo histórico; en Linux en KB, en macOS en bytes
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        out["rss_mb"] = rss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+    except ImportError:
+        pass
+    return out
+
+def prepare() -> str:
+    """En el padre: carga la versión actual una vez y deja su bosque empaquetado en disco."""
+    from .registry import load_bundle
+    from src.model_registry import current_version
+    # Si falta <versión>/packed/ se arma desde el sklearn y se guarda; el padre no retiene el modelo
+    return load_bundle(current_version()).version
+
+def _bind(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(256)
+    sock.set_inheritable(True)
+    return sock
+
+def _worker(index: int, sock: Optional[socket.socket], host: str, port: int, t_fork: float) -> None:
+    """Cuerpo de un worker (hijo del fork, o el único proceso si no hay fork)."""
+    os.environ["OUTBOX_SUBMITTER"] = "1" if index == 0 else "0"
+    if sock is not None:
+        # Un access log por worker: la rotación no se coordina entre procesos
+        base, ext = os.path.splitext(os.getenv("ACCESS_LOG") or os.path.join(ROOT, "logs", "requests.jsonl"))
+        os.environ["ACCESS_LOG"] = f"{base}.{index}{ext}"
+    from werkzeug.serving import make_server
+    from .app import app, _outbox, _registry, start_local_indexer
+
+    b = _registry.current()  # carga por mmap + calentamiento antes de aceptar tráfico
+    _outbox.start()          # no-op salvo en el worker 0
+    start_local_indexer()    # ídem, y solo con CHAIN_BACKEND=local
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno() if sock is not None else None)
+    info = {"worker": index, "pid": os.getpid(), "model_version": b.version,
+            "cold_start_ms": (time.perf_counter() - t_fork) * 1000.0, **memory_mb()}
+    os.makedirs(REPORTS_DIR, exist_ok=True)
+    with open(os.path.join(REPORTS_DIR, f".serve_worker_{index}.json"), "w", encoding="utf-8") as f:
+        json.dump(info, f)
+    print(f"[worker {index}] pid={info['pid']} cold_start={info['cold_start_ms']:.0f}ms "
+          f"rss={info['rss_mb'] or 0:.1f}MB pss={info['pss_mb'] or 0:.1f}MB", flush=True)
+    server.serve_forever()
+
+def _summary(n: int, timeout_s: float = 120.0) -> None:
+    """Espera el reporte de los n workers y escribe reports/serve_workers.json."""
+    paths = [os.path.join(REPORTS_DIR, f".serve_worker_{i}.json") for i in range(n)]
+    deadline = time.time() + timeout_s
+    while time.time() < deadline and not all(os.path.exists(p) for p in paths):
+        time.sleep(0.2)
+    workers = []
+    for p in paths:
+        try:
+            with open(p, "r", encoding="utf-8") as f:
+                workers.append(json.load(f))
+        except (OSError, ValueError):
+            pass
+    def _sum(k):
+        vals = [w[k] for w in workers if w.get(k) is not None]
+        return sum(vals) if vals else None
+    out = {"workers": workers, "n": len(workers), "parent": {"pid": os.getpid(), **memory_mb()},
+           "total_rss_mb": _sum("rss_mb"), "total_pss_mb": _sum("pss_mb"),
+           "cold_start_ms_max": max((w["cold_start_ms"] for w in workers), default=None)}
+    with open(os.path.join(REPORTS_DIR, "serve_workers.json"), "w", encoding="utf-8") as f:
+        json.dump(out, f, indent=2)
+    print(f"OK → {len(workers)}/{n} workers listos | RSS total={out['total_rss_mb'] or 0:.1f}MB "
+          f"PSS total={out['total_pss_mb'] or 0:.1f}MB | reports/serve_workers.json", flush=True)
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=SERVE_WORKERS)
+    ap.add_argument("--host", default=SERVE_HOST)
+    ap.add_argument("--port", type=int, default=SERVE_PORT)
+    args = ap.parse_args()
+
+    if not hasattr(os, "fork") or args.workers <= 1:
+        if args.workers > 1:
+            print("[WARN] Sin os.fork en esta plataforma: un solo proceso con threads", flush=True)
+        _worker(0, None, args.host, args.port, time.perf_counter())
+        return
+
+    t0 = time.perf_counter()
+    version = prepare()
+    print(f"Modelo {version} empaquetado en disco ({(time.perf_counter() - t0) * 1000.0:.0f}ms); "
+          f"lanzando {args.workers} workers en http://{args.host}:{args.port}", flush=True)
+    for i in range(args.workers):
+        p = os.path.join(REPORTS_DIR, f".serve_worker_{i}.json")
+        if os.path.exists(p):
+            os.remove(p)
+    sock = _bind(args.host, args.port)
+
+    children: Dict[int, int] = {}  # pid -> índice
+    stopping = False
+
+    def spawn(index: int) -> None:
+        t_fork = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                _worker(index, sock, args.host, args.port, t_fork)
+            finally:
+                os._exit(0)
+        children[pid] = index
+
+    def stop(*_):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for i in range(args.workers):
+        spawn(i)
+    _summary(args.workers)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = children.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"[WARN] worker {index} (pid={pid}) terminó con estado {status}; reiniciando", flush=True)
+            time.sleep(0.5)
+            spawn(index)
+    sock.close()
+
+if __name__ == "__main__":
+    main()
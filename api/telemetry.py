@@ -0,0 +1,248 @@
+﻿# -*- coding: utf-8 -*-
+"""
+api/telemetry.py — métricas en proceso con exposición en formato Prometheus (GET /metrics)
+- Counter / Gauge / Histogram con labels; el hijo de cada combinación de labels se crea una
+  vez y queda cacheado, así una medición es un dict lookup + una suma bajo un lock
+- Histogram con buckets fijos en segundos (bisect; sin listas por observación)
+- stage(op, name): context manager que alimenta fraudchain_stage_seconds{op,stage}; es lo que
+  usan los handlers y api/chain.py para partir la latencia por etapa
+- on_collect(fn): funciones que se evalúan recién al exportar (estado del outbox, modelo, ...)
+- capture_stages(): además del histograma, las etapas medidas en el contexto actual (el hilo
+  del request) se acumulan en un dict; api/logging_mw.py lo vuelca en el access log
+- TELEMETRY_ENABLED=0 deja stage() como no-op (los contadores siguen)
+- Las métricas son del proceso: con api/serve.py cada worker expone las suyas
+"""
+
+from __future__ import annotations
+import os, time, bisect, threading
+from contextvars import ContextVar, Token
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+TELEMETRY_ENABLED = (os.getenv("TELEMETRY_ENABLED") or "1") != "0"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# 100 µs .. 10 s: cubre desde un predict empaquetado hasta un receipt
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) and not v.is_integer() else str(int(v))
+
+def _escape(v: str) -> str:
+    return v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Value:
+    """Hijo de un Counter / Gauge."""
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, n: float = 1.0) -> None:
+        with self._lock:
+            self.value += n
+
+    def set(self, v: float) -> None:
+        self.value = float(v)
+
+# Etapas del request en curso (None fuera de un request o si nadie las captura)
+_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar("fraudchain_stages", default=None)
+
+class _Timer:
+    __slots__ = ("_child", "_name", "_t0")
+
+    def __init__(self, child: "_HistogramValue", name: Optional[str] = None):
+        self._child = child
+        self._name = name
+
+    def __enter__(self) -> "_Timer":
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        dt = time.perf_counter() - self._t0
+        self._child.observe(dt)
+        if self._name is not None:
+            d = _stages.get()
+            if d is not None:
+                d[self._name] = d.get(self._name, 0.0) + dt
+        return False
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+_NOOP = _NoopTimer()
+
+class _HistogramValue:
+    """Hijo de un Histogram: conteo por bucket (no acumulado), suma y total."""
+    __slots__ = ("_lock", "_bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # el último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, v: float) -> None:
+        i = bisect.bisect_left(self._bounds, v)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+            self.count += 1
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def _new_child(self):
+        return _Value()
+
+    def labels(self, *values, **kw):
+        if not kw:
+            child = self._children.get(values)  # camino rápido: labels ya como str
+            if child is not None:
+                return child
+        key = tuple(str(kw[n]) for n in self.labelnames) if kw else tuple(map(str, values))
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: se esperan labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _items(self) -> List[Tuple[Tuple[str, ...], object]]:
+        with self._lock:
+            return list(self._children.items())
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in self._items():
+            out.append(f"{self.name}{_labels(self.labelnames, key)} {_fmt(child.value)}")
+        return out
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, n: float = 1.0) -> None:
+        self.labels().inc(n)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, v: float) -> None:
+        self.labels().set(v)
+
+    def clear(self) -> None:
+        """Borra todas las series (gauges que se recalculan completos en cada export)."""
+        with self._lock:
+            self._children.clear()
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, v: float) -> None:
+        self.labels().observe(v)
+
+    def render(self) -> List[str]:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, h in self._items():
+            with h._lock:
+                counts, total, n = list(h.counts), h.sum, h.count
+            acc = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                acc += c
+                le = 'le="' + _fmt(bound) + '"'
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {acc}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(total)}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return out
+
+# ---------- registro del proceso ----------
+_metrics: Dict[str, _Metric] = {}
+_collectors: List[Callable[[], None]] = []
+_reg_lock = threading.Lock()
+
+def _get_or_create(cls, name: str, help: str, labelnames: Sequence[str], **kw) -> _Metric:
+    with _reg_lock:
+        m = _metrics.get(name)
+        if m is None:
+            m = _metrics[name] = cls(name, help, labelnames, **kw)
+        elif not isinstance(m, cls):
+            raise ValueError(f"{name} ya está registrada como {m.kind}")
+        return m
+
+def counter(name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+    return _get_or_create(Counter, name, help, labelnames)
+
+def gauge(name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return _get_or_create(Gauge, name, help, labelnames)
+
+def histogram(name: str, help: str, labelnames: Sequence[str] = (),
+              buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return _get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+def on_collect(fn: Callable[[], None]) -> None:
+    """fn() se llama antes de cada export (típicamente para actualizar gauges)."""
+    _collectors.append(fn)
+
+STAGE_SECONDS = histogram("fraudchain_stage_seconds", "Duración de cada etapa de una operación", ("op", "stage"))
+
+def stage(op: str, name: str):
+    """with stage("score", "predict"): ...  -> fraudchain_stage_seconds{op="score",stage="predict"}"""
+    if not TELEMETRY_ENABLED:
+        return _NOOP
+    return _Timer(STAGE_SECONDS.labels(op, name), name)
+
+def capture_stages() -> Tuple[Dict[str, float], Token]:
+    """Empieza a acumular etapas (segundos) en el contexto actual; release(token) al terminar."""
+    d: Dict[str, float] = {}
+    return d, _stages.set(d)
+
+def release_stages(token: Token) -> None:
+    _stages.reset(token)
+
+def render() -> str:
+    """Todas las métricas del proceso en formato de texto Prometheus."""
+    for fn in list(_collectors):
+        try:
+            fn()
+        except Exception:
+            pass  # un collector roto no tira el endpoint
+    with _reg_lock:
+        metrics = list(_metrics.values())
+    lines: List[str] = []
+    for m in metrics:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
@@ -1,24 +1,33 @@
 ﻿# -*- coding: utf-8 -*-
-import os, json, glob, shutil
-import pandas as pd
+import os, sys, shutil
 import plotly.graph_objects as go
-from dash import Dash, dcc, html, dash_table
-from dash.dependencies import Input, Output
+from dash import Dash, dcc, html, dash_table, no_update
+from dash.dependencies import Input, Output, State
 from web3 import Web3
 from datetime import datetime
 
+from event_feed import EventFeed, IndexFeed
+
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)  # se ejecuta como script: python .\dashboard\app.py
+from src.artifacts import load_json, load_latest
+from api.indexer import SecureTxIndex, index_path
+
 REPORTS = os.path.join(ROOT, "reports")
 ENV = os.path.join(ROOT, ".env")
 EVENTS_CSV = os.path.join(ROOT, "events.csv")
+E2E_SUMMARY = os.path.join(REPORTS, "e2e_summary.json")
+# Origen de la tabla de eventos: "csv" | "index" (api/indexer.py) | "auto" = el índice con
+# CHAIN_BACKEND=local (no escribe events.csv; el que haya es de la cadena real) o si no hay events.csv
+EVENTS_SOURCE = (os.getenv("DASH_EVENTS_SOURCE") or "auto").lower()
+# Cada cuánto se mira si cambiaron los archivos (solo os.stat; los callbacks pesados corren si hubo cambios)
+WATCH_MS = int(os.getenv("DASH_WATCH_MS") or 1000)
 
 # ---------- helpers de carga ----------
 def load_rf():
-    paths = sorted(glob.glob(os.path.join(REPORTS, "rf_*.json")))
-    if not paths: 
-        return None
-    with open(paths[-1], "r", encoding="utf-8") as f:
-        return json.load(f)
+    found = load_latest("rf", REPORTS)
+    return found[0] if found else None
 
 def load_env():
     out = {}
@@ -29,33 +38,75 @@ def load_env():
                     k,v = line.strip().split("=",1); out[k]=v
     return out
 
-def load_events(n=200):
-    if not os.path.exists(EVENTS_CSV):
-        return pd.DataFrame(columns=["decision_id_hex","tx_ref_hash_hex","tx_hash","block_number"])
-    return pd.read_csv(EVENTS_CSV).tail(n)
+# Lector incremental: cada refresh parsea solo lo agregado a events.csv
+_feed = EventFeed(EVENTS_CSV)
+_index_feed = None
+CHAIN_BACKEND = (os.getenv("CHAIN_BACKEND") or load_env().get("CHAIN_BACKEND") or "rpc").lower()
 
-def load_e2e_summary():
-    p = os.path.join(REPORTS, "e2e_summary.json")
-    if not os.path.exists(p): 
+def events_source():
+    """(feed, archivos a vigilar): events.csv o el índice on-chain según EVENTS_SOURCE."""
+    global _index_feed
+    db = index_path(CHAIN_BACKEND)
+    use_csv = EVENTS_SOURCE == "csv" or (EVENTS_SOURCE == "auto" and CHAIN_BACKEND != "local" and
+                                         (os.path.exists(EVENTS_CSV) or not os.path.exists(db)))
+    if use_csv:
+        return _feed, [EVENTS_CSV]
+    if _index_feed is None or _index_feed.index.path != db:
+        _index_feed = IndexFeed(SecureTxIndex(db))
+    # WAL: las escrituras nuevas cambian el -wal antes que la base
+    return _index_feed, [db, db + "-wal"]
+
+def load_events(page=0, page_size=10, sort_by=None, filter_query=None, q=None):
+    """Una página del historial completo (orden/filtro resueltos con los índices del feed)."""
+    q = q if isinstance(q,str) else None
+    feed, _ = events_source()
+    return feed.query(q=q, filter_query=filter_query, sort_by=sort_by,
+                      offset=page*page_size, limit=page_size)
+
+def file_stamp(path):
+    """Versión barata de un archivo: (inode, tamaño, mtime); None si no existe."""
+    try:
+        st = os.stat(path)
+    except OSError:
         return None
+    return [st.st_ino, st.st_size, st.st_mtime_ns]
+
+def load_e2e_summary():
+    # Cache por (tamaño, mtime): solo se re-parsea si el archivo cambió
     try:
-        with open(p,"r",encoding="utf-8") as f: 
-            return json.load(f)
+        return load_json(E2E_SUMMARY)
     except Exception:
         return None
 
 # ---------- componentes ----------
-def pr_curve_component():
-    img_path = os.path.join(REPORTS, "pr_curve.png")
+def report_image(name, title):
+    """reports/<name> copiado a assets/ (Dash sirve de ahí); figura vacía si todavía no existe."""
+    img_path = os.path.join(REPORTS, name)
     assets_dir = os.path.join(os.path.dirname(__file__), "assets"); os.makedirs(assets_dir, exist_ok=True)
-    dst_img = os.path.join(assets_dir, "pr_curve.png")
+    dst_img = os.path.join(assets_dir, name)
     if os.path.exists(img_path):
         try: shutil.copyfile(img_path, dst_img)
         except Exception: pass
-        return html.Img(src="/assets/pr_curve.png", style={"maxWidth":"100%","borderRadius":"8px","boxShadow":"0 2px 10px rgba(0,0,0,.05)"})
-    fig = go.Figure(); fig.update_layout(height=380, margin=dict(l=10,r=10,t=30,b=10), title="PR Curve")
+        return html.Img(src=f"/assets/{name}", style={"maxWidth":"100%","borderRadius":"8px","boxShadow":"0 2px 10px rgba(0,0,0,.05)"})
+    fig = go.Figure(); fig.update_layout(height=380, margin=dict(l=10,r=10,t=30,b=10), title=title)
     return dcc.Graph(figure=fig, config={"displayModeBar": False})
 
+def pr_curve_component():
+    return report_image("pr_curve.png", "PR Curve")
+
+def pareto_component():
+    """Frontera precisión vs latencia de scripts/bench_models.py y el candidato que entra en el SLO."""
+    found = load_latest("bench_models", REPORTS)
+    b = found[0] if found else {}
+    if b.get("slo_ms") is None:
+        note = "Sin SLO (--slo-ms)" if b else "Correr scripts/bench_models.py"
+    elif b.get("best_under_slo"):
+        note = f"Mejor dentro del SLO ({b['slo_ms']:g} ms p99): {b['best_under_slo']}"
+    else:
+        note = f"Ningún candidato entra en el SLO de {b['slo_ms']:g} ms"
+    return [report_image("pareto.png", "Precisión vs latencia"),
+            html.Div(note, className="text-secondary mt-2", style={"fontSize":"0.9rem"})]
+
 def kpi_card(title, value):
     return html.Div(className="card shadow-sm mb-3", style={"borderRadius":"16px"}, children=[
         html.Div(className="card-body", children=[
@@ -114,20 +165,28 @@ app.layout = html.Div(className="container-fluid py-4", children=[
     html.Div(className="row", children=[
         html.Div(className="col-12 col-lg-4", children=[
             html.H4("Precision-Recall Curve", className="mb-3"),
-            pr_curve_component()
+            pr_curve_component(),
+            html.H4("Precisión vs latencia", className="mt-4 mb-3"),
+            *pareto_component()
         ]),
         html.Div(className="col-12 col-lg-8", children=[
-            html.H4("Eventos on-chain (últimos)", className="mb-3"),
+            html.H4("Eventos on-chain", className="mb-3"),
             html.Div(className="d-flex gap-2 mb-2", children=[
                 dcc.Input(id="search", type="text", placeholder="Buscar decision_id / tx_hash", className="form-control", style={"maxWidth":"360px"}),
                 html.Button("Refresh", id="btn-refresh", n_clicks=0, className="btn btn-outline-primary"),
-                dcc.Interval(id="auto-ivl", interval=10_000, n_intervals=0)
+                dcc.Interval(id="watch-ivl", interval=WATCH_MS, n_intervals=0),
+                dcc.Store(id="events-version"),
+                dcc.Store(id="e2e-version")
             ]),
             dash_table.DataTable(
                 id="events-table",
-                data=load_events().to_dict("records"),
-                columns=[{"name":c, "id":c} for c in ["decision_id_hex","tx_ref_hash_hex","tx_hash","block_number"]],
-                page_size=10,
+                data=[],
+                columns=[{"name":c, "id":c, "type":("numeric" if c == "block_number" else "text")}
+                         for c in ["decision_id_hex","tx_ref_hash_hex","tx_hash","block_number"]],
+                # Paginado/orden/filtro del lado del servidor: el navegador recibe solo la página visible
+                page_current=0, page_size=10, page_count=1,
+                page_action="custom", sort_action="custom", sort_mode="single", sort_by=[],
+                filter_action="custom", filter_query="",
                 style_table={"overflowX":"auto", "maxHeight":"60vh", "overflowY":"auto"},
                 style_header={"position":"sticky","top":"0","zIndex":1,"backgroundColor":"#f8f9fa","fontWeight":"600","border":"1px solid #dee2e6"},
                 style_cell={"fontFamily":"Consolas, ui-monospace, Menlo, Monaco, 'Courier New', monospace","fontSize":"12px","whiteSpace":"nowrap","textOverflow":"ellipsis","maxWidth":"24ch","border":"1px solid #f1f3f5","padding":"6px"},
@@ -138,41 +197,61 @@ app.layout = html.Div(className="container-fluid py-4", children=[
 ])
 
 # ---------- callbacks ----------
+@app.callback(
+    Output("events-version","data"),
+    Output("e2e-version","data"),
+    Input("watch-ivl","n_intervals"),
+    State("events-version","data"),
+    State("e2e-version","data"),
+    prevent_initial_call=False
+)
+def watch_files(_n, ev_prev, e2e_prev):
+    # Sin cambios -> no_update: los callbacks que dependen de estas versiones no se disparan
+    ev, e2e = [file_stamp(p) for p in events_source()[1]], file_stamp(E2E_SUMMARY)
+    return (ev if ev != ev_prev else no_update), (e2e if e2e != e2e_prev else no_update)
+
 @app.callback(
     Output("events-table","data"),
+    Output("events-table","page_count"),
+    Output("events-table","page_current"),
     Output("ts-badge","children"),
-    Input("auto-ivl","n_intervals"),
+    Input("events-version","data"),
     Input("btn-refresh","n_clicks"),
     Input("search","value"),
+    Input("events-table","page_current"),
+    Input("events-table","page_size"),
+    Input("events-table","sort_by"),
+    Input("events-table","filter_query"),
     prevent_initial_call=False
 )
-def refresh_events(_n, _c, q):
-    df = load_events()
-    if q and isinstance(q,str) and q.strip():
-        ql = q.strip().lower()
-        for col in ["decision_id_hex","tx_ref_hash_hex","tx_hash"]:
-            if col in df.columns:
-                df = df[df[col].astype(str).str.lower().str.contains(ql)]
+def refresh_events(_n, _c, q, page, page_size, sort_by, filter_query):
+    page_size = page_size or 10
+    rows, total = load_events(page or 0, page_size, sort_by, filter_query, q)
+    page_count = max(1, -(-total // page_size))
+    current = no_update
+    if (page or 0) >= page_count:
+        # El filtro achicó el resultado: mostrar la última página válida y mover el paginador a ella
+        current = page_count - 1
+        rows, _ = load_events(current, page_size, sort_by, filter_query, q)
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    return df.to_dict("records"), ts
+    return rows, page_count, current, ts
 
 @app.callback(
     Output("card-p95s","children"),
     Output("card-p95e","children"),
     Output("card-corr","children"),
-    Input("auto-ivl","n_intervals"),
+    Input("e2e-version","data"),
     Input("btn-refresh","n_clicks"),
     prevent_initial_call=False
 )
 def refresh_operational(_n, _c):
     e = load_e2e_summary() or {}
-    p95s = e.get("p95_scoring_ms", 0.0)
-    p95e = e.get("p95_e2e_ms", 0.0)
-    corr = e.get("correlation_secure_to_event_pct", 0.0)
+    # null en el resumen = no medido en esa corrida (p.ej. --event-timeout 0)
+    fmt = lambda v: "n/a" if v is None else f"{v:.1f}"
     return (
-        kpi_card("p95 scoring (ms)", f"{p95s:.1f}"),
-        kpi_card("p95 E2E (ms)", f"{p95e:.1f}"),
-        kpi_card("Correlación secure→evento (%)", f"{corr:.1f}")
+        kpi_card("p95 scoring (ms)", fmt(e.get("p95_scoring_ms", 0.0))),
+        kpi_card("p95 E2E (ms)", fmt(e.get("p95_e2e_ms", 0.0))),
+        kpi_card("Correlación secure→evento (%)", fmt(e.get("correlation_secure_to_event_pct", 0.0)))
     )
 
 if __name__ == "__main__":
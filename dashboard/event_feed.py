@@ -0,0 +1,280 @@
+﻿# -*- coding: utf-8 -*-
+"""
+dashboard/event_feed.py — lector incremental de events.csv para el dashboard
+- Recuerda el offset en bytes: cada refresh() parsea solo las líneas nuevas (completas)
+- Ring buffer acotado con las últimas filas (lo que muestra la tabla por defecto)
+- Índices de prefijo por columna hex (listas ordenadas + bisect) sobre TODO el historial;
+  guardan (clave, offset) y las filas encontradas se leen del archivo con seek. Cada refresh()
+  junta los pares nuevos, los ordena una vez y los mezcla con el índice en una pasada (la primera
+  carga es un solo sort), en vez de un insort O(n) por fila
+- Claves normalizadas: minúsculas y sin '0x' (events.csv mezcla tx_hash con y sin prefijo)
+- query(): página + total para la DataTable con paginado/orden/filtro del lado del servidor
+  (filter_query de Dash); sin filtros, ordenar y paginar es un slice del índice; con filtros
+  se ordenan solo los candidatos (claves por fila en orden de archivo), salvo que sean más de
+  1/8 de las filas: ahí se recorre el índice
+- Si el archivo se reescribe (export_csv, rotación) se reindexa desde cero
+- IndexFeed: misma interfaz de query() sobre el índice on-chain (api/indexer.py, SecureTxIndex);
+  el dashboard lo usa cuando no hay events.csv (p.ej. CHAIN_BACKEND=local no lo escribe)
+"""
+
+from __future__ import annotations
+import os, re, csv, threading
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+FIELDS = ["decision_id_hex", "tx_ref_hash_hex", "tx_hash", "block_number"]
+HEX_FIELDS = ("decision_id_hex", "tx_ref_hash_hex", "tx_hash")
+FEED_RING_SIZE = int(os.getenv("FEED_RING_SIZE") or 1000)
+
+# Cláusula de filter_query de Dash: {col} op valor  (op simbólico o textual, con prefijo s/i de mayúsculas)
+_CLAUSE = re.compile(r"^\{(?P<col>[^}]+)\}\s*(?P<op>[si]?(?:>=|<=|!=|>|<|=|eq|ne|gt|ge|lt|le|contains|datestartswith))"
+                     r"\s*(?P<val>.*)$")
+_OPS = {"eq": "=", "ne": "!=", "gt": ">", "ge": ">=", "lt": "<", "le": "<="}
+
+def parse_filter(filter_query: Optional[str]) -> List[Tuple[str, str, str]]:
+    """'{a} contains 0x1 && {b} > 5' -> [(a, 'contains', '0x1'), (b, '>', '5')]; ignora lo que no entiende."""
+    out = []
+    for part in (filter_query or "").split(" && "):
+        m = _CLAUSE.match(part.strip())
+        if not m:
+            continue
+        op = m.group("op").lstrip("si")
+        val = m.group("val").strip()
+        if len(val) >= 2 and val[0] == val[-1] and val[0] in "\"'`":
+            val = val[1:-1]
+        out.append((m.group("col"), _OPS.get(op, op), val))
+    return out
+
+def norm_hex(s: str) -> str:
+    s = (s or "").strip().lower()
+    return s[2:] if s.startswith("0x") else s
+
+def _merge(idx: List[Tuple[Any, int]], new: List[Tuple[Any, int]]) -> None:
+    """
+    Agrega new (sin orden) a idx (ordenado). Solo se toca la cola de idx desde la primera clave
+    nueva: timsort ve dos corridas ordenadas y las mezcla en tiempo lineal. Con claves crecientes
+    (block_number, offsets) la cola es vacía y el costo es el de las filas nuevas.
+    """
+    new.sort()
+    i = bisect_left(idx, new[0]) if new else len(idx)
+    if i == len(idx):
+        idx.extend(new)
+        return
+    tail = idx[i:]
+    del idx[i:]
+    tail.extend(new)
+    tail.sort()
+    idx.extend(tail)
+
+class EventFeed:
+    """Vista incremental e indexada de events.csv (segura entre threads de Dash)."""
+
+    def __init__(self, path: str, capacity: int = FEED_RING_SIZE):
+        self.path = path
+        self.capacity = max(1, int(capacity))
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self._offset = 0
+        self._ino: Optional[int] = None
+        self._fields = list(FIELDS)
+        self._ring: deque = deque(maxlen=self.capacity)
+        self._offsets: List[int] = []                        # offset de cada fila, en orden de archivo
+        self._index: Dict[str, List[Tuple[Any, int]]] = {c: [] for c in HEX_FIELDS}
+        self._index["block_number"] = []
+        self._keys: Dict[str, List[Any]] = {c: [] for c in self._index}  # clave de cada fila, paralelo a _offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    @property
+    def version(self) -> Tuple[Optional[int], int]:
+        """Cambia cada vez que entran filas nuevas o el archivo se reemplaza."""
+        return self._ino, self._offset
+
+    def _parse(self, line: bytes) -> Optional[Dict[str, Any]]:
+        vals = next(csv.reader([line.decode("utf-8-sig").rstrip("\r\n")]), None)
+        if not vals or len(vals) < len(self._fields):
+            return None
+        row = dict(zip(self._fields, vals))
+        try:
+            row["block_number"] = int(row.get("block_number") or 0)
+        except ValueError:
+            pass
+        return row
+
+    def refresh(self) -> int:
+        """Parsea lo agregado desde la última llamada; devuelve filas nuevas."""
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                if self._offsets:
+                    self._reset()
+                return 0
+            if (self._ino is not None and st.st_ino != self._ino) or st.st_size < self._offset:
+                self._reset()
+            self._ino = st.st_ino
+            if st.st_size == self._offset:
+                return 0
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                chunk = f.read(st.st_size - self._offset)
+            end = chunk.rfind(b"\n") + 1     # una línea a medio escribir queda para el próximo refresh
+            pos, added = self._offset, 0
+            new: Dict[str, List[Tuple[Any, int]]] = {c: [] for c in self._index}
+            for line in chunk[:end].splitlines(keepends=True):
+                start, pos = pos, pos + len(line)
+                if start == 0:
+                    self._fields = next(csv.reader([line.decode("utf-8-sig").strip()]))
+                    continue
+                row = self._parse(line)
+                if row is None:
+                    continue
+                self._offsets.append(start)
+                self._ring.append(row)
+                bn = row.get("block_number")
+                for c in self._index:
+                    key = (bn if isinstance(bn, int) else -1) if c == "block_number" else norm_hex(str(row.get(c, "")))
+                    new[c].append((key, start))
+                    self._keys[c].append(key)
+                added += 1
+            for c, pairs in new.items():
+                _merge(self._index[c], pairs)
+            self._offset += end
+            return added
+
+    def tail(self, n: int = 200) -> List[Dict[str, Any]]:
+        """Últimas n filas (n acotado por el ring buffer), en orden de archivo."""
+        self.refresh()
+        with self._lock:
+            rows = list(self._ring)
+        return rows[-n:] if n < len(rows) else rows
+
+    def _read_at(self, offsets: List[int]) -> List[Dict[str, Any]]:
+        out = []
+        with open(self.path, "rb") as f:
+            for off in offsets:
+                f.seek(off)
+                row = self._parse(f.readline())
+                if row is not None:
+                    out.append(row)
+        return out
+
+    def _match(self, q: str, columns=HEX_FIELDS) -> List[int]:
+        """Offsets (orden de archivo) de filas cuyo valor en alguna columna empieza con q."""
+        hits = set()
+        for c in columns:
+            idx = self._index[c]
+            i = bisect_left(idx, (q, -1))
+            while i < len(idx) and idx[i][0].startswith(q):
+                hits.add(idx[i][1]); i += 1
+        return sorted(hits)
+
+    def _block_match(self, op: str, val: str) -> Optional[Set[int]]:
+        try:
+            v = int(float(val))
+        except ValueError:
+            return None
+        idx = self._index["block_number"]
+        lo, hi = bisect_left(idx, (v, -1)), bisect_left(idx, (v + 1, -1))
+        if op == "!=":
+            return {off for _, off in idx[:lo]} | {off for _, off in idx[hi:]}
+        bounds = {"=": (lo, hi), ">": (hi, len(idx)), ">=": (lo, len(idx)), "<": (0, lo), "<=": (0, hi)}.get(op)
+        return None if bounds is None else {off for _, off in idx[bounds[0]:bounds[1]]}
+
+    def _candidates(self, clauses: Iterable[Tuple[str, str, str]]) -> Optional[Set[int]]:
+        """Intersección de las cláusulas vía índices; None = sin filtro (todas las filas)."""
+        cand: Optional[Set[int]] = None
+        for col, op, val in clauses:
+            if col in HEX_FIELDS or col == "*":
+                if op not in ("contains", "=", "datestartswith"):
+                    continue
+                hits = set(self._match(norm_hex(val), HEX_FIELDS if col == "*" else (col,)))
+            elif col == "block_number":
+                hits = self._block_match(op, val)
+                if hits is None:
+                    continue
+            else:
+                continue
+            cand = hits if cand is None else cand & hits
+        return cand
+
+    def query(self, q: Optional[str] = None, filter_query: Optional[str] = None,
+              sort_by: Optional[List[Dict[str, str]]] = None,
+              offset: int = 0, limit: int = 10) -> Tuple[List[Dict[str, Any]], int]:
+        """
+        Una página (filas, total) sobre todo el historial.
+        q: prefijo en cualquier columna hex (buscador); filter_query / sort_by: formato de DataTable.
+        Orden por defecto: más nuevas primero.
+        """
+        self.refresh()
+        clauses = parse_filter(filter_query)
+        if q and norm_hex(q):
+            clauses.append(("*", "contains", q))
+        sort = (sort_by or [{}])[0]
+        col = sort.get("column_id")
+        desc = sort.get("direction", "desc") == "desc" if col else True
+        with self._lock:
+            cand = self._candidates(clauses)
+            total = len(self._offsets) if cand is None else len(cand)
+            lo, hi = (max(0, total - offset - limit), max(0, total - offset)) if desc else (offset, offset + limit)
+            if cand is None:
+                # Sin filtro: la página es un slice del índice (o de _offsets en orden de archivo)
+                page = [off for _, off in self._index[col][lo:hi]] if col in self._index else self._offsets[lo:hi]
+            elif col in self._index and len(cand) * 8 > len(self._offsets):
+                # Filtro poco selectivo: recorrer el índice ya ordenado sale más barato que ordenar
+                page = [off for _, off in self._index[col] if off in cand][lo:hi]
+            elif col in self._index:
+                keys = self._keys[col]
+                page = sorted(cand, key=lambda off: (keys[bisect_left(self._offsets, off)], off))[lo:hi]
+            else:
+                page = sorted(cand)[lo:hi]
+            return self._read_at(page[::-1] if desc else page), total
+
+    def search(self, q: str, limit: int = 200) -> List[Dict[str, Any]]:
+        """Búsqueda por prefijo (decision_id / tx_ref_hash / tx_hash, con o sin 0x) en todo el historial."""
+        q = norm_hex(q)
+        if not q:
+            return self.tail(limit)
+        self.refresh()
+        with self._lock:
+            offsets = self._match(q)[-limit:]
+            return self._read_at(offsets)
+
+# Columnas de la tabla -> columnas de SecureTxIndex
+_INDEX_COLS = {"decision_id_hex": "decision_id", "tx_ref_hash_hex": "tx_ref_hash", "tx_hash": "tx_hash",
+               "block_number": "block_number"}
+
+class IndexFeed:
+    """query() de EventFeed resuelto en SQL por un SecureTxIndex (filtros, orden y página)."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def _row(self, r: Dict[str, Any]) -> Dict[str, Any]:
+        return {f: r[c] for f, c in _INDEX_COLS.items()}
+
+    def query(self, q: Optional[str] = None, filter_query: Optional[str] = None,
+              sort_by: Optional[List[Dict[str, str]]] = None,
+              offset: int = 0, limit: int = 10) -> Tuple[List[Dict[str, Any]], int]:
+        clauses = parse_filter(filter_query)
+        if q and norm_hex(q):
+            clauses.append(("*", "contains", q))
+        prefixes, blocks = [], []
+        for col, op, val in clauses:
+            if (col in HEX_FIELDS or col == "*") and op in ("contains", "=", "datestartswith"):
+                prefixes.append((None if col == "*" else _INDEX_COLS[col], norm_hex(val)))
+            elif col == "block_number" and op in ("=", "!=", ">", ">=", "<", "<="):
+                try:
+                    blocks.append((op, int(float(val))))
+                except ValueError:
+                    continue
+        sort = (sort_by or [{}])[0]
+        col = sort.get("column_id")
+        desc = sort.get("direction", "desc") == "desc" if col else True
+        rows, total = self.index.query(prefixes, blocks, order_by=_INDEX_COLS.get(col, "block_number"), desc=desc,
+                                       offset=offset, limit=limit)
+        return [self._row(r) for r in rows], total
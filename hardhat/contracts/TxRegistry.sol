@@ -9,4 +9,12 @@ contract TxRegistry {
     function registerSecureTx(bytes32 decisionId, bytes32 txRefHash) external {
         emit SecureTx(decisionId, txRefHash, block.timestamp);
     }
+
+    /// @notice Registra N decisiones en una sola tx (un evento SecureTx por decisión).
+    function registerSecureTxBatch(bytes32[] calldata decisionIds, bytes32[] calldata txRefHashes) external {
+        require(decisionIds.length == txRefHashes.length, "longitudes distintas");
+        for (uint256 i = 0; i < decisionIds.length; i++) {
+            emit SecureTx(decisionIds[i], txRefHashes[i], block.timestamp);
+        }
+    }
 }
@@ -0,0 +1,139 @@
+﻿# -*- coding: utf-8 -*-
+"""
+scripts/bench_chain.py — benchmark del camino on-chain (outbox + api/chain.py) sin nodo externo
+- Corre con CHAIN_BACKEND=local (api/local_chain.py): el código de envío es el del API
+  (nonces locales, gas / fees cacheados, firma EIP-1559, pipelining y lotes del outbox); solo
+  el nodo es la cadena en memoria, con tiempo de bloque y latencia RPC configurables
+- Encola --n decisiones seguras (ids aleatorios) de golpe (drenado de backlog) o a --rate
+  por segundo (régimen estable) y espera a que el outbox las confirme todas
+- Informa confirmaciones/s, tx enviadas y decisiones por tx, reintentos por nonce / gas,
+  bloques, gas por decisión y latencia enqueue -> confirmación (p50 / p95 / máx)
+- Estado en un directorio temporal: no toca state/, events.csv ni la cadena real
+- Salida: reports/chain_<ts>.json (registrado en reports/manifest.json)
+Uso:
+  python .\\scripts\\bench_chain.py --n 2000
+  python .\\scripts\\bench_chain.py --n 2000 --single --in-flight 64
+  python .\\scripts\\bench_chain.py --n 5000 --rate 500 --block-time 1 --rpc-latency-ms 20
+"""
+
+from __future__ import annotations
+import os, sys, json, time, shutil, sqlite3, argparse, tempfile, threading
+from datetime import datetime
+from typing import Any, Dict, List
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+REPORTS = os.path.join(ROOT, "reports")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+from src.artifacts import record  # noqa: E402
+
+def _pct(values: List[float], q: float) -> float:
+    v = sorted(values)
+    return v[min(len(v) - 1, int(round(q / 100.0 * (len(v) - 1))))] if v else 0.0
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=2000, help="Decisiones a registrar")
+    ap.add_argument("--rate", type=float, default=None, help="Decisiones/s encoladas (sin esto: todas de golpe)")
+    ap.add_argument("--single", action="store_true", help="Una tx por decisión (sin registerSecureTxBatch)")
+    ap.add_argument("--batch-size", type=int, default=100)
+    ap.add_argument("--batch-max-age", type=float, default=0.2, help="s que espera la decisión más vieja del lote")
+    ap.add_argument("--in-flight", type=int, default=64, help="Tx enviadas sin receipt (OUTBOX_MAX_IN_FLIGHT)")
+    ap.add_argument("--block-time", type=float, default=0.0, help="s por bloque (0 = automine)")
+    ap.add_argument("--rpc-latency-ms", type=float, default=0.0)
+    ap.add_argument("--timeout", type=float, default=300.0)
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench_chain_")
+    # El entorno se fija antes de importar api.*: los módulos leen su configuración al importarse
+    os.environ.update(CHAIN_BACKEND="local", LOCAL_BLOCK_TIME_S=str(args.block_time),
+                      LOCAL_RPC_LATENCY_MS=str(args.rpc_latency_ms),
+                      OUTBOX_DB=os.path.join(tmp, "outbox.sqlite"), EVENTS_DB=os.path.join(tmp, "events.sqlite"))
+    for k in ("PRIVATE_KEY", "CONTRACT_ADDRESS", "CHAIN_ID"):
+        os.environ.pop(k, None)  # cuenta y contrato de desarrollo del nodo local
+    from api import chain
+    from api.outbox import Outbox
+
+    batch = not args.single and chain.has_batch()
+    ob = Outbox(chain.send_secure_tx, chain.get_receipt, on_confirmed=chain.record_event,
+                path=os.environ["OUTBOX_DB"], max_in_flight=args.in_flight, poll_s=0.05, receipt_poll_s=0.02,
+                send_batch_fn=chain.send_secure_batch if batch else None,
+                batch_size=args.batch_size, batch_max_age_s=args.batch_max_age, submitter=True,
+                nonce_fn=chain.mined_nonce)
+    pairs = [("0x" + os.urandom(32).hex(), "0x" + os.urandom(32).hex()) for _ in range(args.n)]
+    print(f"[CHAIN] {args.n} decisiones | {'lotes de ' + str(args.batch_size) if batch else 'una tx por decisión'} | "
+          f"in_flight={args.in_flight} block_time={args.block_time}s rpc_latency={args.rpc_latency_ms}ms", flush=True)
+
+    chain._client()  # conexión fuera de la medición
+    t0 = time.perf_counter()
+    ob.start()
+    if args.rate:
+        def _produce():
+            chunk = max(1, int(args.rate / 20))  # 20 tandas por segundo
+            for i in range(0, len(pairs), chunk):
+                target = t0 + i / args.rate
+                time.sleep(max(0.0, target - time.perf_counter()))
+                ob.enqueue_many(pairs[i:i + chunk])
+        threading.Thread(target=_produce, daemon=True).start()
+    else:
+        ob.enqueue_many(pairs)
+
+    done = 0
+    while time.perf_counter() - t0 < args.timeout:
+        st = ob.stats()
+        done = st.get("confirmed", 0) + st.get("failed", 0) + st.get("skipped", 0)
+        if done >= args.n:
+            break
+        time.sleep(0.05)
+    duration = time.perf_counter() - t0
+    st = ob.stats()
+
+    with sqlite3.connect(os.environ["OUTBOX_DB"]) as conn:
+        lat = [r[0] * 1000.0 for r in conn.execute(
+            "SELECT updated_at - created_at FROM outbox WHERE status = 'confirmed'")]
+        txs = conn.execute("SELECT COUNT(DISTINCT tx_hash) FROM outbox WHERE status = 'confirmed'").fetchone()[0]
+    w3 = chain._client().w3
+    head = int(w3.eth.block_number)
+    gas = sum(int(w3.eth.get_block(i)["gasUsed"]) for i in range(1, head + 1))
+    sent = {k[0]: int(v.value) for k, v in chain.CHAIN_TX._items()}
+    retries = {k[0]: int(v.value) for k, v in chain.CHAIN_RETRIES._items()}
+    confirmed = st.get("confirmed", 0)
+
+    out: Dict[str, Any] = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {"n": args.n, "rate": args.rate, "mode": "batch" if batch else "single",
+                   "batch_size": args.batch_size if batch else None, "batch_max_age_s": args.batch_max_age,
+                   "in_flight": args.in_flight, "block_time_s": args.block_time,
+                   "rpc_latency_ms": args.rpc_latency_ms},
+        "completed": done >= args.n,
+        "duration_s": duration,
+        "outbox": st,
+        "confirmed_per_s": confirmed / duration if duration > 0 else 0.0,
+        "tx_sent": sent,
+        "tx_confirmed": txs,
+        "decisions_per_tx": confirmed / txs if txs else 0.0,
+        "retries": retries,
+        "blocks": head,
+        "gas_per_decision": gas / confirmed if confirmed else 0.0,
+        "confirm_ms": {"p50": _pct(lat, 50), "p95": _pct(lat, 95), "max": max(lat) if lat else 0.0},
+        "node_pending_nonce": int(w3.eth.get_transaction_count(chain._client().sender, "pending")),
+    }
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    os.makedirs(REPORTS, exist_ok=True)
+    outp = os.path.join(REPORTS, f"chain_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(outp, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False, indent=2)
+    record("chain", outp)
+
+    c = out["confirm_ms"]
+    print(f"[CHAIN] {confirmed}/{args.n} confirmadas en {duration:.2f}s → {out['confirmed_per_s']:.0f} decisiones/s | "
+          f"tx={txs} ({out['decisions_per_tx']:.1f} decisiones/tx) bloques={head}")
+    print(f"[CHAIN] confirmación ms p50={c['p50']:.0f} p95={c['p95']:.0f} máx={c['max']:.0f} | "
+          f"gas/decisión={out['gas_per_decision']:.0f} | reintentos={retries or 0} | outbox={st}")
+    print(f"Reporte: {outp}")
+    if not out["completed"]:
+        raise SystemExit(f"[CHAIN] Timeout: {done}/{args.n} decisiones terminadas en {args.timeout:.0f}s")
+
+if __name__ == "__main__":
+    main()
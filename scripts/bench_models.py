@@ -0,0 +1,253 @@
+﻿# -*- coding: utf-8 -*-
+"""
+scripts/bench_models.py — benchmark precisión vs latencia de bosques candidatos (frontera de Pareto)
+- Candidatos: --candidates N:D (n_estimators:max_depth, "none" = sin límite) se entrenan sobre
+  train con los mismos parámetros que train_rf.py; --models a.joblib ... se cargan tal cual
+  (p.ej. versiones de models/registry/)
+- Por candidato, con el evaluador que usaría el API (api/registry.py: bosque empaquetado hasta
+  PACKED_MAX_ROWS filas, sklearn por encima; FOREST_ENGINE=sklearn -> siempre sklearn):
+  * latencia de 1 fila y de un lote de --batch-rows (p50 / p99, filas de test al azar)
+  * tamaño en disco (model.joblib y el bosque empaquetado) y en memoria (sklearn: lo que
+    asigna joblib.load según tracemalloc; empaquetado: bytes de sus arrays)
+  * tiempo de carga (joblib.load y PackedForest.load con mmap, como al arrancar el API)
+  * test PR-AUC y recall@k / precision@k (src/metrics.py)
+- Frontera de Pareto: ningún otro candidato tiene p99 de 1 fila menor o igual y PR-AUC mayor o
+  igual (con alguna estricta). --slo-ms: el de mejor PR-AUC de la frontera que entra en el SLO
+  de /score (p99 de 1 fila <= SLO)
+- Datos: cache de data.py (matrices .npy mapeadas) o parquet / csv de --data-dir
+- Salida: reports/bench_models_<ts>.json (registrado en el manifest) + reports/pareto.png,
+  que muestra el dashboard
+Uso:
+  python .\\scripts\\bench_models.py --data-dir .\\data\\processed --candidates 50:8 100:12 200:16 400:none --slo-ms 5
+  python .\\scripts\\bench_models.py --models .\\models\\registry\\20250101_120000\\model.joblib --slo-ms 5
+"""
+
+from __future__ import annotations
+import os, sys, json, time, shutil, argparse, tempfile, tracemalloc
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+REPORTS = os.path.join(ROOT, "reports")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+from src.artifacts import record  # noqa: E402
+from metrics import multi_k, pr_auc  # noqa: E402
+from dataset_cache import load_columns, matrix, read_meta, read_split, resolve  # noqa: E402
+from api.forest import PackedForest  # noqa: E402
+from api.registry import FOREST_ENGINE, PACKED_MAX_ROWS  # noqa: E402
+
+def _pct(values: List[float], q: float) -> float:
+    v = sorted(values)
+    return v[min(len(v) - 1, int(round(q / 100.0 * (len(v) - 1))))] if v else 0.0
+
+def _dir_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(path) for f in fs)
+
+def _xy(data_dir: str, split: str, features: Optional[List[str]]) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """(X float32 C-contigua, y, features): matriz del cache si hay cache.json, si no parquet / csv."""
+    hit = resolve(data_dir, split)
+    if hit is not None:
+        features = features or [c for c in read_meta(hit[0])["columns"] if c != "Class"]
+        return matrix(*hit, features), np.asarray(load_columns(*hit, ["Class"])["Class"]), features
+    df = read_split(data_dir, split)
+    features = features or [c for c in df.columns if c != "Class"]
+    return np.ascontiguousarray(df[features].to_numpy(dtype=np.float32)), df["Class"].to_numpy(dtype=np.int8), features
+
+def _parse_candidate(spec: str) -> Dict[str, Any]:
+    n, _, d = spec.partition(":")
+    return {"n_estimators": int(n), "max_depth": None if d.lower() in ("", "none") else int(d)}
+
+def _latency_ms(fn, batches: List[np.ndarray]) -> Dict[str, float]:
+    fn(batches[0])  # primera llamada (caches, páginas del mmap) fuera de la medición
+    ts = []
+    for b in batches:
+        t0 = time.perf_counter(); fn(b); ts.append((time.perf_counter() - t0) * 1000.0)
+    return {"p50": _pct(ts, 50), "p99": _pct(ts, 99)}
+
+def measure(name: str, model_path: str, X_te: np.ndarray, y_te: np.ndarray, ks: List[int], workdir: str,
+            reps: int, batch_rows: int, batch_reps: int, seed: int) -> Dict[str, Any]:
+    from joblib import load
+    t0 = time.perf_counter()
+    clf = load(model_path)
+    load_sklearn_s = time.perf_counter() - t0
+    del clf
+    tracemalloc.start()
+    clf = load(model_path)
+    sklearn_mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    packed_dir = os.path.join(workdir, f"{name}.packed")
+    try:
+        PackedForest.from_sklearn(clf).save(packed_dir)
+        t0 = time.perf_counter()
+        packed = PackedForest.load(packed_dir, mmap_mode="r")
+        load_packed_s = time.perf_counter() - t0
+    except TypeError:
+        packed = None  # no es un ensamble de árboles: el API lo sirve con sklearn
+        load_packed_s = None
+
+    def serve(X: np.ndarray) -> np.ndarray:
+        if FOREST_ENGINE == "packed" and packed is not None and len(X) <= PACKED_MAX_ROWS:
+            return packed.predict_proba(X)[:, 1]
+        return clf.predict_proba(X)[:, 1]
+
+    rng = np.random.default_rng(seed)
+    rows = [X_te[i:i + 1] for i in rng.integers(0, len(X_te), size=reps)]
+    starts = rng.integers(0, max(1, len(X_te) - batch_rows), size=batch_reps)
+    batches = [np.ascontiguousarray(X_te[s:s + batch_rows]) for s in starts]
+    single, batch = _latency_ms(serve, rows), _latency_ms(serve, batches)
+
+    scores = clf.predict_proba(X_te)[:, 1].astype("float64")
+    by_k = multi_k(y_te, scores, ks)
+    packed_arrays = None if packed is None else sum(
+        a.nbytes for a in (packed.feature, packed.threshold, packed.left, packed.value, packed.roots,
+                           packed.missing_left) if a is not None)
+    return {
+        "name": name,
+        "model_path": os.path.abspath(model_path),
+        "params": {k: getattr(clf, k, None) for k in ("n_estimators", "max_depth", "min_samples_leaf", "max_features")},
+        "trees": packed.n_trees if packed is not None else None,
+        "nodes": packed.n_nodes if packed is not None else None,
+        "engine": {"single": "packed" if FOREST_ENGINE == "packed" and packed is not None else "sklearn",
+                   "batch": "packed" if FOREST_ENGINE == "packed" and packed is not None and batch_rows <= PACKED_MAX_ROWS else "sklearn"},
+        "single_ms": single,
+        "batch_ms": {**batch, "rows": batch_rows},
+        "size_bytes": {"disk_joblib": os.path.getsize(model_path),
+                       "disk_packed": _dir_bytes(packed_dir) if packed is not None else None,
+                       "mem_sklearn": int(sklearn_mem), "mem_packed": packed_arrays},
+        "load_s": {"sklearn": load_sklearn_s, "packed": load_packed_s},
+        "test": {"pr_auc": pr_auc(y_te, scores), "by_k": by_k},
+    }
+
+def pareto(results: List[Dict[str, Any]]) -> List[str]:
+    """Nombres de la frontera (menor p99 de 1 fila, mayor PR-AUC), ordenados por latencia."""
+    front = []
+    for r in results:
+        lat, auc = r["single_ms"]["p99"], r["test"]["pr_auc"]
+        dominated = any(o is not r and o["single_ms"]["p99"] <= lat and o["test"]["pr_auc"] >= auc
+                        and (o["single_ms"]["p99"] < lat or o["test"]["pr_auc"] > auc) for o in results)
+        if not dominated:
+            front.append(r)
+    return [r["name"] for r in sorted(front, key=lambda r: r["single_ms"]["p99"])]
+
+def plot(results: List[Dict[str, Any]], front: List[str], slo_ms: Optional[float], out_path: str) -> None:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    by_name = {r["name"]: r for r in results}
+    plt.figure(figsize=(6.4, 4.2))
+    plt.scatter([r["single_ms"]["p99"] for r in results], [r["test"]["pr_auc"] for r in results],
+                c="#adb5bd", label="candidatos")
+    fx = [by_name[n]["single_ms"]["p99"] for n in front]
+    fy = [by_name[n]["test"]["pr_auc"] for n in front]
+    plt.step(fx, fy, where="post", color="#0d6efd")
+    plt.scatter(fx, fy, color="#0d6efd", label="frontera de Pareto", zorder=3)
+    for r in results:
+        plt.annotate(r["name"], (r["single_ms"]["p99"], r["test"]["pr_auc"]), fontsize=7,
+                     xytext=(4, 3), textcoords="offset points")
+    if slo_ms:
+        plt.axvline(slo_ms, color="#dc3545", linestyle="--", linewidth=1, label=f"SLO {slo_ms:g} ms")
+    plt.xlabel("p99 latencia 1 fila (ms)")
+    plt.ylabel("Test PR-AUC")
+    plt.title("Precisión vs latencia")
+    plt.grid(True, linestyle="--", linewidth=0.5)
+    plt.legend(fontsize=8, loc="lower right")
+    plt.tight_layout()
+    plt.savefig(out_path, dpi=120)
+    plt.close()
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--data-dir", default=os.path.join(ROOT, "data", "processed"))
+    ap.add_argument("--candidates", nargs="*", default=["50:8", "100:12", "200:16", "400:none"],
+                    help="n_estimators:max_depth a entrenar (none = sin límite)")
+    ap.add_argument("--models", nargs="*", default=[], help="model.joblib ya entrenados a comparar")
+    ap.add_argument("--k", nargs="+", type=int, default=[100, 500])
+    ap.add_argument("--slo-ms", type=float, default=None, help="SLO de /score: p99 de 1 fila en ms")
+    ap.add_argument("--reps", type=int, default=500, help="Requests de 1 fila medidos por candidato")
+    ap.add_argument("--batch-rows", type=int, default=PACKED_MAX_ROWS)
+    ap.add_argument("--batch-reps", type=int, default=50)
+    ap.add_argument("--random-state", type=int, default=42)
+    args = ap.parse_args()
+
+    X_te, y_te, features = _xy(args.data_dir, "test", None)
+    workdir = tempfile.mkdtemp(prefix="bench_models_")
+    results: List[Dict[str, Any]] = []
+    try:
+        specs = [(f"rf_{c['n_estimators']}x{c['max_depth'] or 'none'}", c)
+                 for c in map(_parse_candidate, args.candidates)]
+        if specs:
+            from joblib import dump
+            from sklearn.ensemble import RandomForestClassifier
+            X_tr, y_tr, _ = _xy(args.data_dir, "train", features)
+            for name, params in specs:
+                clf = RandomForestClassifier(**params, n_jobs=-1, class_weight="balanced",
+                                             random_state=args.random_state)
+                t0 = time.perf_counter()
+                clf.fit(X_tr, y_tr)
+                fit_s = time.perf_counter() - t0
+                path = os.path.join(workdir, f"{name}.joblib")
+                dump(clf, path)
+                del clf
+                r = measure(name, path, X_te, y_te, args.k, workdir, args.reps, args.batch_rows,
+                            args.batch_reps, args.random_state)
+                r["fit_s"] = fit_s
+                r["model_path"] = None  # temporal: se borra al terminar
+                results.append(r)
+                print(f"[MODELS] {name:<16} PR-AUC={r['test']['pr_auc']:.4f}  1 fila p50={r['single_ms']['p50']:.2f} "
+                      f"p99={r['single_ms']['p99']:.2f}ms  lote p99={r['batch_ms']['p99']:.1f}ms  "
+                      f"disco={r['size_bytes']['disk_joblib'] / 1e6:.1f}MB  fit={fit_s:.1f}s", flush=True)
+        for path in args.models:
+            parent = os.path.basename(os.path.dirname(os.path.abspath(path)))
+            name = parent if parent not in ("models", "") else os.path.splitext(os.path.basename(path))[0]
+            r = measure(name, path, X_te, y_te, args.k, workdir, args.reps, args.batch_rows,
+                        args.batch_reps, args.random_state)
+            results.append(r)
+            print(f"[MODELS] {name:<16} PR-AUC={r['test']['pr_auc']:.4f}  1 fila p99={r['single_ms']['p99']:.2f}ms", flush=True)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if not results:
+        raise SystemExit("Sin candidatos: usar --candidates y/o --models")
+
+    front = pareto(results)
+    fits = [n for n in front if args.slo_ms is None or
+            next(r for r in results if r["name"] == n)["single_ms"]["p99"] <= args.slo_ms]
+    choice = fits[-1] if fits else None  # la frontera está ordenada por latencia: el último es el más preciso
+    for r in results:
+        r["pareto"] = r["name"] in front
+
+    os.makedirs(REPORTS, exist_ok=True)
+    plot_path = os.path.join(REPORTS, "pareto.png")
+    plot(results, front, args.slo_ms, plot_path)
+    out = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "data_dir": os.path.abspath(args.data_dir),
+        "test_rows": int(len(y_te)),
+        "engine": {"forest_engine": FOREST_ENGINE, "packed_max_rows": PACKED_MAX_ROWS},
+        "slo_ms": args.slo_ms,
+        "pareto": front,
+        "best_under_slo": choice,
+        "results": results,
+        "plot": os.path.abspath(plot_path),
+    }
+    outp = os.path.join(REPORTS, f"bench_models_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(outp, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False, indent=2)
+    record("bench_models", outp)
+
+    print(f"[MODELS] Frontera de Pareto: {' -> '.join(front)}")
+    if args.slo_ms is not None:
+        if choice:
+            p = next(r for r in results if r["name"] == choice)["params"]
+            print(f"[MODELS] Mejor dentro del SLO ({args.slo_ms:g} ms p99): {choice}  "
+                  f"(train_rf.py --n-estimators {p['n_estimators']} --max-depth {p['max_depth']})")
+        else:
+            print(f"[MODELS] Ningún candidato entra en el SLO de {args.slo_ms:g} ms")
+    print(f"Reporte: {outp}")
+    print(f"Gráfico: {plot_path}")
+
+if __name__ == "__main__":
+    main()
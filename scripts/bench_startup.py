@@ -0,0 +1,176 @@
+﻿# -*- coding: utf-8 -*-
+"""
+scripts/bench_startup.py — costo de arranque del API (cold start de un worker)
+- Cada corrida es un intérprete nuevo (sin caches de import) que mide por etapa:
+  import_ms (import api.app), model_ms (carga + calentamiento del modelo vigente),
+  first_request_ms (primer POST /score con el test client de Flask) y total_ms
+- Informa RSS/PSS al quedar listo y qué módulos pesados quedaron importados
+  (web3, pandas, sklearn, ...): con el bosque empaquetado y la cadena perezosa no debería haber ninguno
+- El worker no corre el submitter (OUTBOX_SUBMITTER=0): no toca el RPC ni hace falta la cadena
+- OUTBOX_DB, EVENTS_DB y ACCESS_LOG apuntan a un directorio temporal (se borra al terminar): el
+  POST de prueba no deja decisiones "bench" en el outbox real ni líneas en logs/requests.jsonl
+- Antes de medir hay una corrida descartada que deja el bosque empaquetado en disco (la primera
+  vez que se sirve una versión se arma desde el sklearn; eso es despliegue, no arranque)
+- --importtime: una corrida extra con python -X importtime; top de paquetes por tiempo acumulado
+- Salida: reports/startup_<ts>.json (registrado en reports/manifest.json) con mediana / p95 / máx
+  por etapa y la diferencia contra la corrida anterior; --max-import-ms / --max-total-ms
+  hacen fallar el script (exit 1) si la mediana se pasa del presupuesto
+Uso:
+  python .\\scripts\\bench_startup.py --runs 5 --importtime
+  python .\\scripts\\bench_startup.py --runs 3 --max-import-ms 800
+"""
+
+from __future__ import annotations
+import os, sys, json, time, shutil, argparse, tempfile, subprocess
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+REPORTS = os.path.join(ROOT, "reports")
+sys.path.insert(0, ROOT)
+from src.artifacts import record, load_latest  # noqa: E402
+
+STAGES = ("import_ms", "model_ms", "first_request_ms", "total_ms")
+# Módulos que un worker no necesita para puntuar; si aparecen, algo los importa de más
+HEAVY = ("web3", "eth_account", "pandas", "sklearn", "joblib", "scipy", "matplotlib")
+
+def _child() -> None:
+    """Una corrida de arranque; imprime un JSON en la última línea de stdout."""
+    t0 = time.perf_counter()
+    from api import app as api_app
+    t1 = time.perf_counter()
+    b = api_app._registry.current()
+    t2 = time.perf_counter()
+    client = api_app.app.test_client()
+    resp = client.post("/score", json={"features": {f: 0.0 for f in b.features}, "tx_ref": "bench"})
+    t3 = time.perf_counter()
+    from api.serve import memory_mb
+    print(json.dumps({
+        "import_ms": (t1 - t0) * 1000.0,
+        "model_ms": (t2 - t1) * 1000.0,
+        "first_request_ms": (t3 - t2) * 1000.0,
+        "total_ms": (t3 - t0) * 1000.0,
+        "status": resp.status_code,
+        "model_version": b.version,
+        "engine": b.engine,
+        "heavy_loaded": [m for m in HEAVY if m in sys.modules],
+        **memory_mb(),
+    }))
+
+def _env(tmp: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + (os.pathsep + env["PYTHONPATH"] if env.get("PYTHONPATH") else "")
+    env["OUTBOX_SUBMITTER"] = "0"
+    env.update(OUTBOX_DB=os.path.join(tmp, "outbox.sqlite"), EVENTS_DB=os.path.join(tmp, "events.sqlite"),
+               ACCESS_LOG=os.path.join(tmp, "requests.jsonl"))
+    env.setdefault("REGISTRY_POLL_S", "3600")
+    return env
+
+def _run_once(tmp: str, importtime: bool = False) -> subprocess.CompletedProcess:
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + [os.path.abspath(__file__), "--child"]
+    p = subprocess.run(cmd, cwd=ROOT, env=_env(tmp), capture_output=True, text=True, encoding="utf-8")
+    if p.returncode != 0:
+        raise SystemExit(f"La corrida falló (exit {p.returncode}):\n{p.stderr[-2000:]}")
+    return p
+
+def _parse_importtime(stderr: str, top: int) -> List[Dict[str, Any]]:
+    """Paquetes raíz ordenados por tiempo acumulado (el del import del paquete, a cualquier profundidad)."""
+    acc: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            cum_us = float(cumulative)
+        except ValueError:
+            continue
+        name = name.strip()
+        # Solo la línea del paquete raíz (sus submódulos ya están en su acumulado); api/src son propios
+        if "." in name or name in ("api", "src", "__main__"):
+            continue
+        acc[name] = max(acc.get(name, 0.0), cum_us / 1000.0)
+    ranked = sorted(acc.items(), key=lambda kv: kv[1], reverse=True)[:top]
+    return [{"module": m, "cumulative_ms": ms} for m, ms in ranked]
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    v = sorted(values)
+    return {"median": v[len(v) // 2], "p95": v[min(len(v) - 1, int(round(0.95 * (len(v) - 1))))], "max": v[-1]}
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--importtime", action="store_true", help="Top de imports (corrida extra con -X importtime)")
+    ap.add_argument("--top", type=int, default=15)
+    ap.add_argument("--max-import-ms", type=float, default=None)
+    ap.add_argument("--max-total-ms", type=float, default=None)
+    args = ap.parse_args()
+
+    if args.child:
+        _child()
+        return
+
+    tmp = tempfile.mkdtemp(prefix="bench_startup_")
+    try:
+        _run_once(tmp)  # preparación (no se mide)
+        runs = []
+        for i in range(max(1, args.runs)):
+            p = _run_once(tmp)
+            runs.append(json.loads(p.stdout.strip().splitlines()[-1]))
+            r = runs[-1]
+            print(f"[{i + 1}/{args.runs}] import={r['import_ms']:.0f}ms model={r['model_ms']:.0f}ms "
+                  f"first_request={r['first_request_ms']:.0f}ms total={r['total_ms']:.0f}ms "
+                  f"rss={r['rss_mb'] or 0:.1f}MB")
+        top = _parse_importtime(_run_once(tmp, importtime=True).stderr, args.top) if args.importtime else None
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    out: Dict[str, Any] = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": sys.version.split()[0],
+        "runs": runs,
+        "stages": {k: _summary([r[k] for r in runs]) for k in STAGES},
+        "rss_mb": _summary([r["rss_mb"] for r in runs]) if all(r.get("rss_mb") for r in runs) else None,
+        "heavy_loaded": sorted({m for r in runs for m in r["heavy_loaded"]}),
+        "model_version": runs[-1]["model_version"],
+        "engine": runs[-1]["engine"],
+    }
+    if top is not None:
+        out["importtime_top"] = top
+
+    # Contra la corrida anterior (reports/manifest.json -> último startup_*.json)
+    prev: Optional[Dict[str, Any]] = None
+    found = load_latest("startup", REPORTS)
+    if found is not None:
+        prev = found[0]
+        out["previous"] = {"path": found[1],
+                           "delta_median_ms": {k: out["stages"][k]["median"] - prev["stages"][k]["median"]
+                                               for k in STAGES if k in prev.get("stages", {})}}
+
+    os.makedirs(REPORTS, exist_ok=True)
+    outp = os.path.join(REPORTS, f"startup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(outp, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False, indent=2)
+    record("startup", outp)
+
+    for k in STAGES:
+        s = out["stages"][k]
+        delta = (out.get("previous") or {}).get("delta_median_ms", {}).get(k)
+        print(f"{k:>17}: mediana={s['median']:.0f}ms p95={s['p95']:.0f}ms máx={s['max']:.0f}ms"
+              + (f"  ({delta:+.0f}ms vs anterior)" if delta is not None else ""))
+    if out["heavy_loaded"]:
+        print(f"[WARN] Módulos pesados importados al arrancar: {', '.join(out['heavy_loaded'])}")
+    for row in out.get("importtime_top", []):
+        print(f"  {row['cumulative_ms']:8.1f}ms  {row['module']}")
+    print(f"Reporte: {outp}")
+
+    over = []
+    if args.max_import_ms is not None and out["stages"]["import_ms"]["median"] > args.max_import_ms:
+        over.append(f"import {out['stages']['import_ms']['median']:.0f}ms > {args.max_import_ms:.0f}ms")
+    if args.max_total_ms is not None and out["stages"]["total_ms"]["median"] > args.max_total_ms:
+        over.append(f"total {out['stages']['total_ms']['median']:.0f}ms > {args.max_total_ms:.0f}ms")
+    if over:
+        raise SystemExit("Presupuesto de arranque excedido: " + "; ".join(over))
+
+if __name__ == "__main__":
+    main()
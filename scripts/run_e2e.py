@@ -0,0 +1,361 @@
+﻿# -*- coding: utf-8 -*-
+"""
+scripts/run_e2e.py — generador de carga y benchmark end-to-end contra el API
+- Reproduce filas de data/processed/test.parquet (del cache de data.py si hay cache.json; test.csv si no hay parquet) contra /score
+  o /score/batch (--batch-size filas por request); mismas filas y mismo orden en cada corrida
+- Lazo cerrado (por defecto): --concurrency clientes, cada uno manda el siguiente request al
+  recibir la respuesta. Lazo abierto: --rate R req/s con llegadas --arrival poisson|uniform
+  (semilla --seed); la latencia se mide desde el instante programado, así la cola del cliente
+  no esconde la saturación del API
+- Conexión HTTP persistente por hilo (keep-alive); --warmup requests previos no se miden
+- Scoring: latencia vista por el cliente (p50/p95/p99) y la que informa el API (latency_ms)
+- E2E: cada decisión segura se consulta en /onchain/<decision_id> hasta confirmed / failed o
+  --event-timeout. e2e = scoring + (updated_at - created_at) de la fila del outbox (ambos con
+  el reloj del servidor). correlation_secure_to_event_pct = % de seguras con evento confirmado
+- decision_id es determinístico (features + umbral + versión): al repetir una corrida las
+  decisiones ya confirmadas cuentan para la correlación pero no para la latencia E2E
+  ("preexisting"); --fresh desplaza Time unos segundos fraccionarios para tener ids nuevos
+- Salida: reports/e2e_summary.json (lo lee el dashboard) + histórico reports/e2e_<ts>.json
+- Baseline: --save-baseline guarda reports/e2e_baseline.json. Si existe y la carga es la misma
+  (modo, concurrencia, rate, batch, --limit, --data, --fresh), la corrida falla (exit 1) si un
+  p95 empeora más de --tolerance, el throughput cae más de --tolerance o la correlación baja
+Uso:
+  python .\\scripts\\run_e2e.py --limit 500 --score-url http://127.0.0.1:5000/score
+  python .\\scripts\\run_e2e.py --limit 5000 --score-url http://127.0.0.1:5000/score/batch --batch-size 64
+  python .\\scripts\\run_e2e.py --limit 2000 --rate 200 --arrival poisson --concurrency 32
+  python .\\scripts\\run_e2e.py --limit 500 --save-baseline
+"""
+
+from __future__ import annotations
+import os, sys, json, time, random, argparse, threading, http.client
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+REPORTS = os.path.join(ROOT, "reports")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+from src.artifacts import record  # noqa: E402
+from dataset_cache import read_path, resolve  # noqa: E402
+
+SUMMARY = os.path.join(REPORTS, "e2e_summary.json")
+BASELINE = os.path.join(REPORTS, "e2e_baseline.json")
+# Claves que definen la carga: solo se compara contra el baseline si coinciden
+WORKLOAD_KEYS = ("mode", "concurrency", "rate", "arrival", "batch_size", "limit", "data", "fresh")
+TERMINAL = ("confirmed", "failed", "skipped")
+
+# ---------- datos ----------
+def load_rows(path: str, limit: int, fresh_offset: float = 0.0) -> List[Dict[str, float]]:
+    """Primeras limit filas (cicla si hay menos) como dicts {feature: valor}, sin Class."""
+    alt = os.path.splitext(path)[0] + ".csv"
+    if resolve(path) is None and not os.path.exists(path) and not os.path.exists(alt):
+        raise SystemExit(f"No se encontró {path} (ni {alt}); correr src/data.py primero")
+    df = read_path(path)  # cache de data.py si el directorio tiene cache.json
+    df = df[[c for c in df.columns if c != "Class"]].astype("float64")
+    if fresh_offset and "Time" in df.columns:
+        df["Time"] = df["Time"] + fresh_offset
+    rows = df.to_dict("records")
+    if not rows:
+        raise SystemExit(f"{path} no tiene filas")
+    return [rows[i % len(rows)] for i in range(limit)]
+
+# ---------- HTTP ----------
+class Client:
+    """Cliente JSON mínimo con una conexión keep-alive por hilo."""
+
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        u = urlsplit(base_url)
+        self.scheme, self.host, self.port = u.scheme or "http", u.hostname or "127.0.0.1", u.port
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def request(self, method: str, path: str, body: Any = None) -> Tuple[int, Dict[str, Any]]:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        for attempt in (1, 2):
+            conn = self._conn()
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                resp = conn.getresponse()
+                payload = resp.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # El servidor cerró la conexión keep-alive: un reintento con conexión nueva
+                conn.close()
+                self._local.conn = None
+                if attempt == 2:
+                    raise
+        try:
+            return resp.status, json.loads(payload or b"{}")
+        except ValueError:
+            return resp.status, {}
+
+# ---------- carga ----------
+def _arrivals(n: int, rate: float, arrival: str, seed: int) -> List[float]:
+    """Instantes (s desde el inicio) de cada request en lazo abierto."""
+    if arrival == "uniform":
+        return [i / rate for i in range(n)]
+    rng = random.Random(seed)
+    t, out = 0.0, []
+    for _ in range(n):
+        out.append(t)
+        t += rng.expovariate(rate)
+    return out
+
+def _send(client: Client, path: str, body: Dict[str, Any], t_sched: Optional[float]) -> Dict[str, Any]:
+    t_send = time.perf_counter()
+    try:
+        status, payload = client.request("POST", path, body)
+        err = None if status == 200 else payload.get("detail") or f"HTTP {status}"
+    except Exception as e:
+        status, payload, err = 0, {}, str(e)
+    t_recv = time.perf_counter()
+    results = payload.get("results") if "results" in payload else ([payload] if "decision_id" in payload else [])
+    return {
+        "status": status,
+        "error": err,
+        # En lazo abierto la latencia arranca en el instante programado (incluye la cola del cliente)
+        "latency_ms": (t_recv - (t_sched if t_sched is not None else t_send)) * 1000.0,
+        "service_ms": (t_recv - t_send) * 1000.0,
+        "server_ms": payload.get("latency_ms"),
+        "t_recv": t_recv,
+        "decisions": [(r["decision_id"], bool(r["secure"]), (r.get("onchain") or {}).get("status"))
+                      for r in results],
+    }
+
+def run_load(client: Client, path: str, bodies: List[Dict[str, Any]], concurrency: int,
+             rate: Optional[float], arrival: str, seed: int) -> Tuple[List[Dict[str, Any]], float]:
+    """Devuelve (resultados en orden de envío, duración en s)."""
+    out: List[Optional[Dict[str, Any]]] = [None] * len(bodies)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        if rate:
+            futs = []
+            for i, at in enumerate(_arrivals(len(bodies), rate, arrival, seed)):
+                target = t0 + at
+                delay = target - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futs.append((i, pool.submit(_send, client, path, bodies[i], target)))
+        else:
+            futs = [(i, pool.submit(_send, client, path, b, None)) for i, b in enumerate(bodies)]
+        for i, f in futs:
+            out[i] = f.result()
+    duration = max(r["t_recv"] for r in out) - t0 if out else 0.0
+    return out, duration
+
+# ---------- on-chain ----------
+def wait_onchain(client: Client, ids: List[str], timeout_s: float, poll_s: float,
+                 concurrency: int) -> Dict[str, Dict[str, Any]]:
+    """Estado final (o el último visto) de cada decision_id en /onchain/<id>."""
+    state: Dict[str, Dict[str, Any]] = {}
+    pending = list(dict.fromkeys(ids))
+    deadline = time.time() + timeout_s
+
+    def _get(d: str) -> Tuple[str, Dict[str, Any]]:
+        try:
+            status, payload = client.request("GET", f"/onchain/{d}")
+            return d, payload if status in (200, 404) else {"status": f"http_{status}"}
+        except Exception as e:
+            return d, {"status": "error", "detail": str(e)}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        while pending:
+            for d, payload in pool.map(_get, pending):
+                state[d] = payload
+            pending = [d for d in pending if state[d].get("status") not in TERMINAL]
+            if not pending or time.time() >= deadline:
+                break
+            print(f"[E2E] esperando eventos on-chain: {len(pending)} pendientes", flush=True)
+            time.sleep(poll_s)
+    return state
+
+# ---------- resumen ----------
+def _pct(values: List[float], q: float) -> Optional[float]:
+    return float(np.percentile(values, q)) if values else None
+
+def summarize(results: List[Dict[str, Any]], onchain: Optional[Dict[str, Dict[str, Any]]], duration: float,
+              config: Dict[str, Any]) -> Dict[str, Any]:
+    """onchain=None: no se consultaron los eventos (correlación y E2E quedan en null)."""
+    ok = [r for r in results if r["status"] == 200]
+    lat = [r["latency_ms"] for r in ok]
+    server = [r["server_ms"] for r in ok if r["server_ms"] is not None]
+    status_codes: Dict[str, int] = {}
+    for r in results:
+        status_codes[str(r["status"])] = status_codes.get(str(r["status"]), 0) + 1
+
+    # Una entrada por decision_id seguro (las repetidas dentro de la corrida cuentan una vez)
+    secure: Dict[str, Tuple[float, Optional[str]]] = {}
+    n_rows = n_fraud = 0
+    for r in ok:
+        for d, is_secure, first_status in r["decisions"]:
+            n_rows += 1
+            if not is_secure:
+                n_fraud += 1
+            elif d not in secure:
+                secure[d] = (r["latency_ms"], first_status)
+    e2e, confirmed, preexisting, failed = [], 0, 0, 0
+    for d, (scoring_ms, first_status) in secure.items():
+        s = (onchain or {}).get(d) or {}
+        if s.get("status") == "confirmed":
+            confirmed += 1
+            if first_status == "confirmed":
+                preexisting += 1  # ya estaba on-chain antes de esta corrida
+            elif s.get("updated_at") and s.get("created_at"):
+                e2e.append(scoring_ms + (float(s["updated_at"]) - float(s["created_at"])) * 1000.0)
+        elif s.get("status") in ("failed", "skipped"):
+            failed += 1
+
+    return {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        **config,
+        "requests": len(results),
+        "rows": n_rows,
+        "errors": len(results) - len(ok),
+        "status_codes": status_codes,
+        "duration_s": duration,
+        "throughput_rps": len(ok) / duration if duration > 0 else 0.0,
+        "rows_per_s": n_rows / duration if duration > 0 else 0.0,
+        "p50_scoring_ms": _pct(lat, 50), "p95_scoring_ms": _pct(lat, 95), "p99_scoring_ms": _pct(lat, 99),
+        "p95_service_ms": _pct([r["service_ms"] for r in ok], 95),
+        "p95_server_ms": _pct(server, 95),
+        "secure": len(secure),
+        "fraud": n_fraud,
+        "confirmed": confirmed,
+        "preexisting": preexisting,
+        "failed_onchain": failed,
+        "unconfirmed": len(secure) - confirmed - failed,
+        "p50_e2e_ms": _pct(e2e, 50), "p95_e2e_ms": _pct(e2e, 95), "p99_e2e_ms": _pct(e2e, 99),
+        "correlation_secure_to_event_pct": None if onchain is None else
+            (100.0 * confirmed / len(secure) if secure else 100.0),
+    }
+
+def check_baseline(cur: Dict[str, Any], base: Dict[str, Any], tolerance: float) -> Tuple[bool, List[str]]:
+    """(comparable, regresiones). Solo se compara la misma carga (WORKLOAD_KEYS)."""
+    if any(cur.get(k) != base.get(k) for k in WORKLOAD_KEYS):
+        return False, []
+    out = []
+    for k in ("p95_scoring_ms", "p95_e2e_ms"):
+        if base.get(k) and cur.get(k) is not None and cur[k] > base[k] * (1.0 + tolerance):
+            out.append(f"{k} {cur[k]:.1f} > {base[k]:.1f} (+{tolerance:.0%})")
+    if base.get("throughput_rps") and cur["throughput_rps"] < base["throughput_rps"] * (1.0 - tolerance):
+        out.append(f"throughput_rps {cur['throughput_rps']:.1f} < {base['throughput_rps']:.1f} (-{tolerance:.0%})")
+    k = "correlation_secure_to_event_pct"
+    if base.get(k) is not None and cur[k] is not None and cur[k] < base[k] - 0.5:
+        out.append(f"{k} {cur[k]:.1f}% < {base[k]:.1f}%")
+    return True, out
+
+def _write_json(path: str, obj: Any) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)  # el dashboard nunca ve un JSON a medio escribir
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--limit", type=int, default=500, help="Filas a reproducir")
+    ap.add_argument("--score-url", default="http://127.0.0.1:5000/score",
+                    help=".../score (una fila por request) o .../score/batch")
+    ap.add_argument("--data", default=os.path.join(ROOT, "data", "processed", "test.parquet"))
+    ap.add_argument("--batch-size", type=int, default=32, help="Filas por request en /score/batch")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--rate", type=float, default=None, help="req/s en lazo abierto (sin esto: lazo cerrado)")
+    ap.add_argument("--arrival", choices=["poisson", "uniform"], default="poisson")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--warmup", type=int, default=20, help="Requests previos que no se miden")
+    ap.add_argument("--fresh", action="store_true", help="decision_id nuevos (desplaza Time < 32 s)")
+    ap.add_argument("--event-timeout", type=float, default=60.0, help="Espera de eventos on-chain (0 = no esperar)")
+    ap.add_argument("--poll-interval", type=float, default=0.5)
+    ap.add_argument("--out", default=SUMMARY)
+    ap.add_argument("--baseline", default=BASELINE)
+    ap.add_argument("--save-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=0.20)
+    args = ap.parse_args()
+
+    u = urlsplit(args.score_url)
+    path = u.path or "/score"
+    mode = "batch" if path.rstrip("/").endswith("/batch") else "single"
+    client = Client(f"{u.scheme}://{u.netloc}")
+
+    # Múltiplo de 1/32: exacto en float32 para los valores de Time del dataset
+    fresh_offset = random.Random(time.time_ns()).randint(1, 1000) / 32.0 if args.fresh else 0.0
+    rows = load_rows(args.data, args.limit, fresh_offset)
+    run_id = datetime.now().strftime("%Y%m%d%H%M%S")
+    txs = [{"features": r, "tx_ref": f"e2e:{run_id}:{i}"} for i, r in enumerate(rows)]
+    if mode == "batch":
+        bodies = [{"transactions": txs[i:i + args.batch_size]} for i in range(0, len(txs), args.batch_size)]
+    else:
+        bodies = txs
+
+    config = {"score_url": args.score_url, "mode": mode, "limit": args.limit,
+              "concurrency": args.concurrency, "rate": args.rate, "arrival": args.arrival if args.rate else None,
+              "batch_size": args.batch_size if mode == "batch" else None, "seed": args.seed,
+              "fresh": bool(args.fresh), "data": os.path.relpath(args.data, ROOT)}
+    print(f"[E2E] {mode} {args.score_url} | {len(rows)} filas en {len(bodies)} requests | "
+          f"{'rate=' + str(args.rate) + ' req/s ' + args.arrival if args.rate else 'lazo cerrado'} "
+          f"concurrency={args.concurrency}", flush=True)
+
+    if args.warmup:
+        warm = bodies[:args.warmup] if mode == "single" else bodies[:1]
+        # Mismas filas: el calentamiento no agrega decisiones nuevas a la corrida
+        run_load(client, path, warm, min(args.concurrency, len(warm)), None, args.arrival, args.seed)
+
+    results, duration = run_load(client, path, bodies, args.concurrency, args.rate, args.arrival, args.seed)
+    errors = [r["error"] for r in results if r["error"]]
+    if errors:
+        print(f"[WARN] {len(errors)} requests con error; primero: {errors[0]}", flush=True)
+
+    secure_ids = [d for r in results if r["status"] == 200 for d, s, _ in r["decisions"] if s]
+    onchain = None
+    if args.event_timeout > 0:
+        onchain = wait_onchain(client, secure_ids, args.event_timeout, args.poll_interval, args.concurrency) \
+            if secure_ids else {}
+    summary = summarize(results, onchain, duration, config)
+
+    os.makedirs(REPORTS, exist_ok=True)
+    base = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            base = json.load(f)
+        comparable, regressions = check_baseline(summary, base, args.tolerance)
+        summary["baseline"] = {"path": os.path.relpath(args.baseline, ROOT), "comparable": comparable,
+                               "regressions": regressions}
+    _write_json(args.out, summary)
+    hist = os.path.join(REPORTS, f"e2e_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    _write_json(hist, summary)
+    record("e2e", hist)
+    if args.save_baseline:
+        _write_json(args.baseline, summary)
+
+    f = lambda v: "n/a" if v is None else f"{v:.1f}"
+    print(f"[E2E] {summary['requests']} requests / {summary['rows']} filas en {duration:.2f}s | "
+          f"{summary['throughput_rps']:.1f} req/s ({summary['rows_per_s']:.1f} filas/s) | errores={summary['errors']}")
+    print(f"[E2E] scoring ms p50={f(summary['p50_scoring_ms'])} p95={f(summary['p95_scoring_ms'])} "
+          f"p99={f(summary['p99_scoring_ms'])} | API p95={f(summary['p95_server_ms'])}")
+    print(f"[E2E] e2e ms     p50={f(summary['p50_e2e_ms'])} p95={f(summary['p95_e2e_ms'])} "
+          f"p99={f(summary['p99_e2e_ms'])} | seguras={summary['secure']} confirmadas={summary['confirmed']} "
+          f"(previas={summary['preexisting']}) correlación={f(summary['correlation_secure_to_event_pct'])}%")
+    print(f"OK → {args.out}" + (f" | baseline guardado en {args.baseline}" if args.save_baseline else ""))
+
+    if base is not None:
+        b = summary["baseline"]
+        if not b["comparable"]:
+            print(f"[WARN] El baseline es de otra carga ({', '.join(WORKLOAD_KEYS)}); no se compara")
+        elif b["regressions"]:
+            raise SystemExit("[E2E] Regresión contra el baseline: " + "; ".join(b["regressions"]))
+        else:
+            print("[E2E] Sin regresiones contra el baseline")
+
+if __name__ == "__main__":
+    main()
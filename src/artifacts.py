@@ -0,0 +1,109 @@
+﻿# -*- coding: utf-8 -*-
+"""
+artifacts.py — cache de artefactos (reports/*.json) compartido por API, dashboard y scripts
+- load_json(path): LRU por ruta, válido mientras (tamaño, mtime) no cambien; un hit es un os.stat
+- reports/manifest.json: {"latest": {"rf": "rf_....json", "baseline": "baseline_....json"}}
+  lo actualizan train_rf.py / baseline_rules.py al escribir (record)
+- latest(kind): O(1) vía manifest; si falta o apunta a un archivo borrado, cae al glob
+  (O(archivos)) y repara el manifest
+- Los objetos devueltos se comparten entre llamadas: no mutarlos
+"""
+
+from __future__ import annotations
+import os, json, glob, threading, time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+REPORTS = os.path.join(ROOT, "reports")
+MANIFEST_NAME = "manifest.json"
+ARTIFACT_CACHE_SIZE = int(os.getenv("ARTIFACT_CACHE_SIZE") or 64)
+
+class ArtifactCache:
+    """LRU de archivos parseados, invalidado por (tamaño, mtime_ns)."""
+
+    def __init__(self, capacity: int = ARTIFACT_CACHE_SIZE):
+        self.capacity = max(1, int(capacity))
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Tuple[Tuple[int, int], Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path: str, loader: Callable[[str], Any]) -> Any:
+        path = os.path.abspath(path)
+        st = os.stat(path)  # FileNotFoundError se propaga
+        stamp = (st.st_size, st.st_mtime_ns)
+        with self._lock:
+            item = self._items.get(path)
+            if item is not None and item[0] == stamp:
+                self._items.move_to_end(path)
+                self.hits += 1
+                return item[1]
+        value = loader(path)
+        with self._lock:
+            self.misses += 1
+            self._items[path] = (stamp, value)
+            self._items.move_to_end(path)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+def _read_json(path: str) -> Any:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+_cache = ArtifactCache()
+
+def load_json(path: str) -> Any:
+    return _cache.get(path, _read_json)
+
+# ---------- manifest ----------
+def _manifest_path(reports_dir: str) -> str:
+    return os.path.join(reports_dir, MANIFEST_NAME)
+
+def _read_manifest(reports_dir: str) -> Dict[str, Any]:
+    try:
+        m = load_json(_manifest_path(reports_dir))
+        return m if isinstance(m, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+def record(kind: str, path: str, reports_dir: Optional[str] = None) -> None:
+    """Registra path como último artefacto de kind (los nombres llevan timestamp: gana el mayor)."""
+    reports_dir = reports_dir or os.path.dirname(os.path.abspath(path))
+    name = os.path.basename(path)
+    m = _read_manifest(reports_dir)
+    latest = dict(m.get("latest") or {})
+    if latest.get(kind, "") > name and os.path.exists(os.path.join(reports_dir, latest[kind])):
+        return
+    latest[kind] = name
+    tmp = _manifest_path(reports_dir) + f".{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"latest": latest, "updated_at": time.strftime("%Y-%m-%d %H:%M:%S")}, f,
+                  ensure_ascii=False, indent=2)
+    os.replace(tmp, _manifest_path(reports_dir))
+
+def latest(kind: str, reports_dir: str = REPORTS) -> Optional[str]:
+    """Ruta del último {kind}_*.json en reports_dir, o None si no hay ninguno."""
+    name = (_read_manifest(reports_dir).get("latest") or {}).get(kind)
+    if name and os.path.exists(os.path.join(reports_dir, name)):
+        return os.path.join(reports_dir, name)
+    paths = sorted(glob.glob(os.path.join(reports_dir, f"{kind}_*.json")))
+    if not paths:
+        return None
+    try:
+        record(kind, paths[-1], reports_dir)
+    except OSError:
+        pass  # reports/ de solo lectura: seguimos con el glob
+    return paths[-1]
+
+def load_latest(kind: str, reports_dir: str = REPORTS) -> Optional[Tuple[Any, str]]:
+    """(contenido, ruta) del último {kind}_*.json, o None."""
+    path = latest(kind, reports_dir)
+    if path is None:
+        return None
+    return load_json(path), path
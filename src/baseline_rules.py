@@ -5,17 +5,25 @@ baseline_rules.py — Baseline simple (sin ML) para fraude:
 - Umbral por cuantil de negativos para controlar FPs
 - Reporta PR-AUC, F1 y precision/recall@k
 
+- --input: ruta de un split (parquet o csv); si su directorio tiene cache.json (data.py) se lee
+  del cache de columnas .npy, sin parsear
+
 Uso (ejemplo):
-  python .\src\baseline_rules.py --input .\data\processed\test.csv --outdir .\reports --k 100 500
+  python .\src\baseline_rules.py --input .\data\processed\test.parquet --outdir .\reports --k 100 500
 """
 
 from __future__ import annotations
-import argparse, json, os
+import argparse, json, os, sys
 from datetime import datetime
 import numpy as np
 import pandas as pd
 
 from metrics import pr_auc, f1_fraud, multi_k
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)  # se ejecuta como script: python .\src\baseline_rules.py
+from src.artifacts import record
+from dataset_cache import read_path
 
 def make_score(df: pd.DataFrame) -> np.ndarray:
     """
@@ -63,16 +71,16 @@ def pick_threshold(scores: np.ndarray, y_true: np.ndarray | None) -> float:
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--input", required=True, help="CSV de entrada (usar test.csv del Paso 3 para baseline)")
+    ap.add_argument("--input", required=True, help="Split de entrada (usar test.parquet / test.csv del Paso 3 para baseline)")
     ap.add_argument("--outdir", default=os.path.join("reports"), help="Directorio de salida de reportes")
     ap.add_argument("--k", nargs="+", type=int, default=[100, 500], help="Valores de k para precision/recall@k")
     args = ap.parse_args()
 
     os.makedirs(args.outdir, exist_ok=True)
-    df = pd.read_csv(args.input)
+    df = read_path(args.input, columns=["Amount", "V1", "Class"])
 
     if "Class" not in df.columns:
-        raise ValueError("El CSV debe contener columna 'Class' (0/1)")
+        raise ValueError("La entrada debe contener columna 'Class' (0/1)")
 
     y_true = df["Class"].astype(int).values
     scores = make_score(df)
@@ -99,6 +107,7 @@ def main():
     fpath = os.path.join(args.outdir, fname)
     with open(fpath, "w", encoding="utf-8") as f:
         json.dump(out, f, ensure_ascii=False, indent=2)
+    record("baseline", fpath)  # reports/manifest.json -> último baseline
 
     print(f"OK → baseline guardado en: {fpath}")
     print(f"PR-AUC={out['metrics']['pr_auc']:.4f}  F1={out['metrics']['f1_fraud']:.4f}")
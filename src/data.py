@@ -1,16 +1,39 @@
 ﻿# -*- coding: utf-8 -*-
 """
 fraudchain - Paso 3: Data loader RAM-friendly + split out-of-time
+- En memoria (por defecto): lee el CSV completo y parte con StratifiedShuffleSplit
+- --chunksize N: modo por bloques en dos pasadas, memoria acotada por N filas (exports más
+  grandes que la RAM)
+  * pasada 1: Time min/max y conteos exactos (filas, positivos) por bin de Time (TimeHistogram,
+    hasta --time-bins bins; el ancho se duplica cuando el rango crece). Con eso se elige el
+    cutoff (redondeado a un borde de bin) y se sabe cuántas filas de cada clase quedan antes
+  * pasada 2: cada bloque va directo a los writers de train / val / test (Parquet con
+    pyarrow, si no CSV). val es un muestreo estratificado exacto sin reemplazo: por bloque se
+    sortean cuántas filas de cada clase van a val (hipergeométrica sobre lo que falta)
+  * --sample-frac es un Bernoulli por fila (misma semilla en las dos pasadas); el orden del
+    archivo se conserva (no se re-ordena por Time)
+- Cache (src/dataset_cache.py): los splits quedan también en data/cache/<clave>/ como columnas
+  .npy, con clave = hash del CSV + parámetros. Si la clave ya existe no se parsea el CSV: solo
+  se re-exportan train / val / test desde el cache cuando outdir apunta a otra clave.
+  outdir/cache.json apunta a la entrada (train_rf.py y baseline_rules.py leen de ahí).
+  --no-cache: comportamiento anterior (y se borra el puntero)
 Uso:
   python .\src\data.py --input .\data\creditcard.csv --outdir .\data\processed --sample-frac 0.30 --test-frac-time 0.20 --val-frac 0.10 --random-state 42
+  python .\src\data.py --input .\data\transactions.csv --outdir .\data\processed --chunksize 500000
 """
 
 import argparse, os, sys, json
 import numpy as np
 import pandas as pd
 from datetime import datetime
+from typing import Dict, Iterator, Optional, Tuple
 from sklearn.model_selection import StratifiedShuffleSplit
 
+import dataset_cache
+
+COLS = ["Time"] + [f"V{i}" for i in range(1,29)] + ["Amount","Class"]
+DTYPE = {**{c: "float32" for c in COLS if c != "Class"}, "Class": "int8"}
+
 def _has_pyarrow():
     try:
         import pyarrow  # noqa
@@ -24,34 +47,33 @@ def _bytes(n: int) -> str:
         n /= 1024
     return f"{n:.1f} PB"
 
+def _check_fracs(test_frac_time: float, val_frac: float) -> None:
+    if not (0.0 < test_frac_time < 0.9):
+        raise ValueError("test_frac_time debe estar entre (0, 0.9)")
+    if not (0.0 < val_frac < 0.5):
+        raise ValueError("val_frac debe estar entre (0, 0.5)")
+
 def load_creditcard_csv(path: str) -> pd.DataFrame:
-    cols = ["Time"] + [f"V{i}" for i in range(1,29)] + ["Amount","Class"]
-    dtype = {c:"float32" for c in cols if c not in ("Time","Class")}
-    dtype["Time"] = "float32"
-    dtype["Class"] = "int8"
-    df = pd.read_csv(path, usecols=lambda c: c in cols, dtype=dtype, low_memory=True)
-    missing = [c for c in cols if c not in df.columns]
+    df = pd.read_csv(path, usecols=lambda c: c in COLS, dtype=DTYPE, low_memory=True)
+    missing = [c for c in COLS if c not in df.columns]
     if missing:
         raise ValueError(f"Faltan columnas en {path}: {missing}")
-    return df[cols]
+    return df[COLS]
 
 def split_out_of_time(df: pd.DataFrame, test_frac_time: float, val_frac: float, random_state: int):
-    if not (0.0 < test_frac_time < 0.9):
-        raise ValueError("test_frac_time debe estar entre (0, 0.9)")
-    if not (0.0 < val_frac < 0.5):
-        raise ValueError("val_frac debe estar entre (0, 0.5)")
+    _check_fracs(test_frac_time, val_frac)
 
-    t_min, t_max = float(df["Time"].min()), float(df["Time"].max())
+    t = df["Time"].values
+    t_min, t_max = float(t.min()), float(t.max())
     cutoff = t_min + (t_max - t_min) * (1.0 - test_frac_time)
 
-    early = df[df["Time"] < cutoff].copy()
-    late  = df[df["Time"] >= cutoff].copy()
-
-    # si late quedó sin positivos, mover cutoff un poco
-    if late["Class"].sum() == 0 and test_frac_time <= 0.85:
+    # si late quedaría sin positivos, mover cutoff un poco (se decide con la máscara, sin copiar)
+    if df["Class"].values[t >= cutoff].sum() == 0 and test_frac_time <= 0.85:
         cutoff = t_min + (t_max - t_min) * (1.0 - (test_frac_time + 0.05))
-        early = df[df["Time"] < cutoff].copy()
-        late  = df[df["Time"] >= cutoff].copy()
+
+    is_early = t < cutoff
+    early = df[is_early]
+    late  = df[~is_early]
 
     # val estratificado en early (si hay ambas clases)
     if early["Class"].nunique() >= 2 and len(early) > 0:
@@ -69,6 +91,195 @@ def split_out_of_time(df: pd.DataFrame, test_frac_time: float, val_frac: float,
     test = late
     return train, val, test
 
+# ---------- modo por bloques ----------
+def iter_creditcard_csv(path: str, chunksize: int, cols=COLS) -> Iterator[pd.DataFrame]:
+    """Bloques de hasta chunksize filas con las columnas y dtypes de load_creditcard_csv."""
+    reader = pd.read_csv(path, usecols=lambda c: c in cols, dtype={c: DTYPE[c] for c in cols}, chunksize=chunksize)
+    for i, chunk in enumerate(reader):
+        if i == 0:
+            missing = [c for c in cols if c not in chunk.columns]
+            if missing:
+                raise ValueError(f"Faltan columnas en {path}: {missing}")
+        yield chunk[list(cols)]
+
+def _sample_mask(n: int, sample_frac: float, random_state: int, chunk_idx: int) -> Optional[np.ndarray]:
+    """Bernoulli por fila; depende solo de (semilla, bloque): igual en las dos pasadas."""
+    if not (0 < sample_frac < 1.0):
+        return None
+    return np.random.default_rng([random_state, chunk_idx]).random(n) < sample_frac
+
+class TimeHistogram:
+    """
+    Conteos exactos de filas y positivos por bin de Time, con memoria acotada: los bins tienen
+    ancho w (potencia de 2) y si hay más de max_bins ocupados w se duplica fusionando de a pares
+    (floor(t / 2w) == floor(floor(t / w) / 2), así los conteos siguen exactos).
+    """
+
+    def __init__(self, max_bins: int = 4096, width: float = 2.0 ** -6):
+        self.max_bins = max(16, int(max_bins))
+        self.width = float(width)
+        self.rows: Dict[int, int] = {}
+        self.pos: Dict[int, int] = {}
+
+    def add(self, t: np.ndarray, y: np.ndarray) -> None:
+        if len(t) == 0:
+            return
+        keys = np.floor(t.astype("float64") / self.width).astype(np.int64)
+        # Un bloque que abarca más de 2·max_bins bins ya obliga a ensanchar (y acota el loop de abajo)
+        while (int(keys.max()) - int(keys.min())) >= 2 * self.max_bins:
+            keys = keys // 2
+            self._coarsen()
+        uk, inv = np.unique(keys, return_inverse=True)
+        n = np.bincount(inv)
+        p = np.bincount(inv, weights=y.astype("float64")).astype(np.int64)
+        for k, a, b in zip(uk.tolist(), n.tolist(), p.tolist()):
+            self.rows[k] = self.rows.get(k, 0) + a
+            if b:
+                self.pos[k] = self.pos.get(k, 0) + b
+        while len(self.rows) > self.max_bins:
+            self._coarsen()
+
+    def _coarsen(self) -> None:
+        self.width *= 2.0
+        for name in ("rows", "pos"):
+            merged: Dict[int, int] = {}
+            for k, v in getattr(self, name).items():
+                merged[k // 2] = merged.get(k // 2, 0) + v
+            setattr(self, name, merged)
+
+    def snap(self, x: float) -> float:
+        """Borde de bin más cercano a x (el cutoff tiene que caer en un borde para contar exacto)."""
+        return round(x / self.width) * self.width
+
+    def below(self, cutoff: float) -> Tuple[int, int]:
+        """(filas, positivos) con Time < cutoff; cutoff debe ser un borde (snap)."""
+        edge = int(round(cutoff / self.width))
+        return (sum(v for k, v in self.rows.items() if k < edge),
+                sum(v for k, v in self.pos.items() if k < edge))
+
+def scan_time(path: str, chunksize: int, sample_frac: float = 1.0, random_state: int = 42,
+              max_bins: int = 4096) -> Dict[str, object]:
+    """Pasada 1: filas, positivos, Time min/max e histograma de Time (solo se parsean Time y Class)."""
+    hist = TimeHistogram(max_bins)
+    n = pos = 0
+    t_min, t_max = float("inf"), float("-inf")
+    for i, chunk in enumerate(iter_creditcard_csv(path, chunksize, ("Time", "Class"))):
+        t, y = chunk["Time"].values, chunk["Class"].values
+        m = _sample_mask(len(chunk), sample_frac, random_state, i)
+        if m is not None:
+            t, y = t[m], y[m]
+        if len(t) == 0:
+            continue
+        n += len(t); pos += int(y.sum())
+        t_min, t_max = min(t_min, float(t.min())), max(t_max, float(t.max()))
+        hist.add(t, y)
+    if n == 0:
+        raise ValueError(f"{path} no tiene filas")
+    return {"rows": n, "positives": pos, "t_min": t_min, "t_max": t_max, "hist": hist}
+
+def choose_cutoff(stats: Dict[str, object], test_frac_time: float) -> Tuple[float, int, int]:
+    """Misma regla que split_out_of_time sobre el histograma -> (cutoff, filas early, positivos early)."""
+    hist: TimeHistogram = stats["hist"]
+    t_min, t_max = stats["t_min"], stats["t_max"]
+    cutoff = hist.snap(t_min + (t_max - t_min) * (1.0 - test_frac_time))
+    rows, pos = hist.below(cutoff)
+    if stats["positives"] - pos == 0 and test_frac_time <= 0.85:
+        cutoff = hist.snap(t_min + (t_max - t_min) * (1.0 - (test_frac_time + 0.05)))
+        rows, pos = hist.below(cutoff)
+    return cutoff, rows, pos
+
+class _SplitWriter:
+    """Escribe un split por bloques: un ParquetWriter (pyarrow) o CSV en modo append."""
+
+    def __init__(self, path: str, use_parquet: bool):
+        self.path, self.use_parquet = path, use_parquet
+        self.rows = self.positives = 0
+        self._w = None
+        if os.path.exists(path):
+            os.remove(path)
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self.use_parquet:
+            import pyarrow as pa, pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._w is None:
+                self._w = pq.ParquetWriter(self.path, table.schema)
+            self._w.write_table(table)
+        else:
+            df.to_csv(self.path, mode="a", header=self.rows == 0, index=False)
+        self.rows += len(df)
+        self.positives += int(df["Class"].sum())
+
+    def close(self) -> None:
+        if self.use_parquet:
+            if self._w is None:  # split vacío: archivo con el esquema igual
+                pd.DataFrame({c: pd.Series(dtype=d) for c, d in DTYPE.items()}).to_parquet(self.path, index=False)
+            else:
+                self._w.close()
+        elif self.rows == 0:
+            pd.DataFrame(columns=COLS).to_csv(self.path, index=False)
+
+def split_out_of_time_chunked(path: str, outdir: str, chunksize: int, test_frac_time: float, val_frac: float,
+                              random_state: int, sample_frac: float = 1.0, max_bins: int = 4096) -> Dict[str, object]:
+    """Dos pasadas por bloques; escribe train / val / test en outdir y devuelve el resumen."""
+    _check_fracs(test_frac_time, val_frac)
+    stats = scan_time(path, chunksize, sample_frac, random_state, max_bins)
+    cutoff, early_rows, early_pos = choose_cutoff(stats, test_frac_time)
+    print(f"Pasada 1: {stats['rows']:,} filas ({stats['positives']:,} positivos) | "
+          f"cutoff Time={cutoff:.3f} (bin {stats['hist'].width:g}s) | early={early_rows:,}")
+
+    # Cupo de val por clase (exacto, como StratifiedShuffleSplit) y población early que falta ver
+    need = {0: int(round(val_frac * (early_rows - early_pos))), 1: int(round(val_frac * early_pos))}
+    left = {0: early_rows - early_pos, 1: early_pos}
+    rng = np.random.default_rng(random_state)
+    use_parquet = _has_pyarrow()
+    ext = "parquet" if use_parquet else "csv"
+    writers = {s: _SplitWriter(os.path.join(outdir, f"{s}.{ext}"), use_parquet) for s in ("train", "val", "test")}
+    peak_chunk = 0
+    try:
+        for i, chunk in enumerate(iter_creditcard_csv(path, chunksize)):
+            m = _sample_mask(len(chunk), sample_frac, random_state, i)
+            if m is not None:
+                chunk = chunk[m]
+            peak_chunk = max(peak_chunk, int(chunk.memory_usage(deep=True).sum()))
+            # float64 como en el histograma: cada fila cae del mismo lado del cutoff que en la pasada 1
+            is_early = chunk["Time"].values.astype("float64") < cutoff
+            if (~is_early).any():
+                writers["test"].write(chunk[~is_early])
+            early = chunk[is_early]
+            if len(early) == 0:
+                continue
+            y = early["Class"].values
+            to_val = np.zeros(len(early), dtype=bool)
+            for c in (0, 1):
+                idx = np.flatnonzero(y == c)
+                if len(idx) == 0 or need[c] == 0:
+                    left[c] -= len(idx)
+                    continue
+                # De las left[c] filas de la clase que faltan, need[c] van a val: cuántas caen en este bloque
+                k = int(rng.hypergeometric(need[c], left[c] - need[c], len(idx)))
+                if k:
+                    to_val[rng.choice(idx, size=k, replace=False)] = True
+                need[c] -= k
+                left[c] -= len(idx)
+            if to_val.any():
+                writers["val"].write(early[to_val])
+            if (~to_val).any():
+                writers["train"].write(early[~to_val])
+    finally:
+        for w in writers.values():
+            w.close()
+
+    return {
+        "rows": {"total": stats["rows"], **{s: w.rows for s, w in writers.items()}},
+        "positives": {"total": stats["positives"], **{s: w.positives for s, w in writers.items()}},
+        "paths": {s: w.path for s, w in writers.items()},
+        "format": ext,
+        "cutoff_time": cutoff,
+        "time_bin_s": stats["hist"].width,
+        "peak_chunk_bytes": peak_chunk,
+    }
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--input", required=True)
@@ -77,44 +288,110 @@ def main():
     ap.add_argument("--test-frac-time", type=float, default=0.20)
     ap.add_argument("--val-frac", type=float, default=0.10)
     ap.add_argument("--random-state", type=int, default=42)
+    ap.add_argument("--chunksize", type=int, default=0, help="Filas por bloque (0 = todo en memoria)")
+    ap.add_argument("--time-bins", type=int, default=4096, help="Bins máximos del histograma de Time (modo por bloques)")
+    ap.add_argument("--cache-dir", default=dataset_cache.CACHE_DIR)
+    ap.add_argument("--no-cache", action="store_true", help="Parsear siempre y no escribir el cache")
     args = ap.parse_args()
 
     os.makedirs(args.outdir, exist_ok=True)
+    params = { "sample_frac": args.sample_frac, "test_frac_time": args.test_frac_time, "val_frac": args.val_frac, "random_state": args.random_state }
+    # El modo por bloques sortea por bloque: chunksize / time_bins cambian los splits y van en la clave
+    key_params = {**params, "chunksize": args.chunksize, "time_bins": args.time_bins if args.chunksize > 0 else None}
+
+    key = entry = None
+    if args.no_cache:
+        dataset_cache.unlink(args.outdir)
+    else:
+        sha = dataset_cache.input_sha256(args.input, args.cache_dir)
+        key = dataset_cache.cache_key(sha, key_params)
+        entry = dataset_cache.lookup(key, args.cache_dir)
+    if entry:
+        summ = _from_cache(entry, key, args.outdir, args.cache_dir)
+        p_train, p_val, p_test = (summ["paths"][s] for s in ("train", "val", "test"))
+        print(f"Cache hit {key}: {entry} (sin parsear {args.input})")
+        _finish(args.outdir, summ, p_train, p_val, p_test)
+        return
+    if key:
+        dataset_cache.unlink(args.outdir)  # outdir se reescribe: el puntero viejo ya no vale
+
     print(f"[{datetime.now().strftime('%H:%M:%S')}] Leyendo: {args.input}")
-    df = load_creditcard_csv(args.input)
+    if args.chunksize > 0:
+        print(f"Split OOT por bloques de {args.chunksize:,} filas: test_frac_time={args.test_frac_time:.2f}  val_frac={args.val_frac:.2f}")
+        summ = split_out_of_time_chunked(args.input, args.outdir, args.chunksize, args.test_frac_time, args.val_frac,
+                                         args.random_state, args.sample_frac, args.time_bins)
+        summ["params"] = {**params, "chunksize": args.chunksize, "time_bins": args.time_bins}
+        print(f"Memoria: bloque máx={_bytes(summ['peak_chunk_bytes'])}  "
+              f"filas train={summ['rows']['train']:,} val={summ['rows']['val']:,} test={summ['rows']['test']:,}")
+        p_train, p_val, p_test = (summ["paths"][s] for s in ("train", "val", "test"))
+    else:
+        df = load_creditcard_csv(args.input)
+
+        if 0 < args.sample_frac < 1.0:
+            df = df.sample(frac=args.sample_frac, random_state=args.random_state)
+            df = df.sort_values("Time", kind="stable").reset_index(drop=True)
+            print(f"sample-frac={args.sample_frac:.2f} → {len(df):,} filas")
 
-    if 0 < args.sample_frac < 1.0:
-        df = df.sample(frac=args.sample_frac, random_state=args.random_state)
-        df = df.sort_values("Time", kind="stable").reset_index(drop=True)
-        print(f"sample-frac={args.sample_frac:.2f} → {len(df):,} filas")
+        print(f"Split OOT: test_frac_time={args.test_frac_time:.2f}  val_frac={args.val_frac:.2f}")
+        train, val, test = split_out_of_time(df, args.test_frac_time, args.val_frac, args.random_state)
 
-    print(f"Split OOT: test_frac_time={args.test_frac_time:.2f}  val_frac={args.val_frac:.2f}")
-    train, val, test = split_out_of_time(df, args.test_frac_time, args.val_frac, args.random_state)
+        mem = lambda x: _bytes(x.memory_usage(deep=True).sum())
+        print(f"Memoria total={mem(df)}  train={mem(train)}  val={mem(val)}  test={mem(test)}")
 
-    mem = lambda x: _bytes(x.memory_usage(deep=True).sum())
-    print(f"Memoria total={mem(df)}  train={mem(train)}  val={mem(val)}  test={mem(test)}")
+        use_parquet = _has_pyarrow()
+        def _save(dfp, name):
+            p = os.path.join(args.outdir, f"{name}.{'parquet' if use_parquet else 'csv'}")
+            if use_parquet:
+                dfp.to_parquet(p, index=False)
+            else:
+                dfp.to_csv(p, index=False)
+            return p
 
+        p_train = _save(train, "train")
+        p_val   = _save(val, "val")
+        p_test  = _save(test, "test")
+
+        summ = {
+            "rows": { "total": int(len(df)), "train": int(len(train)), "val": int(len(val)), "test": int(len(test)) },
+            "positives": { "total": int(df['Class'].sum()), "train": int(train['Class'].sum()), "val": int(val['Class'].sum()), "test": int(test['Class'].sum()) },
+            "paths": { "train": p_train, "val": p_val, "test": p_test },
+            "format": "parquet" if use_parquet else "csv",
+            "params": params
+        }
+        frames = {"train": [train], "val": [val], "test": [test]}
+        del df
+    if key:
+        if args.chunksize > 0:
+            frames = {s: dataset_cache.iter_file(summ["paths"][s], args.chunksize) for s in ("train", "val", "test")}
+        meta = {"input": os.path.abspath(args.input), "input_sha256": sha, "params": key_params, "columns": COLS,
+                "rows": summ["rows"], "positives": summ["positives"],
+                "summary": {k: v for k, v in summ.items() if k not in ("paths", "format")}}
+        entry = dataset_cache.store(key, frames, meta, args.cache_dir)
+        dataset_cache.link(args.outdir, key, args.cache_dir)
+        summ["cache"] = {"key": key, "entry": entry, "hit": False}
+        print(f"Cache: {entry}")
+    _finish(args.outdir, summ, p_train, p_val, p_test)
+
+def _from_cache(entry: str, key: str, outdir: str, cache_dir: str) -> Dict[str, object]:
+    """Resumen desde meta.json; re-exporta train / val / test solo si outdir tiene otros splits."""
+    meta = dataset_cache.read_meta(entry)
     use_parquet = _has_pyarrow()
-    def _save(dfp, name):
-        p = os.path.join(args.outdir, f"{name}.{'parquet' if use_parquet else 'csv'}")
-        if use_parquet:
-            dfp.to_parquet(p, index=False)
-        else:
-            dfp.to_csv(p, index=False)
-        return p
-
-    p_train = _save(train, "train")
-    p_val   = _save(val, "val")
-    p_test  = _save(test, "test")
-
-    summ = {
-        "rows": { "total": int(len(df)), "train": int(len(train)), "val": int(len(val)), "test": int(len(test)) },
-        "positives": { "total": int(df['Class'].sum()), "train": int(train['Class'].sum()), "val": int(val['Class'].sum()), "test": int(test['Class'].sum()) },
-        "paths": { "train": p_train, "val": p_val, "test": p_test },
-        "format": "parquet" if use_parquet else "csv",
-        "params": { "sample_frac": args.sample_frac, "test_frac_time": args.test_frac_time, "val_frac": args.val_frac, "random_state": args.random_state }
-    }
-    sp = os.path.join(args.outdir, f"summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    ext = "parquet" if use_parquet else "csv"
+    paths = {s: os.path.join(outdir, f"{s}.{ext}") for s in ("train", "val", "test")}
+    if dataset_cache.linked_key(outdir) != key or not all(os.path.exists(p) for p in paths.values()):
+        dataset_cache.unlink(outdir)
+        for s, p in paths.items():
+            w = _SplitWriter(p, use_parquet)
+            try:
+                for chunk in dataset_cache.iter_frames(entry, s):
+                    w.write(chunk)
+            finally:
+                w.close()
+        dataset_cache.link(outdir, key, cache_dir)
+    return {**meta["summary"], "paths": paths, "format": ext, "cache": {"key": key, "entry": entry, "hit": True}}
+
+def _finish(outdir: str, summ: Dict[str, object], p_train: str, p_val: str, p_test: str) -> None:
+    sp = os.path.join(outdir, f"summary_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
     with open(sp, "w", encoding="utf-8") as f:
         json.dump(summ, f, ensure_ascii=False, indent=2)
 
@@ -0,0 +1,250 @@
+﻿# -*- coding: utf-8 -*-
+"""
+dataset_cache.py — cache de splits direccionado por contenido (data/cache/)
+- Clave = sha256(sha256 del CSV de entrada + parámetros del split): mismo archivo y mismos
+  sample_frac / test_frac_time / val_frac / random_state (+ modo por bloques) -> mismos splits.
+  Renombrar o mover el CSV no invalida nada; cambiar un byte sí
+- data/cache/<clave>/<split>/<columna>.npy: un array por columna (float32; Class int8), se abren
+  con np.load(mmap_mode="r") -> cargar un split no parsea nada y solo se pagina lo que se lee
+- matrix(): la matriz de features float32 C-contigua del split, también en disco (X_<hash>.npy);
+  train_rf.py entrena directo sobre ella
+- data/cache/<clave>/meta.json: entrada, parámetros, columnas, filas / positivos por split.
+  La entrada se arma en un directorio temporal y se renombra al final: una entrada a medio
+  escribir nunca se ve
+- data/cache/inputs.json: sha256 por ruta, válido mientras (tamaño, mtime) no cambien: no se
+  re-hashea un CSV de varios GB en cada corrida
+- data.py deja <outdir>/cache.json {"key": ...}; train_rf.py, baseline_rules.py,
+  scripts/run_e2e.py y api/forest.py leen desde el cache si el puntero existe (si no, parquet / csv)
+- DATASET_CACHE_DIR cambia la raíz
+"""
+
+from __future__ import annotations
+import os, json, shutil, hashlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+CACHE_DIR = os.getenv("DATASET_CACHE_DIR") or os.path.join(ROOT, "data", "cache")
+POINTER_FILE = "cache.json"
+META_FILE = "meta.json"
+INPUTS_FILE = "inputs.json"
+SPLITS = ("train", "val", "test")
+FORMAT_VERSION = 1  # sube si cambia el layout o la lógica del split
+
+def _dtype(col: str) -> str:
+    return "int8" if col == "Class" else "float32"
+
+def _write_json_atomic(path: str, obj: Any) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def _read_json(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# ---------- clave ----------
+def input_sha256(path: str, cache_dir: str = CACHE_DIR) -> str:
+    """sha256 del archivo; memorizado en inputs.json por (ruta, tamaño, mtime_ns)."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    memo_path = os.path.join(cache_dir, INPUTS_FILE)
+    memo = _read_json(memo_path) or {}
+    item = memo.get(path)
+    if item and item.get("size") == st.st_size and item.get("mtime_ns") == st.st_mtime_ns:
+        return item["sha256"]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    memo[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": h.hexdigest()}
+    os.makedirs(cache_dir, exist_ok=True)
+    _write_json_atomic(memo_path, memo)
+    return memo[path]["sha256"]
+
+def cache_key(input_hash: str, params: Dict[str, Any]) -> str:
+    blob = json.dumps({"input": input_hash, "params": params, "v": FORMAT_VERSION}, sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:24]
+
+# ---------- escritura ----------
+def lookup(key: str, cache_dir: str = CACHE_DIR) -> Optional[str]:
+    """Directorio de la entrada si está completa (tiene meta.json), si no None."""
+    entry = os.path.join(cache_dir, key)
+    return entry if os.path.exists(os.path.join(entry, META_FILE)) else None
+
+def store(key: str, frames: Dict[str, Iterable[pd.DataFrame]], meta: Dict[str, Any],
+          cache_dir: str = CACHE_DIR) -> str:
+    """
+    Escribe cada split columna por columna. frames[split] es un iterable de bloques (un solo
+    DataFrame en memoria o los bloques de un archivo); meta["rows"][split] y meta["columns"]
+    tienen que venir completos: los .npy se crean con su tamaño final y se llenan por bloques.
+    """
+    cols: List[str] = list(meta["columns"])
+    tmp = os.path.join(cache_dir, f"{key}.{os.getpid()}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    try:
+        for split, chunks in frames.items():
+            n = int(meta["rows"][split])
+            os.makedirs(os.path.join(tmp, split))
+            arrays = {c: np.lib.format.open_memmap(os.path.join(tmp, split, f"{c}.npy"), mode="w+",
+                                                   dtype=_dtype(c), shape=(n,)) for c in cols}
+            i = 0
+            for chunk in chunks:
+                if i + len(chunk) > n:
+                    raise ValueError(f"{split}: más filas que las declaradas ({n})")
+                for c in cols:
+                    arrays[c][i:i + len(chunk)] = chunk[c].to_numpy(dtype=_dtype(c))
+                i += len(chunk)
+            if i != n:
+                raise ValueError(f"{split}: {i} filas escritas, se esperaban {n}")
+            for a in arrays.values():
+                a.flush()
+            del arrays
+        meta = {**meta, "key": key, "format": "npy", "format_version": FORMAT_VERSION,
+                "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        _write_json_atomic(os.path.join(tmp, META_FILE), meta)
+        entry = os.path.join(cache_dir, key)
+        if lookup(key, cache_dir):
+            shutil.rmtree(tmp, ignore_errors=True)  # otra corrida la completó antes: misma clave, mismo contenido
+        else:
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(tmp, entry)
+        return entry
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+def iter_file(path: str, batch_rows: int = 500_000) -> Iterator[pd.DataFrame]:
+    """Bloques de un split ya escrito (parquet por row groups o CSV por chunks)."""
+    if path.lower().endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_rows):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=batch_rows)
+
+# ---------- lectura ----------
+def read_meta(entry: str) -> Dict[str, Any]:
+    meta = _read_json(os.path.join(entry, META_FILE))
+    if meta is None:
+        raise FileNotFoundError(f"Entrada de cache incompleta: {entry}")
+    return meta
+
+def load_columns(entry: str, split: str, columns: Optional[Sequence[str]] = None) -> Dict[str, np.ndarray]:
+    """{columna: array de solo lectura mapeado a disco}; no copia ni parsea."""
+    cols = list(columns) if columns is not None else list(read_meta(entry)["columns"])
+    return {c: np.load(os.path.join(entry, split, f"{c}.npy"), mmap_mode="r") for c in cols}
+
+def load_frame(entry: str, split: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """DataFrame con las columnas del split (pandas copia los arrays al armar los bloques)."""
+    return pd.DataFrame(load_columns(entry, split, columns))
+
+def iter_frames(entry: str, split: str, batch_rows: int = 500_000) -> Iterator[pd.DataFrame]:
+    """El split en bloques de batch_rows filas (para re-exportar sin cargarlo entero)."""
+    arrays = load_columns(entry, split)
+    n = len(next(iter(arrays.values()))) if arrays else 0
+    for i in range(0, n, batch_rows):
+        yield pd.DataFrame({c: np.asarray(a[i:i + batch_rows]) for c, a in arrays.items()})
+
+def matrix(entry: str, split: str, columns: Sequence[str], batch_rows: int = 1 << 18) -> np.ndarray:
+    """
+    Matriz (filas, columnas) float32 C-contigua, mapeada a disco y de solo lectura. Se arma una
+    vez por conjunto de columnas (<split>/X_<hash>.npy, por bloques de filas) y se reutiliza:
+    los hilos / procesos que la abren comparten las mismas páginas del page cache.
+    """
+    cols = list(columns)
+    tag = hashlib.sha256(json.dumps(cols).encode("utf-8")).hexdigest()[:12]
+    path = os.path.join(entry, split, f"X_{tag}.npy")
+    if not os.path.exists(path):
+        arrays = load_columns(entry, split, cols)
+        n = len(arrays[cols[0]]) if cols else 0
+        tmp = f"{path}.{os.getpid()}.tmp"
+        X = np.lib.format.open_memmap(tmp, mode="w+", dtype="float32", shape=(n, len(cols)))
+        for i in range(0, n, batch_rows):
+            X[i:i + batch_rows] = np.column_stack([arrays[c][i:i + batch_rows] for c in cols])
+        X.flush()
+        del X
+        os.replace(tmp, path)
+    return np.load(path, mmap_mode="r")
+
+# ---------- puntero en el directorio de splits ----------
+def link(outdir: str, key: str, cache_dir: str = CACHE_DIR) -> None:
+    _write_json_atomic(os.path.join(outdir, POINTER_FILE),
+                       {"key": key, "entry": os.path.abspath(os.path.join(cache_dir, key))})
+
+def unlink(outdir: str) -> None:
+    try:
+        os.remove(os.path.join(outdir, POINTER_FILE))
+    except FileNotFoundError:
+        pass
+
+def linked_key(outdir: str) -> Optional[str]:
+    ptr = _read_json(os.path.join(outdir, POINTER_FILE))
+    return ptr.get("key") if ptr else None
+
+def resolve(path: str, split: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """
+    (entrada, split) para un directorio de splits (con split) o la ruta de un split
+    (.../test.parquet, .../test.csv); None si no hay puntero o la entrada ya no existe.
+    """
+    if split is None:
+        path, name = os.path.split(path)
+        split = os.path.splitext(name)[0]
+    if split not in SPLITS:
+        return None
+    ptr = _read_json(os.path.join(path or ".", POINTER_FILE))
+    if not ptr:
+        return None
+    entry = ptr.get("entry") or ""
+    if not os.path.isdir(entry):  # repo movido: la misma clave bajo la raíz actual
+        entry = os.path.join(CACHE_DIR, ptr.get("key", ""))
+    if not os.path.exists(os.path.join(entry, META_FILE)) or not os.path.isdir(os.path.join(entry, split)):
+        return None
+    return entry, split
+
+def _read_file(path: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """parquet (csv hermano si pyarrow falla) o csv; columns filtra las que existan."""
+    want = None if columns is None else set(columns)
+    if path.lower().endswith(".parquet"):
+        try:
+            if want is None:
+                return pd.read_parquet(path)
+            import pyarrow.parquet as pq
+            names = pq.read_schema(path).names
+            return pd.read_parquet(path, columns=[c for c in names if c in want])
+        except Exception:
+            csv = os.path.splitext(path)[0] + ".csv"
+            if not os.path.exists(csv):
+                raise
+            path = csv
+    return pd.read_csv(path, usecols=None if want is None else (lambda c: c in want))
+
+def _cached(entry: str, split: str, columns: Optional[Sequence[str]]) -> pd.DataFrame:
+    if columns is not None:
+        have = set(read_meta(entry)["columns"])
+        columns = [c for c in columns if c in have]
+    return load_frame(entry, split, columns)
+
+def read_path(path: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Un split por ruta de archivo: desde el cache si el directorio tiene puntero, si no parquet / csv."""
+    hit = resolve(path)
+    if hit is not None:
+        return _cached(*hit, columns)
+    if not os.path.exists(path) and path.lower().endswith(".parquet"):
+        path = os.path.splitext(path)[0] + ".csv"
+    return _read_file(path, columns)
+
+def read_split(data_dir: str, split: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """Un split por directorio: cache, si no <split>.parquet, si no <split>.csv."""
+    hit = resolve(data_dir, split)
+    if hit is not None:
+        return _cached(*hit, columns)
+    p = os.path.join(data_dir, f"{split}.parquet")
+    return _read_file(p if os.path.exists(p) else os.path.join(data_dir, f"{split}.csv"), columns)
@@ -0,0 +1,106 @@
+﻿# -*- coding: utf-8 -*-
+"""
+model_registry.py — registro versionado de modelos servidos por el API
+- models/registry/<version>/  model.joblib + manifest.json
+  manifest: version, model_path, features, threshold, sha256, created_at (+ extras: reporte, params)
+- models/registry/current.json  {"version": ...}: la versión que sirve el API (lo vigila api/registry.py)
+- El manifest se escribe al final y current.json se reemplaza atómicamente: una versión a medio
+  copiar nunca queda publicada
+Uso:
+  python .\\src\\model_registry.py --list
+  python .\\src\\model_registry.py --promote 20250101_120000     (rollback / promoción manual)
+"""
+
+from __future__ import annotations
+import os, json, shutil, hashlib, argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+REGISTRY_DIR = os.getenv("MODEL_REGISTRY") or os.path.join(ROOT, "models", "registry")
+CURRENT_FILE = "current.json"
+MANIFEST_FILE = "manifest.json"
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def _write_json_atomic(path: str, obj: Any) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+def publish(model_path: str, features: List[str], threshold: float, registry_dir: str = REGISTRY_DIR,
+            version: Optional[str] = None, promote: bool = True, extra: Optional[Dict[str, Any]] = None) -> str:
+    """Copia el modelo a una versión nueva, escribe su manifest y (por defecto) la deja como actual."""
+    version = version or datetime.now().strftime("%Y%m%d_%H%M%S")
+    vdir = os.path.join(registry_dir, version)
+    os.makedirs(vdir, exist_ok=False)
+    dst = os.path.join(vdir, "model.joblib")
+    shutil.copy2(model_path, dst)
+    manifest = {
+        "version": version,
+        "model_path": "model.joblib",
+        "features": list(features),
+        "threshold": float(threshold),
+        "sha256": file_sha256(dst),
+        "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        **(extra or {}),
+    }
+    _write_json_atomic(os.path.join(vdir, MANIFEST_FILE), manifest)
+    if promote:
+        set_current(version, registry_dir)
+    return version
+
+def set_current(version: str, registry_dir: str = REGISTRY_DIR) -> None:
+    if not os.path.exists(os.path.join(registry_dir, version, MANIFEST_FILE)):
+        raise FileNotFoundError(f"La versión {version} no existe en {registry_dir}")
+    _write_json_atomic(os.path.join(registry_dir, CURRENT_FILE),
+                       {"version": version, "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")})
+
+def versions(registry_dir: str = REGISTRY_DIR) -> List[str]:
+    """Versiones completas (con manifest), de la más vieja a la más nueva."""
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(v for v in os.listdir(registry_dir)
+                  if os.path.exists(os.path.join(registry_dir, v, MANIFEST_FILE)))
+
+def current_version(registry_dir: str = REGISTRY_DIR) -> Optional[str]:
+    """Versión de current.json; sin puntero, la más nueva publicada; None si el registro está vacío."""
+    try:
+        with open(os.path.join(registry_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)["version"]
+    except (OSError, ValueError, KeyError):
+        vs = versions(registry_dir)
+        return vs[-1] if vs else None
+
+def read_manifest(version: str, registry_dir: str = REGISTRY_DIR) -> Dict[str, Any]:
+    vdir = os.path.join(registry_dir, version)
+    with open(os.path.join(vdir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        m = json.load(f)
+    m["model_path"] = os.path.join(vdir, m.get("model_path") or "model.joblib")
+    return m
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--registry", default=REGISTRY_DIR)
+    ap.add_argument("--list", action="store_true")
+    ap.add_argument("--promote", default=None, help="Versión a servir (el API la toma en caliente)")
+    args = ap.parse_args()
+
+    if args.promote:
+        set_current(args.promote, args.registry)
+        print(f"OK → versión actual: {args.promote}")
+    cur = current_version(args.registry)
+    if args.list or not args.promote:
+        for v in versions(args.registry):
+            m = read_manifest(v, args.registry)
+            print(f"{'*' if v == cur else ' '} {v}  thr={m['threshold']:.6f}  sha256={m['sha256'][:12]}  "
+                  f"features={len(m['features'])}")
+
+if __name__ == "__main__":
+    main()
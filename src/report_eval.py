@@ -3,21 +3,25 @@
 Compara último baseline_*.json vs último rf_*.json
 Genera reports/eval_*.md con deltas y banderas de aceptación.
 """
-import os, glob, json, datetime
+import os, sys, datetime
 
 ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)  # se ejecuta como script: python .\src\report_eval.py
+from src.artifacts import load_latest
+
 REPORTS = os.path.join(ROOT, "reports")
 
-def load_last(pattern):
-    paths = sorted(glob.glob(os.path.join(REPORTS, pattern)))
-    if not paths:
-        raise SystemExit(f"No se encontró {pattern} en {REPORTS}")
-    with open(paths[-1], "r", encoding="utf-8") as f:
-        return json.load(f), paths[-1]
+def load_last(kind):
+    # Vía reports/manifest.json (src/artifacts.py); glob solo si el manifest no lo tiene
+    found = load_latest(kind, REPORTS)
+    if found is None:
+        raise SystemExit(f"No se encontró {kind}_*.json en {REPORTS}")
+    return found
 
 def main():
-    base, base_p = load_last("baseline_*.json")
-    rf, rf_p = load_last("rf_*.json")
+    base, base_p = load_last("baseline")
+    rf, rf_p = load_last("rf")
 
     b = base["metrics"]
     r = rf["metrics"]["test"]
@@ -0,0 +1,212 @@
+﻿# -*- coding: utf-8 -*-
+"""
+rf_search.py — búsqueda de hiperparámetros del RandomForest sobre folds out-of-time (train_rf.py --search)
+- Folds rodantes (ventana creciente) sobre train + val ordenados por Time: el fold k es el prefijo
+  que llega hasta el (1 - (K-1-k)·h) del rango de Time, partido con split_out_of_time (data.py):
+  early (train + su val) para ajustar, late (el último h del rango) para evaluar. El test final
+  no se toca
+- Los datos ordenados van a un memmap float32 (X) + int8 (y) en disco; como los folds son
+  prefijos en el tiempo, el early y el late de cada fold son rebanadas contiguas de esos arrays:
+  los procesos del pool los abren con mmap_mode="r" y comparten las páginas, sin copias ni pickle
+- Candidatos = producto de la grilla (o --search-trials sorteados); ProcessPoolExecutor con
+  n_jobs = cpus // workers por bosque
+- Poda por successive halving a lo largo de los folds: tras cada fold (del más chico al más
+  grande) sigue solo el mejor 1/eta por PR-AUC medio; los podados no gastan folds grandes
+- Selección: PR-AUC medio en los folds (metrics.pr_auc) y, a igualdad, precision@k medio
+  (metrics.multi_k, primer k)
+- Salida: reports/rfsearch_<ts>_trials.jsonl (una línea por trial, se escribe a medida que
+  terminan) y reports/rfsearch_<ts>.json (folds, ranking, mejor; registrado en el manifest)
+"""
+
+from __future__ import annotations
+import os, json, math, time, random, itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from metrics import multi_k, pr_auc
+from data import split_out_of_time
+from src.artifacts import record
+
+GRID_KEYS = ("n_estimators", "max_depth", "min_samples_leaf", "max_features")
+
+def parse_value(v: str) -> Any:
+    """CLI -> valor de sklearn: none -> None, enteros, floats; el resto queda str (sqrt, log2)."""
+    if v.lower() == "none":
+        return None
+    try:
+        return int(v)
+    except ValueError:
+        pass
+    try:
+        return float(v)
+    except ValueError:
+        return v
+
+def candidates(grid: Dict[str, Sequence[Any]], trials: int = 0, random_state: int = 42) -> List[Dict[str, Any]]:
+    combos = [dict(zip(GRID_KEYS, c)) for c in itertools.product(*(grid[k] for k in GRID_KEYS))]
+    if 0 < trials < len(combos):
+        combos = random.Random(random_state).sample(combos, trials)
+    return combos
+
+# ---------- folds ----------
+def build_folds(X_parts: Sequence[np.ndarray], y_parts: Sequence[np.ndarray], time_col: int, n_folds: int,
+                horizon: float, workdir: str, random_state: int = 42,
+                batch_rows: int = 1 << 18) -> Tuple[str, str, List[Dict[str, Any]]]:
+    """
+    Concatena las partes ordenadas por Time en workdir/X.npy, y.npy y devuelve los folds como
+    rebanadas [0, fit_end) / [fit_end, end).
+    """
+    t = np.concatenate([np.asarray(X[:, time_col], dtype=np.float64) for X in X_parts])
+    y_all = np.concatenate([np.asarray(y, dtype=np.int8) for y in y_parts])
+    order = np.argsort(t, kind="stable")
+    n, f = len(order), X_parts[0].shape[1]
+    offsets = np.cumsum([0] + [len(X) for X in X_parts])
+
+    x_path, y_path = os.path.join(workdir, "X.npy"), os.path.join(workdir, "y.npy")
+    X = np.lib.format.open_memmap(x_path, mode="w+", dtype=np.float32, shape=(n, f))
+    for i in range(0, n, batch_rows):
+        idx = order[i:i + batch_rows]
+        part = np.searchsorted(offsets, idx, side="right") - 1
+        block = np.empty((len(idx), f), dtype=np.float32)
+        for p in np.unique(part):
+            m = part == p
+            block[m] = X_parts[p][idx[m] - offsets[p]]
+        X[i:i + len(idx)] = block
+    X.flush()
+    del X
+    np.save(y_path, y_all[order])
+    t, y_sorted = t[order], y_all[order]
+
+    folds: List[Dict[str, Any]] = []
+    t_min, t_max = float(t[0]), float(t[-1])
+    for k in range(n_folds):
+        end_frac = 1.0 - (n_folds - 1 - k) * horizon
+        if end_frac <= 0 or horizon / end_frac >= 0.9:
+            raise ValueError(f"--folds {n_folds} con --fold-horizon {horizon}: el fold {k} queda sin early")
+        end = int(np.searchsorted(t, t_min + (t_max - t_min) * end_frac, side="right"))
+        # split_out_of_time decide el cutoff (y lo corre si late queda sin positivos); con los datos
+        # ordenados early = train ∪ val es el prefijo [0, fit_end)
+        light = pd.DataFrame({"Time": t[:end], "Class": y_sorted[:end]})
+        tr, va, te = split_out_of_time(light, horizon / end_frac, 0.1, random_state)
+        fit_end = len(tr) + len(va)
+        folds.append({"fold": k, "fit_rows": fit_end, "eval_rows": end - fit_end,
+                      "fit_positives": int(y_sorted[:fit_end].sum()),
+                      "eval_positives": int(y_sorted[fit_end:end].sum()),
+                      "eval_from_time": float(te["Time"].min()) if len(te) else None,
+                      "slices": [0, fit_end, end]})
+    return x_path, y_path, folds
+
+# ---------- trials (en los procesos del pool) ----------
+_X: Optional[np.ndarray] = None
+_y: Optional[np.ndarray] = None
+_threads = 1
+
+def _init_worker(x_path: str, y_path: str, threads: int) -> None:
+    global _X, _y, _threads
+    _X = np.load(x_path, mmap_mode="r")
+    _y = np.load(y_path, mmap_mode="r")
+    _threads = threads
+
+def _trial(params: Dict[str, Any], fold: Dict[str, Any], ks: List[int], random_state: int) -> Dict[str, Any]:
+    a, b, c = fold["slices"]
+    clf = RandomForestClassifier(**params, n_jobs=_threads, class_weight="balanced", random_state=random_state)
+    t0 = time.perf_counter()
+    clf.fit(_X[a:b], np.asarray(_y[a:b]))
+    fit_s = time.perf_counter() - t0
+    y_ev = np.asarray(_y[b:c])
+    s = clf.predict_proba(_X[b:c])[:, 1] if len(clf.classes_) > 1 else np.zeros(c - b)
+    return {"params": params, "fold": fold["fold"], "pr_auc": pr_auc(y_ev, s), "by_k": multi_k(y_ev, s, ks),
+            "fit_s": round(fit_s, 3), "eval_s": round(time.perf_counter() - t0 - fit_s, 3)}
+
+# ---------- búsqueda ----------
+def _key(params: Dict[str, Any]) -> str:
+    return json.dumps(params, sort_keys=True)
+
+def _rank(scores: Dict[str, List[Dict[str, Any]]], k0: str) -> List[Tuple[str, float, float]]:
+    """(clave, PR-AUC medio, precision@k0 medio), mejor primero."""
+    rows = [(key, float(np.mean([r["pr_auc"] for r in rs])),
+             float(np.mean([r["by_k"][k0]["precision_at_k"] for r in rs]))) for key, rs in scores.items()]
+    return sorted(rows, key=lambda r: (r[1], r[2]), reverse=True)
+
+def search(X_parts: Sequence[np.ndarray], y_parts: Sequence[np.ndarray], features: List[str],
+           grid: Dict[str, Sequence[Any]], ks: List[int], workdir: str, reports_dir: str = "reports",
+           n_folds: int = 3, horizon: float = 0.15, eta: int = 2, trials: int = 0,
+           workers: int = 0, random_state: int = 42) -> Dict[str, Any]:
+    """Corre la búsqueda y devuelve el resumen (con "best": params y "path": el reporte)."""
+    if "Time" not in features:
+        raise ValueError("La búsqueda out-of-time necesita la columna Time entre las features")
+    cands = candidates(grid, trials, random_state)
+    x_path, y_path, folds = build_folds(X_parts, y_parts, features.index("Time"), n_folds, horizon,
+                                        workdir, random_state)
+    cpus = os.cpu_count() or 1
+    workers = max(1, min(workers or cpus, len(cands)))
+    threads = max(1, cpus // workers)
+    k0 = str(ks[0])
+
+    os.makedirs(reports_dir, exist_ok=True)
+    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    trials_path = os.path.join(reports_dir, f"rfsearch_{ts}_trials.jsonl")
+    print(f"[SEARCH] {len(cands)} candidatos x {n_folds} folds (eta={eta}) | {workers} procesos x {threads} hilos")
+    for f in folds:
+        print(f"[SEARCH] fold {f['fold']}: fit={f['fit_rows']:,} ({f['fit_positives']} pos)  "
+              f"eval={f['eval_rows']:,} ({f['eval_positives']} pos)")
+
+    alive = {_key(p): p for p in cands}
+    scores: Dict[str, List[Dict[str, Any]]] = {k: [] for k in alive}
+    pruned: Dict[str, int] = {}
+    n_trials = 0
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(x_path, y_path, threads)) as pool, \
+         open(trials_path, "w", encoding="utf-8") as log:
+        for fold in folds:
+            futs = [pool.submit(_trial, p, fold, ks, random_state) for p in alive.values()]
+            for fut in as_completed(futs):
+                r = fut.result()
+                scores[_key(r["params"])].append(r)
+                n_trials += 1
+                log.write(json.dumps({"ts": time.time(), **r}, ensure_ascii=False) + "\n")
+                log.flush()
+            ranked = _rank({k: scores[k] for k in alive}, k0)
+            if fold is not folds[-1] and eta > 1:
+                keep = max(1, math.ceil(len(ranked) / eta))
+                for key, _, _ in ranked[keep:]:
+                    pruned[key] = fold["fold"]
+                    del alive[key]
+            best_key, best_auc, best_pk = ranked[0]
+            print(f"[SEARCH] fold {fold['fold']}: {len(futs)} trials | mejor PR-AUC medio={best_auc:.4f} "
+                  f"p@{k0}={best_pk:.4f} | siguen {len(alive)}")
+    duration = time.perf_counter() - t0
+
+    ranking = []
+    for key, auc, pk in _rank(scores, k0):
+        rs = scores[key]
+        ranking.append({"params": json.loads(key), "folds": len(rs), "pr_auc_mean": auc,
+                        f"precision_at_{k0}_mean": pk, "pruned_after_fold": pruned.get(key),
+                        "fit_s": round(sum(r["fit_s"] for r in rs), 3)})
+    # Solo compite quien llegó al último fold (los podados tienen medias sobre folds más chicos)
+    finalists = [r for r in ranking if r["pruned_after_fold"] is None]
+    best = finalists[0]
+    out = {
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "grid": {k: list(v) for k, v in grid.items()},
+        "candidates": len(cands), "trials": n_trials, "full_grid_trials": len(cands) * n_folds,
+        "folds": folds, "eta": eta, "workers": workers, "threads_per_worker": threads,
+        "duration_s": round(duration, 3),
+        "selection": {"metric": "pr_auc_mean", "tie_break": f"precision_at_{k0}_mean"},
+        "best": best["params"], "best_scores": best,
+        "ranking": ranking,
+        "trials_log": os.path.abspath(trials_path),
+    }
+    path = os.path.join(reports_dir, f"rfsearch_{ts}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False, indent=2)
+    record("rfsearch", path)
+    print(f"[SEARCH] {n_trials}/{len(cands) * n_folds} trials en {duration:.1f}s | mejor {best['params']} "
+          f"PR-AUC medio={best['pr_auc_mean']:.4f}")
+    return {**out, "path": path}
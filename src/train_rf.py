@@ -1,43 +1,107 @@
 ﻿# -*- coding: utf-8 -*-
 """
 train_rf.py — RandomForest con umbral optimizado en val (modo f1 o cost)
+- Features: una matriz float32 C-contigua mapeada a disco por split. Con el cache de data.py es
+  la de data/cache/<clave>/<split>/X_<hash>.npy (se arma una vez, sin DataFrames); sin cache se
+  lee el split y se vuelca a un memmap temporal, liberando el DataFrame. sklearn la usa tal cual
+  (ya es float32 C-contigua) y los workers de joblib del bosque la comparten sin copiarla
+- Tiempo y pico de RSS por etapa (carga, fit, predict, ...) en consola y en reports/rf_*.json
+- --search: antes del fit final elige n_estimators / max_depth / min_samples_leaf / max_features
+  con folds out-of-time rodantes sobre train + val (src/rf_search.py: pool de procesos sobre
+  memmaps compartidos, poda por successive halving, trials en reports/rfsearch_*); el modelo
+  final se entrena con el mejor y el umbral se elige en val como siempre
 Uso:
   python .\\src\\train_rf.py --data-dir .\\data\\processed --k 100 500 --th-mode f1 --n-estimators 200 --max-depth 16
+  python .\\src\\train_rf.py --data-dir .\\data\\processed --search --folds 3 --grid-max-depth 8 16 none --grid-min-samples-leaf 1 5 20
 """
 
 from __future__ import annotations
-import os, sys, json, math, argparse
+import os, sys, json, math, time, atexit, shutil, argparse, tempfile
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Tuple, Dict
+from typing import Any, List, Optional, Tuple, Dict
 
 import numpy as np
-import pandas as pd
 from joblib import dump
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import precision_recall_curve, average_precision_score
 from metrics import multi_k, pr_auc, f1_fraud
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)  # se ejecuta como script: python .\src\train_rf.py
+from src.artifacts import record
+from model_registry import publish
+from dataset_cache import load_columns, matrix, read_meta, read_split, resolve
+import rf_search
 
 import matplotlib
 matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 
-def _read_any(path: str) -> pd.DataFrame:
-    ext = os.path.splitext(path)[1].lower()
-    if ext == ".parquet":
-        try:
-            import pyarrow  # noqa
-            return pd.read_parquet(path)
-        except Exception:
-            return pd.read_csv(path)
-    return pd.read_csv(path)
-
-def _features_and_target(df: pd.DataFrame) -> Tuple[pd.DataFrame, np.ndarray]:
-    cols = [c for c in df.columns if c != "Class"]
-    X = df[cols].astype("float32")
-    y = df["Class"].astype("int8").values
-    return X, y
-
-def _predict_scores(clf, X: pd.DataFrame) -> np.ndarray:
+def _rss_mb(field: str) -> Optional[float]:
+    """VmRSS (actual) o VmHWM (pico) de /proc/self/status en MB; fuera de Linux ru_maxrss / None."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    if field != "VmHWM":
+        return None
+    try:
+        import resource  # máximo histórico del proceso (no se puede reiniciar por etapa)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / (1024.0 * 1024.0 if sys.platform == "darwin" else 1024.0)
+    except ImportError:
+        return None
+
+def _reset_peak_rss() -> None:
+    """En Linux, escribir 5 en clear_refs reinicia VmHWM: el pico queda medido por etapa."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+class _Stages:
+    """Segundos, RSS al terminar y pico de RSS de cada etapa del entrenamiento."""
+
+    def __init__(self):
+        self.items: Dict[str, Dict[str, Any]] = {}
+
+    @contextmanager
+    def __call__(self, name: str):
+        _reset_peak_rss()
+        t0 = time.perf_counter()
+        yield
+        d = {"s": round(time.perf_counter() - t0, 3), "rss_mb": _rss_mb("VmRSS"), "peak_rss_mb": _rss_mb("VmHWM")}
+        self.items[name] = d
+        mb = lambda v: "n/a" if v is None else f"{v:.0f}MB"
+        print(f"[RF] {name:<12} {d['s']:>8.2f}s  rss={mb(d['rss_mb'])}  pico={mb(d['peak_rss_mb'])}", flush=True)
+
+def _load_xy(data_dir: str, split: str, features: Optional[List[str]], tmpdir: str) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """(X float32 C-contigua en disco, y int8, features) de un split; features=None -> todas menos Class."""
+    hit = resolve(data_dir, split)
+    if hit is not None:
+        if features is None:
+            features = [c for c in read_meta(hit[0])["columns"] if c != "Class"]
+        y = np.array(load_columns(*hit, ["Class"])["Class"], dtype=np.int8)
+        return matrix(*hit, features), y, features
+    df = read_split(data_dir, split)
+    if features is None:
+        features = [c for c in df.columns if c != "Class"]
+    X = np.lib.format.open_memmap(os.path.join(tmpdir, f"{split}_X.npy"), mode="w+", dtype=np.float32,
+                                  shape=(len(df), len(features)))
+    for j, c in enumerate(features):  # columna a columna: nunca hay una segunda copia entera del split
+        X[:, j] = df[c].to_numpy(dtype=np.float32)
+    y = df["Class"].to_numpy(dtype=np.int8)
+    del df
+    X.flush()
+    del X
+    return np.load(os.path.join(tmpdir, f"{split}_X.npy"), mmap_mode="r"), y, features
+
+def _predict_scores(clf, X: np.ndarray) -> np.ndarray:
     if hasattr(clf, "predict_proba"):
         return clf.predict_proba(X)[:, 1].astype("float64")
     if hasattr(clf, "decision_function"):
@@ -97,35 +161,62 @@ def main():
     ap.add_argument("--fn-cost", type=float, default=5.0)
     ap.add_argument("--fp-cost", type=float, default=1.0)
     ap.add_argument("--n-estimators", type=int, default=200)
-    ap.add_argument("--max-depth", type=int, default=16)
+    ap.add_argument("--max-depth", type=rf_search.parse_value, default=16)
+    ap.add_argument("--min-samples-leaf", type=int, default=1)
+    ap.add_argument("--max-features", type=rf_search.parse_value, default="sqrt")
     ap.add_argument("--random-state", type=int, default=42)
+    ap.add_argument("--search", action="store_true", help="Elegir hiperparámetros con folds out-of-time antes del fit final")
+    ap.add_argument("--folds", type=int, default=3)
+    ap.add_argument("--fold-horizon", type=float, default=0.15, help="Fracción del rango de Time evaluada en cada fold")
+    ap.add_argument("--search-eta", type=int, default=2, help="Tras cada fold sigue el mejor 1/eta (1 = sin poda)")
+    ap.add_argument("--search-trials", type=int, default=0, help="Candidatos sorteados de la grilla (0 = toda)")
+    ap.add_argument("--search-workers", type=int, default=0, help="Procesos del pool (0 = cpus)")
+    ap.add_argument("--grid-n-estimators", nargs="+", type=int, default=[100, 200, 400])
+    ap.add_argument("--grid-max-depth", nargs="+", type=rf_search.parse_value, default=[8, 16, None])
+    ap.add_argument("--grid-min-samples-leaf", nargs="+", type=int, default=[1, 5, 20])
+    ap.add_argument("--grid-max-features", nargs="+", type=rf_search.parse_value, default=["sqrt", 0.5])
     args = ap.parse_args()
 
-    # Paths (parquet preferido, csv fallback)
-    p_train = os.path.join(args.data_dir, "train.parquet")
-    p_val   = os.path.join(args.data_dir, "val.parquet")
-    p_test  = os.path.join(args.data_dir, "test.parquet")
-    if not os.path.exists(p_train): p_train = os.path.join(args.data_dir, "train.csv")
-    if not os.path.exists(p_val):   p_val   = os.path.join(args.data_dir, "val.csv")
-    if not os.path.exists(p_test):  p_test  = os.path.join(args.data_dir, "test.csv")
+    # Cache de data.py (columnas .npy mapeadas) si data-dir tiene cache.json; si no parquet, csv fallback
+    hit = resolve(args.data_dir, "train")
+    print(f"[RF] Leyendo: {hit[0] + ' (cache)' if hit else args.data_dir}")
+    stage = _Stages()
+    tmpdir = tempfile.mkdtemp(prefix="train_rf_")  # memmaps sin cache; se borra al salir (ya sin mapear)
+    atexit.register(shutil.rmtree, tmpdir, True)
+    with stage("load_train"):
+        X_tr, y_tr, features = _load_xy(args.data_dir, "train", None, tmpdir)
+    with stage("load_val"):
+        X_va, y_va, _ = _load_xy(args.data_dir, "val", features, tmpdir)
+    with stage("load_test"):
+        X_te, y_te, _ = _load_xy(args.data_dir, "test", features, tmpdir)
 
-    print(f"[RF] Leyendo: {p_train}, {p_val}, {p_test}")
-    train = _read_any(p_train); val = _read_any(p_val); test = _read_any(p_test)
-    X_tr, y_tr = _features_and_target(train)
-    X_va, y_va = _features_and_target(val)
-    X_te, y_te = _features_and_target(test)
+    search = None
+    if args.search:
+        grid = {"n_estimators": args.grid_n_estimators, "max_depth": args.grid_max_depth,
+                "min_samples_leaf": args.grid_min_samples_leaf, "max_features": args.grid_max_features}
+        with stage("search"):
+            search = rf_search.search([X_tr, X_va], [y_tr, y_va], features, grid, args.k, tmpdir, "reports",
+                                      n_folds=args.folds, horizon=args.fold_horizon, eta=args.search_eta,
+                                      trials=args.search_trials, workers=args.search_workers,
+                                      random_state=args.random_state)
+        for k, v in search["best"].items():
+            setattr(args, k, v)
 
     clf = RandomForestClassifier(
         n_estimators=args.n_estimators,
         max_depth=args.max_depth,
+        min_samples_leaf=args.min_samples_leaf,
+        max_features=args.max_features,
         n_jobs=-1,
         class_weight="balanced",
         random_state=args.random_state,
     )
-    clf.fit(X_tr, y_tr)
-
-    s_va = _predict_scores(clf, X_va)
-    s_te = _predict_scores(clf, X_te)
+    with stage("fit"):
+        clf.fit(X_tr, y_tr)
+    with stage("predict_val"):
+        s_va = _predict_scores(clf, X_va)
+    with stage("predict_test"):
+        s_te = _predict_scores(clf, X_te)
 
     if args.th_mode == "f1":
         thr, f1_best = _best_threshold_f1(y_va, s_va)
@@ -143,9 +234,10 @@ def main():
     os.makedirs("models", exist_ok=True)
     os.makedirs("reports", exist_ok=True)
 
-    dump(clf, os.path.join("models","model.joblib"))
+    with stage("dump"):
+        dump(clf, os.path.join("models","model.joblib"))
     with open(os.path.join("models","features.json"), "w", encoding="utf-8") as f:
-        json.dump({"features": list(X_tr.columns)}, f, ensure_ascii=False, indent=2)
+        json.dump({"features": features}, f, ensure_ascii=False, indent=2)
 
     pr_path = os.path.join("reports","pr_curve.png")
     _plot_pr_curve(y_te, s_te, pr_path)
@@ -157,11 +249,16 @@ def main():
         "params": {
             "n_estimators": args.n_estimators,
             "max_depth": args.max_depth,
+            "min_samples_leaf": args.min_samples_leaf,
+            "max_features": args.max_features,
             "class_weight": "balanced",
             "random_state": args.random_state
         },
         "threshold": {"value": thr, **th_info},
+        "search": os.path.abspath(search["path"]) if search else None,
         "metrics": {"val": rep_val, "test": rep_te},
+        "rows": {"train": int(len(y_tr)), "val": int(len(y_va)), "test": int(len(y_te))},
+        "stages": stage.items,
         "artifacts": {
             "model_path": os.path.abspath(os.path.join("models","model.joblib")),
             "features_path": os.path.abspath(os.path.join("models","features.json")),
@@ -171,6 +268,10 @@ def main():
     outp = os.path.join("reports", f"rf_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
     with open(outp, "w", encoding="utf-8") as f:
         json.dump(out, f, ensure_ascii=False, indent=2)
+    record("rf", outp)  # reports/manifest.json -> último rf
+    # Nueva versión en models/registry/: el API la carga y la intercambia en caliente
+    version = publish(os.path.join("models","model.joblib"), features, thr,
+                      extra={"report": os.path.abspath(outp), "params": out["params"]})
 
     print(f"OK → modelo guardado en models/model.joblib")
     print(f"Umbral seleccionado: {thr:.6f}  (modo={th_info['mode']})")
@@ -181,6 +282,7 @@ def main():
     for k, d in rep_te["by_k"].items():
         print(f"Test k={k:>5}: precision@k={d['precision_at_k']:.4f}  recall@k={d['recall_at_k']:.4f}")
     print(f"Reporte: {outp}")
+    print(f"Registro: models/registry/{version} (actual)")
 
 if __name__ == "__main__":
-    main()
+    main()